@@ -1,4 +1,5 @@
 import requests
+import httpx
 
 from dotenv import load_dotenv
 import os
@@ -13,89 +14,171 @@ class AtomaAPI:
         assert atoma_api_token !=None, "No atoma bearer found in .env"
         self.atoma_api_token = atoma_api_token
 
-        print('Initializing models list...', end='')
-        self.models_list = self.get_models_list()
-        print('done.')
+        # One long lived sdk with pooled keep-alive connections, instead of a new
+        # http client (and TLS handshake) per request.
+        # Not used as a context manager: AtomaSDK.__exit__ closes its http clients.
+        pool_size = int(os.getenv('ATOMA_POOL_SIZE', 20))
+        limits = httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=float(os.getenv('ATOMA_KEEPALIVE_SECONDS', 60)),
+        )
+        timeout_seconds = float(os.getenv('ATOMA_TIMEOUT', 120))
+        timeout = httpx.Timeout(timeout_seconds, connect=min(10.0, timeout_seconds))
+        self.client = httpx.Client(limits=limits, timeout=timeout)
+        self.async_client = httpx.AsyncClient(limits=limits, timeout=timeout)
+        self.atoma_sdk = AtomaSDK(
+            bearer_auth=self.atoma_api_token,
+            client=self.client,
+            async_client=self.async_client,
+            timeout_ms=int(timeout_seconds * 1000),
+        )
+
+        # Filled by get_models_list / get_models_list_async (the app refreshes it in the
+        # background, see llm/model_registry.py) so construction does no network calls.
+        self.models_list = []
     
     def get_models_list(self):
         atoma_models = []
         try:
-            with AtomaSDK(
-                bearer_auth=self.atoma_api_token,
-            ) as atoma_sdk:
-                res = atoma_sdk.models_.models_list()
-                # Handle response
-                # print(res)
-                for model in res.data:
-                    atoma_models.append(model.id)
-                return atoma_models
-                # print(atoma_models)
+            res = self.atoma_sdk.models_.models_list()
+            # Handle response
+            # print(res)
+            for model in res.data:
+                atoma_models.append(model.id)
+            self.models_list = atoma_models
+            return atoma_models
+            # print(atoma_models)
         except Exception as ex:
             print(ex)
             return []
 
+    async def get_models_list_async(self):
+        res = await self.atoma_sdk.models_.models_list_async()
+        self.models_list = [model.id for model in res.data]
+        return self.models_list
+
     async def query_atoma_async(self, query, model_name, max_tokens=None, exclude_thinking_text=True):
         try:
-            async with AtomaSDK(  # Use async with
-                bearer_auth=self.atoma_api_token,
-            ) as atoma_sdk:
-                res = await atoma_sdk.chat.create_async(  # Use create_async and await
-                    messages=[
-                        {
-                            "content": query,
-                            "role": "user",
-                        },
-                    ],
-                    model=model_name,
-                    frequency_penalty=0,
-                    max_tokens=max_tokens,
-                    n=1,
-                    presence_penalty=0,
-                    seed=123,
-                    stop=[
-                        "json([\"stop\", \"halt\"])",
-                    ],
-                    temperature=0.7,
-                    top_p=1,
-                    user="user-1234"
-                )
-
-                # deepseek r1 have option to include thinking text
-                if 'r1' in model_name and exclude_thinking_text:
-                    # Remove thinking text from r1 model
-                    return res.choices[0].message.content.split('</think>')[-1].strip()
-
-                # llm response without any modifications.
-                return res.choices[0].message.content
+            res = await self.atoma_sdk.chat.create_async(  # Use create_async and await
+                messages=[
+                    {
+                        "content": query,
+                        "role": "user",
+                    },
+                ],
+                model=model_name,
+                frequency_penalty=0,
+                max_tokens=max_tokens,
+                n=1,
+                presence_penalty=0,
+                seed=123,
+                stop=[
+                    "json([\"stop\", \"halt\"])",
+                ],
+                temperature=0.7,
+                top_p=1,
+                user="user-1234"
+            )
+
+            # deepseek r1 have option to include thinking text
+            if 'r1' in model_name and exclude_thinking_text:
+                # Remove thinking text from r1 model
+                return res.choices[0].message.content.split('</think>')[-1].strip()
+
+            # llm response without any modifications.
+            return res.choices[0].message.content
         except Exception as ex:
             print(f' error query llm: {ex}')
             return f"error query llm: {ex}"
 
-    def query_atoma(self, query, model_name, max_tokens=None, exclude_thinking_text=True):
+    async def query_atoma_stream(self, query, model_name, max_tokens=None, exclude_thinking_text=True):
+        '''
+        Async generator yielding the completion text as it arrives.
+        For r1 models the thinking text is held back until </think> when exclude_thinking_text is set.
+        '''
         try:
-            with AtomaSDK(
-                bearer_auth=self.atoma_api_token,
-            ) as atoma_sdk:
-                res = atoma_sdk.chat.create(messages=[
+            stream = await self.atoma_sdk.chat.create_stream_async(
+                messages=[
                     {
                         "content": query,
                         "role": "user",
                     },
-                ], model=model_name, frequency_penalty=0, max_tokens=max_tokens, n=1, presence_penalty=0, seed=123, stop=[
+                ],
+                model=model_name,
+                frequency_penalty=0,
+                max_tokens=max_tokens,
+                n=1,
+                presence_penalty=0,
+                seed=123,
+                stop=[
                     "json([\"stop\", \"halt\"])",
-                ], temperature=0.7, top_p=1, user="user-1234")
-                
-                # deepseek r1 have option to include thinking text
-                if 'r1' in model_name and not exclude_thinking_text:
-                    # Remove thinking text from r1 model
-                    return res.choices[0].message.content.split('</think>')[-1].strip()
-                
-                # llm response without any modifications.
-                return res.choices[0].message.content
+                ],
+                temperature=0.7,
+                top_p=1,
+                user="user-1234"
+            )
+
+            skip_thinking = 'r1' in model_name and exclude_thinking_text
+            thinking_text = ''
+            async with stream:
+                async for event in stream:
+                    if not event.data.choices:
+                        continue
+                    content = event.data.choices[0].delta.content
+                    if not isinstance(content, str) or not content:
+                        continue
+
+                    if skip_thinking:
+                        thinking_text += content
+                        if '</think>' not in thinking_text:
+                            continue
+                        skip_thinking = False
+                        content = thinking_text.split('</think>')[-1].lstrip()
+                        if not content:
+                            continue
+
+                    yield content
+
+            # model never closed its thinking block, same as the non streaming split
+            if skip_thinking and thinking_text:
+                yield thinking_text.strip()
+        except Exception as ex:
+            print(f' error query llm: {ex}')
+            yield f"error query llm: {ex}"
+
+    def query_atoma(self, query, model_name, max_tokens=None, exclude_thinking_text=True):
+        try:
+            res = self.atoma_sdk.chat.create(messages=[
+                {
+                    "content": query,
+                    "role": "user",
+                },
+            ], model=model_name, frequency_penalty=0, max_tokens=max_tokens, n=1, presence_penalty=0, seed=123, stop=[
+                "json([\"stop\", \"halt\"])",
+            ], temperature=0.7, top_p=1, user="user-1234")
+            
+            # deepseek r1 have option to include thinking text
+            if 'r1' in model_name and not exclude_thinking_text:
+                # Remove thinking text from r1 model
+                return res.choices[0].message.content.split('</think>')[-1].strip()
+            
+            # llm response without any modifications.
+            return res.choices[0].message.content
         except Exception as ex:
             print(f' error query llm: {ex}')
             return f"error query llm: {ex}"
 
+    def close(self):
+        self.client.close()
+
+    async def aclose(self):
+        """
+        Close the pooled connections; called on app shutdown.
+        """
+        await self.async_client.aclose()
+        self.client.close()
+
 
 if __name__ == "__main__":
     # Test if above class works as expected
@@ -103,7 +186,7 @@ if __name__ == "__main__":
     atoma_api = AtomaAPI()
     
     # list models
-    print(f'models list: {atoma_api.models_list}')
+    print(f'models list: {atoma_api.get_models_list()}')
     
     # normal request
     response = atoma_api.query_atoma('hi!','neuralmagic/DeepSeek-R1-Distill-Llama-70B-FP8-dynamic')
@@ -0,0 +1,166 @@
+import io
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+# Default sqlite file: the backend's data directory, whatever directory the server starts from
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "caption_cache.sqlite3")
+
+
+def perceptual_hash(image_bytes: bytes, hash_size: int = 8) -> Optional[int]:
+    """
+    64 bit difference hash (dHash): compares neighbouring pixels of a small grayscale
+    thumbnail, so re-encoded or resized copies of an image hash within a few bits of each
+    other. Returns None if the bytes are not an image Pillow can read.
+    """
+    from PIL import Image
+
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        image.draft("L", (hash_size * 8, hash_size * 8))
+        pixels = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR).tobytes()
+    except Exception:
+        return None
+
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+class CaptionCache:
+    """
+    Persistent cache of image captions.
+
+    Captions are keyed by (sha256 of the image bytes, prompt, model) and stored in a local
+    sqlite file, LRU-evicted past max_entries. With phash_distance set, an exact miss falls
+    back to the cached caption (same prompt and model) of the image whose perceptual hash
+    differs in at most that many bits, so resized or re-encoded copies hit too.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: Optional[int] = None, phash_distance: Optional[int] = None):
+        """
+        Args:
+            path: sqlite file, "" keeps the cache in memory only (default: CAPTION_CACHE_PATH or data/caption_cache.sqlite3 in the backend directory)
+            max_entries: Max cached captions (default: CAPTION_CACHE_MAX_ENTRIES or 10000)
+            phash_distance: Max differing perceptual hash bits for a near-duplicate hit, -1 disables (default: CAPTION_CACHE_PHASH_DISTANCE or -1)
+        """
+        load_dotenv()
+
+        self.path = path if path is not None else os.getenv("CAPTION_CACHE_PATH", DEFAULT_CACHE_PATH)
+        self.max_entries = int(max_entries or os.getenv("CAPTION_CACHE_MAX_ENTRIES", 10000))
+        self.phash_distance = int(phash_distance if phash_distance is not None else os.getenv("CAPTION_CACHE_PHASH_DISTANCE", -1))
+
+        self._lock = threading.Lock()
+        if self.path and os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._db = sqlite3.connect(self.path or ":memory:", check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS captions ("
+            " key TEXT PRIMARY KEY, scope TEXT NOT NULL, phash INTEGER, caption TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS captions_last_used ON captions (last_used)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS captions_scope ON captions (scope)")
+        self._db.commit()
+
+        self.hits = 0
+        self.near_duplicate_hits = 0
+        self.misses = 0
+
+    @property
+    def perceptual(self) -> bool:
+        return self.phash_distance >= 0
+
+    @staticmethod
+    def make_scope(prompt: str, model_name: str) -> str:
+        return hashlib.sha256(f"{model_name}\0{prompt}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _key(scope: str, image_bytes: bytes) -> str:
+        return f"{scope}:{hashlib.sha256(image_bytes).hexdigest()}"
+
+    @staticmethod
+    def _to_sqlite(phash: Optional[int]) -> Optional[int]:
+        # sqlite integers are signed 64 bit
+        return phash - (1 << 64) if phash is not None and phash >= 1 << 63 else phash
+
+    def get(self, image_bytes: bytes, prompt: str, model_name: str) -> Tuple[Optional[str], Optional[int]]:
+        """
+        Return (cached caption or None, perceptual hash). The hash is only computed on an
+        exact miss in perceptual mode; pass it on to put() so it isn't computed twice.
+        Blocking (hashing and sqlite), call it off the event loop.
+        """
+        scope = self.make_scope(prompt, model_name)
+        key = self._key(scope, image_bytes)
+
+        with self._lock:
+            row = self._db.execute("SELECT caption FROM captions WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._touch(key)
+                self.hits += 1
+                return row[0], None
+
+        phash = perceptual_hash(image_bytes) if self.perceptual else None
+        with self._lock:
+            if phash is not None:
+                best = None
+                for other_key, other_phash, caption in self._db.execute("SELECT key, phash, caption FROM captions WHERE scope = ? AND phash IS NOT NULL", (scope,)):
+                    distance = ((other_phash & ((1 << 64) - 1)) ^ phash).bit_count()
+                    if distance <= self.phash_distance and (best is None or distance < best[0]):
+                        best = (distance, other_key, caption)
+                if best is not None:
+                    self._touch(best[1])
+                    self.hits += 1
+                    self.near_duplicate_hits += 1
+                    return best[2], phash
+
+            self.misses += 1
+            return None, phash
+
+    def _touch(self, key: str):
+        self._db.execute("UPDATE captions SET last_used = ? WHERE key = ?", (time.time(), key))
+        self._db.commit()
+
+    def put(self, image_bytes: bytes, prompt: str, model_name: str, caption: str, phash: Optional[int] = None):
+        """
+        Store a caption (blocking). Errors returned by the vision helpers must not be stored.
+        """
+        scope = self.make_scope(prompt, model_name)
+        if phash is None and self.perceptual:
+            phash = perceptual_hash(image_bytes)
+
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO captions (key, scope, phash, caption, last_used) VALUES (?, ?, ?, ?, ?)",
+                (self._key(scope, image_bytes), scope, self._to_sqlite(phash), caption, time.time()),
+            )
+            self._db.execute(
+                "DELETE FROM captions WHERE key IN (SELECT key FROM captions ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM captions").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "hits": self.hits,
+                "near_duplicate_hits": self.near_duplicate_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "path": self.path or None,
+            }
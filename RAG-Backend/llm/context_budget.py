@@ -0,0 +1,219 @@
+import os
+import json
+import threading
+from itertools import islice
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from vector_db.chunking import APPROX_TOKEN_PATTERN
+
+# Shortest shared text treated as chunk overlap rather than coincidence.
+MIN_OVERLAP_CHARS = 32
+
+# Tokens spent on the "[n] " label and blank line around every document.
+SEPARATOR_TOKENS = 4
+
+
+def overlap_length(left: str, right: str, min_chars: int = MIN_OVERLAP_CHARS) -> int:
+    """
+    Length of the longest suffix of left that is also a prefix of right (0 if shorter than
+    min_chars). Consecutive chunks of the same document share such an overlap.
+    """
+    probe = right[:min_chars]
+    if len(probe) < min_chars:
+        return 0
+    start = left.find(probe, max(0, len(left) - len(right)))
+    while start != -1:
+        if right.startswith(left[start:]):
+            return len(left) - start
+        start = left.find(probe, start + 1)
+    return 0
+
+
+def shingles(text: str, size: int = 3) -> set:
+    words = text.lower().split()
+    return {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+
+class ContextBudgeter:
+    """
+    Assembles the retrieved documents into the prompt context.
+
+    Documents are deduplicated (exact and contained copies and near duplicates are dropped,
+    text shared with an overlap-split sibling is trimmed), optionally reranked with a local
+    cross-encoder, then packed best-first into the model's token budget.
+    """
+
+    _rerankers: Dict[str, Any] = {}
+    _rerankers_lock = threading.Lock()
+
+    def __init__(self, default_budget: Optional[int] = None, model_budgets: Optional[Dict[str, int]] = None, rerank_model: Optional[str] = None, dedup_similarity: Optional[float] = None):
+        """
+        Args:
+            default_budget: Context tokens for models without their own budget (default: CONTEXT_TOKEN_BUDGET or 6000)
+            model_budgets: Per model budgets (default: CONTEXT_TOKEN_BUDGETS, a json object, e.g. {"gpt-4o-mini": 16000})
+            rerank_model: sentence-transformers cross-encoder used when reranking (default: RERANK_MODEL or cross-encoder/ms-marco-MiniLM-L-6-v2)
+            dedup_similarity: Word 3-gram jaccard similarity above which a document counts as a duplicate (default: CONTEXT_DEDUP_SIMILARITY or 0.8)
+        """
+        load_dotenv()
+
+        self.default_budget = int(default_budget or os.getenv("CONTEXT_TOKEN_BUDGET", 6000))
+        self.model_budgets = model_budgets if model_budgets is not None else json.loads(os.getenv("CONTEXT_TOKEN_BUDGETS") or "{}")
+        self.rerank_model = rerank_model or os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+        self.dedup_similarity = float(dedup_similarity if dedup_similarity is not None else os.getenv("CONTEXT_DEDUP_SIMILARITY", 0.8))
+
+        self._encodings: Dict[Optional[str], Any] = {}
+
+    def budget_for(self, model_name: Optional[str]) -> int:
+        return int(self.model_budgets.get(model_name, self.default_budget))
+
+    def _encoding(self, model_name: Optional[str]):
+        """
+        tiktoken encoding for the model if tiktoken is installed, else None (approximate counts).
+        """
+        if model_name not in self._encodings:
+            try:
+                import tiktoken
+                try:
+                    self._encodings[model_name] = tiktoken.encoding_for_model(model_name or "")
+                except KeyError:
+                    self._encodings[model_name] = tiktoken.get_encoding("o200k_base")
+            except ImportError:
+                self._encodings[model_name] = None
+        return self._encodings[model_name]
+
+    def count_tokens(self, text: str, model_name: Optional[str] = None) -> int:
+        encoding = self._encoding(model_name)
+        if encoding is None:
+            # words and punctuation, close to BPE counts for english text
+            return sum(1 for _ in APPROX_TOKEN_PATTERN.finditer(text))
+        return len(encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int, model_name: Optional[str] = None) -> str:
+        """
+        Longest prefix of text cut at token boundaries that counts at most max_tokens.
+        """
+        encoding = self._encoding(model_name)
+        limit = max_tokens
+        while limit > 0:
+            if encoding is None:
+                ends = [match.end() for match in islice(APPROX_TOKEN_PATTERN.finditer(text), limit)]
+                truncated = text[:ends[-1]] if ends else ""
+            else:
+                # decoding a cut can merge into different tokens, so the result is re-counted
+                truncated = encoding.decode(encoding.encode(text, disallowed_special=())[:limit])
+            overflow = self.count_tokens(truncated, model_name) - max_tokens
+            if overflow <= 0:
+                return truncated
+            limit -= overflow
+        return ""
+
+    def dedupe(self, documents: List[str]) -> List[str]:
+        """
+        Drop duplicate / contained / near-duplicate documents and trim text already present
+        in a better ranked overlap sibling. Keeps the order of the input.
+        """
+        kept: List[str] = []
+        kept_normalized: List[str] = []
+        kept_shingles: List[set] = []
+
+        for text in documents:
+            text = text.strip()
+            normalized = " ".join(text.split()).lower()
+            if not normalized or any(normalized in other for other in kept_normalized):
+                continue
+
+            untrimmed_length = len(text)
+            for other in kept:
+                shared = overlap_length(other, text)
+                if shared:
+                    text = text[shared:].lstrip()
+                shared = overlap_length(text, other)
+                if shared:
+                    text = text[:len(text) - shared].rstrip()
+            # only a trimmed document can be reduced to a meaningless leftover; short documents stay
+            if len(text) < untrimmed_length and len(text) < MIN_OVERLAP_CHARS:
+                continue
+
+            text_shingles = shingles(text)
+            if any(len(text_shingles & other) / len(text_shingles | other) >= self.dedup_similarity for other in kept_shingles):
+                continue
+
+            # a lower ranked document containing a kept one replaces it in place
+            normalized = " ".join(text.split()).lower()
+            contained = [i for i, other in enumerate(kept_normalized) if other in normalized]
+            if contained:
+                index = contained[0]
+                for i in reversed(contained[1:]):
+                    del kept[i], kept_normalized[i], kept_shingles[i]
+                kept[index], kept_normalized[index], kept_shingles[index] = text, normalized, text_shingles
+                continue
+
+            kept.append(text)
+            kept_normalized.append(normalized)
+            kept_shingles.append(text_shingles)
+        return kept
+
+    def _reranker(self):
+        with self._rerankers_lock:
+            if self.rerank_model not in self._rerankers:
+                from sentence_transformers import CrossEncoder
+                self._rerankers[self.rerank_model] = CrossEncoder(self.rerank_model)
+            return self._rerankers[self.rerank_model]
+
+    def rerank(self, query: str, documents: List[str]) -> Tuple[List[str], bool]:
+        """
+        Order documents by cross-encoder relevance to the query. Returns (documents, reranked);
+        the input order is kept if the model can't be loaded.
+        """
+        if len(documents) < 2:
+            return documents, False
+        try:
+            scores = self._reranker().predict([(query, document) for document in documents])
+        except Exception as ex:
+            print(f'could not rerank with {self.rerank_model}, keeping vector order: {ex}')
+            return documents, False
+        order = sorted(range(len(documents)), key=lambda i: -float(scores[i]))
+        return [documents[i] for i in order], True
+
+    def pack(self, documents: List[str], budget: int, model_name: Optional[str] = None) -> Tuple[List[str], int]:
+        """
+        Take documents in order while they fit in the budget, skipping those that don't.
+        If not even the first fits, a copy of it truncated to the budget is used.
+        """
+        used, tokens = [], 0
+        for document in documents:
+            document_tokens = self.count_tokens(document, model_name) + SEPARATOR_TOKENS
+            if tokens + document_tokens <= budget:
+                used.append(document)
+                tokens += document_tokens
+
+        if not used and documents and budget > SEPARATOR_TOKENS:
+            document = self.truncate(documents[0], budget - SEPARATOR_TOKENS, model_name)
+            used, tokens = [document], self.count_tokens(document, model_name) + SEPARATOR_TOKENS
+        return used, tokens
+
+    def build(self, query: str, documents: List[str], model_name: Optional[str] = None, rerank: bool = False) -> Dict[str, Any]:
+        """
+        Dedupe, (optionally) rerank and pack documents. Blocking, call it off the event loop.
+        Returns the context text plus what was used, for reporting.
+        """
+        unique = self.dedupe(documents)
+        reranked = False
+        if rerank:
+            unique, reranked = self.rerank(query, unique)
+
+        budget = self.budget_for(model_name)
+        used, tokens = self.pack(unique, budget, model_name)
+        return {
+            "context": "\n\n".join(f"[{i}] {document}" for i, document in enumerate(used, start=1)),
+            "documents": used,
+            "stats": {
+                "documents_after_dedupe": len(unique),
+                "documents_used": len(used),
+                "context_tokens": tokens,
+                "token_budget": budget,
+                "reranked": reranked,
+            },
+        }
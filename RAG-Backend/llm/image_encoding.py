@@ -0,0 +1,80 @@
+import io
+import os
+import base64
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# Formats the vision api accepts as is.
+SUPPORTED_FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+
+# EXIF orientation tag; values 5 to 8 mean the stored image is rotated by 90 degrees.
+EXIF_ORIENTATION = 0x0112
+
+
+def target_size(width: int, height: int, max_side: int, max_short_side: int) -> Tuple[int, int]:
+    """
+    Size the vision model actually looks at: fit within max_side x max_side, then
+    shrink until the short side is at most max_short_side (OpenAI's high detail
+    preprocessing). Never upscales.
+    """
+    scale = min(1.0, max_side / max(width, height))
+    if min(width, height) * scale > max_short_side:
+        scale = max_short_side / min(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def prepare_image(image_bytes: bytes, downscale: Optional[bool] = None, max_side: Optional[int] = None, max_short_side: Optional[int] = None, jpeg_quality: Optional[int] = None) -> Tuple[bytes, str]:
+    """
+    Return (image bytes, mime type) ready to send to the vision model.
+
+    Images larger than the model's working resolution are downscaled, images with an EXIF
+    orientation are rotated upright (phone photos), and formats the api doesn't accept are
+    re-encoded, with Pillow. Anything else (or anything Pillow can't read) is passed through
+    untouched. CPU bound, call it off the event loop.
+
+    Args:
+        downscale: Resize / re-encode at all (default: IMAGE_DOWNSCALE or true)
+        max_side: Max width and height (default: IMAGE_MAX_SIDE or 2048)
+        max_short_side: Max length of the shorter side (default: IMAGE_MAX_SHORT_SIDE or 768)
+        jpeg_quality: Quality of re-encoded jpegs (default: IMAGE_JPEG_QUALITY or 85)
+    """
+    if downscale is None:
+        downscale = os.getenv("IMAGE_DOWNSCALE", "true").lower() in ("1", "true", "yes")
+    if not downscale:
+        return image_bytes, "image/jpeg"
+
+    max_side = int(max_side or os.getenv("IMAGE_MAX_SIDE", 2048))
+    max_short_side = int(max_short_side or os.getenv("IMAGE_MAX_SHORT_SIDE", 768))
+    jpeg_quality = int(jpeg_quality or os.getenv("IMAGE_JPEG_QUALITY", 85))
+
+    from PIL import Image, ImageOps
+
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+        rotated = orientation in (5, 6, 7, 8)
+        width, height = (image.height, image.width) if rotated else image.size
+        size = target_size(width, height, max_side, max_short_side)
+        animated = getattr(image, "is_animated", False)
+        if image.format in SUPPORTED_FORMATS and (animated or (orientation == 1 and size == (width, height))):
+            return image_bytes, SUPPORTED_FORMATS[image.format]
+
+        image.draft("RGB", (size[1], size[0]) if rotated else size)  # lets jpeg decode straight at a reduced scale
+        # upright before resizing, the re-encoded image has no orientation tag
+        image = ImageOps.exif_transpose(image)
+        image = image.resize(size, Image.LANCZOS) if image.size != size else image
+        output = io.BytesIO()
+        if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+            image.save(output, format="PNG", optimize=True)
+            return output.getvalue(), "image/png"
+        image.convert("RGB").save(output, format="JPEG", quality=jpeg_quality, optimize=True)
+        return output.getvalue(), "image/jpeg"
+    except Exception as ex:
+        print(f'could not preprocess image, sending it as is: {ex}')
+        return image_bytes, "image/jpeg"
+
+
+def to_data_url(image_bytes: bytes, mime_type: str = "image/jpeg") -> str:
+    return f"data:{mime_type};base64,{base64.b64encode(image_bytes).decode('ascii')}"
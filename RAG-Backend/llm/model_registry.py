@@ -0,0 +1,128 @@
+import os
+import time
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+
+class ModelRegistry:
+    """
+    TTL-cached lists of the models each LLM provider serves.
+
+    The lists are fetched concurrently in a background task (first right after startup,
+    then every ttl seconds), so the app starts accepting requests without waiting on the
+    providers. A failed or slow provider keeps its last known list and is retried on the
+    next refresh.
+    """
+
+    def __init__(self, fetchers: Dict[str, Callable[[], Awaitable[List[str]]]], ttl: Optional[float] = None, fetch_timeout: Optional[float] = None):
+        """
+        Args:
+            fetchers: Provider name -> coroutine function returning the provider's model ids.
+                Earlier providers win when several serve the same model id.
+            ttl: Seconds between refreshes (default: MODEL_LIST_TTL or 600)
+            fetch_timeout: Max seconds per provider fetch (default: MODEL_LIST_TIMEOUT or 10)
+        """
+        load_dotenv()
+
+        self.fetchers = fetchers
+        self.ttl = float(ttl or os.getenv("MODEL_LIST_TTL", 600))
+        self.fetch_timeout = float(fetch_timeout or os.getenv("MODEL_LIST_TIMEOUT", 10))
+
+        self.models: Dict[str, List[str]] = {provider: [] for provider in fetchers}
+        self.fetched_at: Dict[str, Optional[float]] = {provider: None for provider in fetchers}
+        self.errors: Dict[str, Optional[str]] = {provider: None for provider in fetchers}
+
+        self._ready: Optional[asyncio.Event] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._refresh_lock: Optional[asyncio.Lock] = None
+
+    async def start(self):
+        """
+        Start the background refresh loop; returns immediately.
+        """
+        if self._refresh_task is not None:
+            return
+        self._ready = asyncio.Event()
+        self._refresh_lock = asyncio.Lock()
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def aclose(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+            self._refresh_task = None
+
+    async def _refresh_loop(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.ttl)
+
+    async def refresh(self) -> Dict[str, Optional[str]]:
+        """
+        Fetch every provider's list concurrently. Returns the errors per provider (None if fetched).
+        """
+        if self._refresh_lock is None:
+            raise RuntimeError("Model registry is not started")
+        async with self._refresh_lock:
+            providers = list(self.fetchers)
+            results = await asyncio.gather(*(self._fetch(provider) for provider in providers), return_exceptions=True)
+            for provider, result in zip(providers, results):
+                if isinstance(result, asyncio.TimeoutError):
+                    self.errors[provider] = f"timed out after {self.fetch_timeout}s"
+                elif isinstance(result, BaseException):
+                    self.errors[provider] = f"{type(result).__name__}: {result}"
+                elif not result:
+                    # providers report failures as an empty list
+                    self.errors[provider] = "no models returned"
+                else:
+                    self.models[provider] = list(result)
+                    self.fetched_at[provider] = time.time()
+                    self.errors[provider] = None
+                if self.errors[provider]:
+                    print(f'could not fetch {provider} models list, keeping {len(self.models[provider])} known models: {self.errors[provider]}')
+            self._ready.set()
+            return dict(self.errors)
+
+    async def _fetch(self, provider: str) -> List[str]:
+        # creating the provider (lazily, by the fetcher) may fail too, e.g. on a missing api key
+        return await asyncio.wait_for(self.fetchers[provider](), self.fetch_timeout)
+
+    @property
+    def ready(self) -> bool:
+        """Whether the first refresh has finished (successfully or not)."""
+        return self._ready is not None and self._ready.is_set()
+
+    async def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for the first refresh, at most timeout seconds (default: fetch_timeout).
+        """
+        if self._ready is None:
+            return False
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout if timeout is not None else self.fetch_timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.ready
+
+    def provider_for(self, model_name: Optional[str]) -> Optional[str]:
+        for provider, models in self.models.items():
+            if model_name in models:
+                return provider
+        return None
+
+    def status(self) -> Dict:
+        now = time.time()
+        return {
+            "ready": self.ready,
+            "ttl": self.ttl,
+            "providers": {
+                provider: {
+                    "models": len(self.models[provider]),
+                    "age_seconds": round(now - self.fetched_at[provider], 1) if self.fetched_at[provider] else None,
+                    "error": self.errors[provider],
+                }
+                for provider in self.fetchers
+            },
+        }
@@ -0,0 +1,158 @@
+import os
+import time
+import random
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from vector_db.chunking import APPROX_TOKEN_PATTERN
+
+# Prompt size buckets (approximate tokens): latency grows with the prompt, so models are
+# compared on requests of similar size.
+PROMPT_BUCKETS = ((1000, "small"), (8000, "medium"), (float("inf"), "large"))
+
+
+def approx_tokens(text: str) -> int:
+    return sum(1 for _ in APPROX_TOKEN_PATTERN.finditer(text or ""))
+
+
+def prompt_bucket(prompt_tokens: int) -> str:
+    for limit, name in PROMPT_BUCKETS:
+        if prompt_tokens < limit:
+            return name
+    return PROMPT_BUCKETS[-1][1]
+
+
+class ModelStats:
+    """
+    Rolling per-model performance: exponentially weighted latency (overall and per prompt
+    size bucket), output tokens per second and error rate, plus a window of recent
+    latencies for percentiles. Used to hedge slow requests and to pick a model for "auto".
+    """
+
+    def __init__(self, alpha: Optional[float] = None, latency_window: Optional[int] = None, max_error_rate: Optional[float] = None, explore_rate: Optional[float] = None, retry_after: Optional[float] = None):
+        """
+        Args:
+            alpha: Weight of the newest sample in the moving averages (default: MODEL_STATS_ALPHA or 0.2)
+            latency_window: Recent latencies kept per model (default: LLM_LATENCY_WINDOW or 200)
+            max_error_rate: Error rate above which a model counts as unhealthy (default: AUTO_MAX_ERROR_RATE or 0.2)
+            explore_rate: Share of "auto" requests sent to a candidate without samples yet (default: AUTO_EXPLORE_RATE or 0.05)
+            retry_after: Seconds after its last error an unhealthy model is given another chance (default: AUTO_RETRY_SECONDS or 60)
+        """
+        load_dotenv()
+
+        self.alpha = float(alpha if alpha is not None else os.getenv("MODEL_STATS_ALPHA", 0.2))
+        self.latency_window = int(latency_window if latency_window is not None else os.getenv("LLM_LATENCY_WINDOW", 200))
+        self.max_error_rate = float(max_error_rate if max_error_rate is not None else os.getenv("AUTO_MAX_ERROR_RATE", 0.2))
+        self.explore_rate = float(explore_rate if explore_rate is not None else os.getenv("AUTO_EXPLORE_RATE", 0.05))
+        self.retry_after = float(retry_after if retry_after is not None else os.getenv("AUTO_RETRY_SECONDS", 60))
+
+        self._models: Dict[str, Dict] = {}
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def _ewma(self, current: Optional[float], sample: float) -> float:
+        return sample if current is None else self.alpha * sample + (1 - self.alpha) * current
+
+    def _entry(self, model_name: str) -> Dict:
+        if model_name not in self._models:
+            self._models[model_name] = {
+                "requests": 0,
+                "errors": 0,
+                "error_rate": 0.0,
+                "latency_ewma": None,
+                "bucket_latency_ewma": {},
+                "tokens_per_second_ewma": None,
+                "last_error": None,
+                "last_error_at": None,
+            }
+            self._latencies[model_name] = deque(maxlen=self.latency_window)
+        return self._models[model_name]
+
+    def record(self, model_name: str, seconds: float, prompt_tokens: int = 0, output_tokens: int = 0, error: Optional[str] = None):
+        """
+        Record one finished request. Failed requests only count towards the error rate.
+        """
+        with self._lock:
+            entry = self._entry(model_name)
+            entry["requests"] += 1
+            entry["error_rate"] = self._ewma(entry["error_rate"] if entry["requests"] > 1 else None, 1.0 if error else 0.0)
+            if error:
+                entry["errors"] += 1
+                entry["last_error"] = error[:200]
+                entry["last_error_at"] = time.time()
+                return
+
+            entry["latency_ewma"] = self._ewma(entry["latency_ewma"], seconds)
+            bucket = prompt_bucket(prompt_tokens)
+            entry["bucket_latency_ewma"][bucket] = self._ewma(entry["bucket_latency_ewma"].get(bucket), seconds)
+            if output_tokens and seconds > 0:
+                entry["tokens_per_second_ewma"] = self._ewma(entry["tokens_per_second_ewma"], output_tokens / seconds)
+            self._latencies[model_name].append(seconds)
+
+    def record_cancelled(self, model_name: str, seconds: float):
+        """
+        Record a request cancelled after seconds (e.g. the loser of a hedge). Its latency is
+        at least that, so it counts towards the percentiles; the moving averages only take
+        finished requests.
+        """
+        with self._lock:
+            self._entry(model_name)
+            self._latencies[model_name].append(seconds)
+
+    def latency_percentile(self, model_name: str, q: float, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            if len(self._latencies.get(model_name, ())) < max(1, min_samples):
+                return None
+            return self._percentile_unlocked(model_name, q)
+
+    def healthy(self, model_name: str) -> bool:
+        entry = self._models.get(model_name)
+        if entry is None or entry["error_rate"] <= self.max_error_rate:
+            return True
+        # no traffic goes to an unhealthy model, so its error rate can't recover on its own
+        return time.time() - entry["last_error_at"] > self.retry_after
+
+    def expected_latency(self, model_name: str, prompt_tokens: int) -> Optional[float]:
+        entry = self._models.get(model_name)
+        if entry is None:
+            return None
+        return entry["bucket_latency_ewma"].get(prompt_bucket(prompt_tokens), entry["latency_ewma"])
+
+    def pick(self, candidates: List[str], prompt_tokens: int) -> Optional[str]:
+        """
+        Fastest healthy candidate for a prompt of this size. Candidates without samples are
+        tried now and then (explore_rate) so they get measured; if every candidate is
+        unhealthy the one with the lowest error rate is used.
+        """
+        if not candidates:
+            return None
+        with self._lock:
+            unmeasured = [model for model in candidates if self.expected_latency(model, prompt_tokens) is None and self.healthy(model)]
+            measured = [model for model in candidates if self.expected_latency(model, prompt_tokens) is not None and self.healthy(model)]
+            if unmeasured and (not measured or random.random() < self.explore_rate):
+                return unmeasured[0]
+            if measured:
+                return min(measured, key=lambda model: self.expected_latency(model, prompt_tokens))
+            return min(candidates, key=lambda model: self._models[model]["error_rate"])
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {
+                model: {
+                    **{key: value for key, value in entry.items() if key != "bucket_latency_ewma"},
+                    "latency_ewma_by_prompt_size": dict(entry["bucket_latency_ewma"]),
+                    "p50_latency": self._percentile_unlocked(model, 50),
+                    "p95_latency": self._percentile_unlocked(model, 95),
+                    "healthy": self.healthy(model),
+                }
+                for model, entry in self._models.items()
+            }
+
+    def _percentile_unlocked(self, model_name: str, q: float) -> Optional[float]:
+        samples = sorted(self._latencies.get(model_name, ()))
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(round(q / 100 * (len(samples) - 1))))]
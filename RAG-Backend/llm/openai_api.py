@@ -1,11 +1,14 @@
 import requests
 import base64
+import asyncio
 
 from dotenv import load_dotenv
 import os
 load_dotenv()
 
-from openai import OpenAI, AsyncOpenAI, models
+from openai import OpenAI, AsyncOpenAI
+
+from .image_encoding import prepare_image, to_data_url
 
 class OpenaiAPI:
     def __init__(self):
@@ -15,23 +18,34 @@ class OpenaiAPI:
         
         self.openai_client = OpenAI(api_key=openai_api_key)
         self.openai_client_async = AsyncOpenAI(api_key=openai_api_key)
+
+        # Vision calls are slow; bound how many run at once and how long each may take
+        # so a burst of image captioning can't starve chat requests.
+        self.vision_timeout = float(os.getenv('VISION_TIMEOUT', 60))
+        self.vision_semaphore = asyncio.Semaphore(int(os.getenv('VISION_MAX_CONCURRENCY', 4)))
         
-        print('Initializing models list...', end='')
-        self.models_list = self.get_models_list()
-        print('done.')
+        # Filled by get_models_list / get_models_list_async (the app refreshes it in the
+        # background, see llm/model_registry.py) so construction does no network calls.
+        self.models_list = []
 
     def get_models_list(self):
         models_list = []
         
         try:
-            res = models.list()
+            res = self.openai_client.models.list()
             for model in res.data:
                     models_list.append(model.id)
         except Exception as ex:
             print(ex)
         
+        self.models_list = models_list or self.models_list
         return models_list
 
+    async def get_models_list_async(self):
+        res = await self.openai_client_async.models.list()
+        self.models_list = [model.id for model in res.data]
+        return self.models_list
+
     
     def query_openai(self, query, model_name):
         try:
@@ -108,6 +122,61 @@ class OpenaiAPI:
         except Exception as e:
             return f"Error: {str(e)}"
     
+    async def describe_image_async(self, image_url, query, model_name):
+        '''
+        Caption an image given as a url or a data url, without blocking the event loop.
+        At most VISION_MAX_CONCURRENCY calls run at once; each may take VISION_TIMEOUT seconds.
+        '''
+        try:
+            async with self.vision_semaphore:
+                response = await asyncio.wait_for(
+                    self.openai_client_async.responses.create(
+                        model=model_name,
+                        input=[{
+                            "role": "user",
+                            "content": [
+                                {"type": "input_text", "text": query},
+                                {
+                                    "type": "input_image",
+                                    "image_url": image_url,
+                                },
+                            ],
+                        }],
+                    ),
+                    timeout=self.vision_timeout,
+                )
+            return response.output_text
+        except asyncio.TimeoutError:
+            return f"Error: image description timed out after {self.vision_timeout:g}s"
+        except Exception as e:
+            return f"Error: {str(e)}"
+
+    async def get_image_description_from_url_async(self, image_url, query, model_name):
+        print(f'generating image response from url.')
+        return await self.describe_image_async(image_url, query, model_name)
+
+    async def get_image_description_from_bytes_async(self, image_bytes, query, model_name):
+        '''
+        Caption an image held in memory: downscaled / re-encoded if needed and sent as a data url.
+        '''
+        print(f'generating image response from bytes.')
+        try:
+            image_url = await asyncio.to_thread(lambda: to_data_url(*prepare_image(image_bytes)))
+        except Exception as e:
+            return f"Error: {str(e)}"
+        return await self.describe_image_async(image_url, query, model_name)
+
+    async def get_image_description_from_path_async(self, image_path, query, model_name):
+        def read_image(image_path):
+            with open(image_path, "rb") as image_file:
+                return image_file.read()
+
+        try:
+            image_bytes = await asyncio.to_thread(read_image, image_path)
+        except Exception as e:
+            return f"Error: {str(e)}"
+        return await self.get_image_description_from_bytes_async(image_bytes, query, model_name)
+
     async def query_openai_async(self, query, model_name, max_tokens=None):
         try:
             print(f'one of gpt models. using {model_name} model')
@@ -127,13 +196,37 @@ class OpenaiAPI:
             print(f'Error in query_openai: {e}')
             return f"Error: {str(e)}"
 
+    async def query_openai_stream(self, query, model_name, max_tokens=None):
+        '''
+        Async generator yielding the completion text as it arrives.
+        '''
+        try:
+            print(f'one of gpt models. streaming with {model_name} model')
+            stream = await self.openai_client_async.chat.completions.create(
+                model=model_name,
+                messages=[
+                    {"role": "system", "content": "You are a helpful assistant."},
+                    {
+                        "role": "user",
+                        "content": query
+                    }
+                ],
+                stream=True
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            print(f'Error in query_openai_stream: {e}')
+            yield f"Error: {str(e)}"
+
 if __name__ == "__main__":
     # Test if above class works as expected
     
     openai_api = OpenaiAPI()
     
     # list models
-    print(f'models list: {openai_api.models_list}')
+    print(f'models list: {openai_api.get_models_list()}')
     
     # normal request
     response = openai_api.query_openai_async('hi!','gpt-4-0613')
@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from .model_stats import ModelStats, approx_tokens
+from services.metrics import current_collection, LLM_SECONDS, LLM_TTFT_SECONDS, LLM_TOKENS, LLM_FALLBACK_ANSWERS, ERRORS
+
+logger = logging.getLogger("rag.llm")
+
+
+def is_error_response(response) -> bool:
+    """The llm helpers return errors as strings; those must never be cached or served when a fallback can answer."""
+    return isinstance(response, str) and response.lower().startswith(("error:", "error query llm"))
+
+
+class ProviderRouter:
+    """
+    Sends a query along the model's fallback chain.
+
+    The first model is asked first. If it answers with an error the next model in the chain
+    is tried. With hedging on (off by default), if the current model hasn't answered within the hedge
+    percentile of its recent latencies, the next model is asked in parallel; the first good
+    answer wins and the other request is cancelled.
+    """
+
+    def __init__(self, call: Callable[[str, str, Optional[int]], Awaitable[str]], fallbacks: Optional[Dict[str, List[str]]] = None, hedge_percentile: Optional[float] = None, hedge_min_samples: Optional[int] = None, model_stats: Optional[ModelStats] = None):
+        """
+        Args:
+            call: Coroutine function (model_name, query, max_tokens) -> response text or error string
+            fallbacks: Model -> models to fall back to, in order; "*" applies to models without their own
+                chain (default: LLM_FALLBACKS, a json object, or {"*": ["gpt-4o-mini"]})
+            hedge_percentile: Latency percentile of the current model after which the next model is asked too,
+                0 disables hedging (default: LLM_HEDGE_PERCENTILE or 0)
+            hedge_min_samples: Latencies recorded per model before it is hedged (default: LLM_HEDGE_MIN_SAMPLES or 20)
+            model_stats: Where latencies and errors are recorded (a new ModelStats if not given)
+        """
+        load_dotenv()
+
+        self.call = call
+        self.fallbacks = fallbacks if fallbacks is not None else json.loads(os.getenv("LLM_FALLBACKS") or '{"*": ["gpt-4o-mini"]}')
+        self.hedge_percentile = float(hedge_percentile if hedge_percentile is not None else os.getenv("LLM_HEDGE_PERCENTILE", 0))
+        self.hedge_min_samples = int(hedge_min_samples if hedge_min_samples is not None else os.getenv("LLM_HEDGE_MIN_SAMPLES", 20))
+        self.model_stats = model_stats or ModelStats()
+
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    def chain_for(self, model_name: str) -> List[str]:
+        chain = [model_name] + list(self.fallbacks.get(model_name, self.fallbacks.get("*", [])))
+        return list(dict.fromkeys(chain))
+
+    def hedge_delay(self, model_name: str) -> Optional[float]:
+        """
+        Seconds to wait for model_name before hedging, None if hedging is off or there are too few samples.
+        """
+        if self.hedge_percentile <= 0:
+            return None
+        return self.model_stats.latency_percentile(model_name, self.hedge_percentile, self.hedge_min_samples)
+
+    async def _timed_call(self, model_name: str, query: str, max_tokens: Optional[int]) -> str:
+        start = time.perf_counter()
+        try:
+            response = await self.call(model_name, query, max_tokens)
+        except asyncio.CancelledError:
+            # a cancelled (hedge losing) request would have taken at least this long
+            self.model_stats.record_cancelled(model_name, time.perf_counter() - start)
+            raise
+        except Exception as ex:
+            response = f"Error: {ex}"
+        seconds = time.perf_counter() - start
+        error = response if is_error_response(response) else None
+        prompt_tokens, output_tokens = approx_tokens(query), 0 if error else approx_tokens(response)
+        self.model_stats.record(model_name, seconds, prompt_tokens, output_tokens, error)
+        self._record_metrics(model_name, seconds, prompt_tokens, output_tokens, error)
+        return response
+
+    def _record_metrics(self, model_name: str, seconds: float, prompt_tokens: int, output_tokens: int, error: Optional[str] = None):
+        collection = current_collection.get()
+        LLM_SECONDS.observe(seconds, model=model_name, collection=collection)
+        LLM_TOKENS.inc(prompt_tokens, model=model_name, collection=collection, type="prompt")
+        LLM_TOKENS.inc(output_tokens, model=model_name, collection=collection, type="completion")
+        if error:
+            ERRORS.inc(stage="llm", model=model_name, collection=collection)
+
+    def _answered_by(self, requested: str, model: str):
+        if model != requested:
+            LLM_FALLBACK_ANSWERS.inc(model=requested, answered_by=model)
+            logger.info("answered by %s instead of %s", model, requested)
+
+    async def query(self, query: str, model_name: str, max_tokens: Optional[int] = None) -> Tuple[str, str]:
+        """
+        Answer from the first model of the chain that answers without an error.
+        Returns (response, model that answered); the last error and model tried if every model failed.
+        """
+        chain = self.chain_for(model_name)
+        pending: Dict[asyncio.Task, str] = {}
+        next_index = 0
+        last_error, last_model = None, model_name
+        hedge_task = None
+
+        def launch():
+            nonlocal next_index
+            task = asyncio.create_task(self._timed_call(chain[next_index], query, max_tokens))
+            pending[task] = chain[next_index]
+            next_index += 1
+            return task
+
+        launch()
+        started = time.perf_counter()
+        try:
+            while pending:
+                timeout = None
+                if hedge_task is None and len(pending) == 1 and next_index < len(chain):
+                    delay = self.hedge_delay(pending[next(iter(pending))])
+                    if delay is not None:
+                        timeout = max(0.0, delay - (time.perf_counter() - started))
+
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.hedges += 1
+                    hedge_task = launch()
+                    continue
+
+                for task in done:
+                    model = pending.pop(task)
+                    response = task.result()
+                    if not is_error_response(response):
+                        if task is hedge_task and pending:
+                            self.hedge_wins += 1
+                        self._answered_by(chain[0], model)
+                        return response, model
+                    logger.warning("%s failed: %s", model, response[:200])
+                    last_error, last_model = response, model
+
+                if not pending and next_index < len(chain):
+                    self.failovers += 1
+                    started = time.perf_counter()
+                    launch()
+            return last_error, last_model
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    async def stream(self, query: str, model_name: str, open_stream: Callable[[str, str, Optional[int]], AsyncIterator[str]], max_tokens: Optional[int] = None, on_model: Optional[Callable[[str], None]] = None) -> AsyncIterator[str]:
+        """
+        Stream from the first model of the chain whose stream doesn't start with an error.
+        No hedging: once tokens were sent to the client the answer can't switch models.
+        on_model is called with the model streaming the answer before its first chunk is yielded.
+        """
+        chain = self.chain_for(model_name)
+        prompt_tokens = approx_tokens(query)
+        for index, model in enumerate(chain):
+            start = time.perf_counter()
+            stream = open_stream(model, query, max_tokens)
+            first = None
+            async for first in stream:
+                break
+            if first is None:
+                return
+            if is_error_response(first):
+                self.model_stats.record(model, time.perf_counter() - start, prompt_tokens, error=first)
+                self._record_metrics(model, time.perf_counter() - start, prompt_tokens, 0, first)
+                if index < len(chain) - 1:
+                    await stream.aclose()
+                    logger.warning("%s failed: %s, streaming from %s", model, first[:200], chain[index + 1])
+                    self.failovers += 1
+                    continue
+            else:
+                LLM_TTFT_SECONDS.observe(time.perf_counter() - start, model=model, collection=current_collection.get())
+                self._answered_by(chain[0], model)
+            if on_model is not None:
+                on_model(model)
+            yield first
+            output_tokens = approx_tokens(first)
+            async for text in stream:
+                output_tokens += approx_tokens(text)
+                yield text
+            if not is_error_response(first):
+                self.model_stats.record(model, time.perf_counter() - start, prompt_tokens, output_tokens)
+                self._record_metrics(model, time.perf_counter() - start, prompt_tokens, output_tokens)
+            return
+
+    def stats(self) -> Dict:
+        return {
+            "hedge_percentile": self.hedge_percentile,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+            "hedge_delay_seconds": {model: self.hedge_delay(model) for model in self.model_stats.snapshot()},
+        }
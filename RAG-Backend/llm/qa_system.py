@@ -1,5 +1,7 @@
+import os
 import json
-from typing import List, Dict
+import threading
+from typing import List, Dict, Optional, Tuple
 
 from typing import Union, List
 
@@ -12,24 +14,84 @@ load_dotenv()
 
 from .atoma_api import AtomaAPI
 from .openai_api import OpenaiAPI
+from .model_registry import ModelRegistry
+from .provider_router import ProviderRouter
+from .model_stats import ModelStats, approx_tokens
 
 class DocumentQA:
     _instance: "DocumentQA" = None
     
     def __init__(self, chunk_size: int = 10_000, overlap: int = 100):
         
-        # initialize openai api
-        self.openai_api = OpenaiAPI()
-        
-        # initialize atoma api
-        self.atoma_api = AtomaAPI()
+        # Providers are created on first use and their model lists are fetched in the
+        # background (start()), so constructing DocumentQA does no network calls.
+        self._openai_api: Optional[OpenaiAPI] = None
+        self._atoma_api: Optional[AtomaAPI] = None
+        self._providers_lock = threading.Lock()
+
+        self.model_registry = ModelRegistry({
+            "openai": lambda: self.openai_api.get_models_list_async(),
+            "atoma": lambda: self.atoma_api.get_models_list_async(),
+        })
 
-        self.atoma_models = self.atoma_api.models_list
-        self.openai_models = self.openai_api.models_list
+        # Fallback chains and hedging across models (LLM_FALLBACKS, LLM_HEDGE_PERCENTILE);
+        # the router records every request in model_stats, which routes model_name "auto"
+        self.model_stats = ModelStats()
+        self.router = ProviderRouter(self._query_model, model_stats=self.model_stats)
+        self.auto_models = [model.strip() for model in os.getenv("AUTO_MODELS", "gpt-4o-mini").split(",") if model.strip()]
         
         # Parameters for splitting documents
         self.chunk_size = chunk_size
         self.overlap = overlap
+
+    @property
+    def openai_api(self) -> OpenaiAPI:
+        if self._openai_api is None:
+            with self._providers_lock:
+                if self._openai_api is None:
+                    self._openai_api = OpenaiAPI()
+        return self._openai_api
+
+    @property
+    def atoma_api(self) -> AtomaAPI:
+        if self._atoma_api is None:
+            with self._providers_lock:
+                if self._atoma_api is None:
+                    self._atoma_api = AtomaAPI()
+        return self._atoma_api
+
+    @property
+    def openai_models(self) -> List[str]:
+        return self.model_registry.models["openai"]
+
+    @property
+    def atoma_models(self) -> List[str]:
+        return self.model_registry.models["atoma"]
+
+    async def start(self):
+        """
+        Start refreshing the providers' model lists in the background; called on app startup.
+        """
+        await self.model_registry.start()
+
+    async def aclose(self):
+        """
+        Stop the model list refresh and close the pooled provider connections; called on app shutdown.
+        """
+        await self.model_registry.aclose()
+        if self._atoma_api is not None:
+            await self._atoma_api.aclose()
+
+    async def provider_for(self, model_name: Optional[str]) -> Optional[str]:
+        """
+        Provider serving model_name. Right after startup the model lists may still be
+        loading; unknown models wait for the first refresh (bounded by MODEL_LIST_TIMEOUT).
+        """
+        provider = self.model_registry.provider_for(model_name)
+        if provider is None and not self.model_registry.ready:
+            await self.model_registry.wait_ready()
+            provider = self.model_registry.provider_for(model_name)
+        return provider
     
     def query_image(self, image_path=None, image_url=None, query="Please describe the image.", model_name="gpt-4o-mini"):
         if not image_path and not image_url:
@@ -42,6 +104,20 @@ class DocumentQA:
             response = self.openai_api.get_image_description_from_url(image_url, query, model_name)
             return response
 
+    async def aquery_image(self, image_path=None, image_url=None, image_bytes=None, query="Please describe the image.", model_name="gpt-4o-mini"):
+        """
+        Async query_image: the vision call runs on the async openai client with a timeout and concurrency limit.
+        image_bytes (e.g. an upload) is encoded in memory, without a temp file.
+        """
+        if image_bytes is not None:
+            return await self.openai_api.get_image_description_from_bytes_async(image_bytes, query, model_name)
+        if not image_path and not image_url:
+            raise ValueError("Please provide either image_path, image_url or image_bytes")
+
+        if image_path:
+            return await self.openai_api.get_image_description_from_path_async(image_path, query, model_name)
+        return await self.openai_api.get_image_description_from_url_async(image_url, query, model_name)
+
     # gpt-4o-mini is cheap model so using it as default.
     async def query_llm(self, query: str, max_tokens = None, model_name='gpt-4o-mini') -> str:
         """
@@ -55,17 +131,53 @@ class DocumentQA:
         # print(f'query: {query}')
         # query using deepseek r1 model
         #-------------------------------
-        if model_name in self.openai_api.models_list:
-            response = await self.openai_api.query_openai_async(query=query, model_name=model_name)
-            return response
-        
-        elif model_name in self.atoma_api.models_list:
-            response = await self.atoma_api.query_atoma_async(query=query, model_name=model_name, max_tokens=max_tokens)
-            return response
-        else:
-            print(f'Cant recognize model: {model_name}. Using Default model:gpt-4o model')
-            response = await self.openai_api.query_openai_async(query=query, model_name='gpt-4o-mini', max_tokens=max_tokens)
-            return response
+        response, _ = await self.query_llm_with_model(query=query, max_tokens=max_tokens, model_name=model_name)
+        return response
+
+    async def query_llm_with_model(self, query: str, max_tokens = None, model_name='gpt-4o-mini') -> Tuple[str, str]:
+        """
+        Same as query_llm, but returns (response, model that answered): a fallback model if the
+        requested one failed, the picked model for "auto".
+        """
+        model_name = await self.resolve_model(model_name, query)
+        return await self.router.query(query=query, model_name=model_name, max_tokens=max_tokens)
+    
+    async def stream_llm(self, query: str, max_tokens = None, model_name='gpt-4o-mini', on_model=None):
+        """
+        Same model routing as query_llm, but yields the response text as the provider streams it.
+        Falls back along the chain only while nothing has been streamed yet.
+        on_model is called with the model that streams the answer.
+        """
+        model_name = await self.resolve_model(model_name, query)
+        async for text in self.router.stream(query=query, model_name=model_name, open_stream=self._stream_model, max_tokens=max_tokens, on_model=on_model):
+            yield text
+
+    async def resolve_model(self, model_name: Optional[str], query: str = "") -> str:
+        """
+        Model to query: None and "auto" pick the fastest healthy AUTO_MODELS model for the
+        prompt's size from the observed stats; unknown models fall back to gpt-4o-mini.
+        """
+        if model_name is None or model_name == "auto":
+            # only models a provider currently serves, unless the lists aren't loaded
+            candidates = [model for model in self.auto_models if self.model_registry.provider_for(model)] or self.auto_models
+            return self.model_stats.pick(candidates, approx_tokens(query)) or 'gpt-4o-mini'
+        if await self.provider_for(model_name) is None:
+            print(f'Cant recognize model: {model_name}. Using Default model:gpt-4o-mini model')
+            return 'gpt-4o-mini'
+        return model_name
+
+    async def _query_model(self, model_name: str, query: str, max_tokens=None) -> str:
+        """
+        One request to the provider serving model_name (openai if it isn't in the model lists).
+        """
+        if await self.provider_for(model_name) == "atoma":
+            return await self.atoma_api.query_atoma_async(query=query, model_name=model_name, max_tokens=max_tokens)
+        return await self.openai_api.query_openai_async(query=query, model_name=model_name, max_tokens=max_tokens)
+
+    def _stream_model(self, model_name: str, query: str, max_tokens=None):
+        if self.model_registry.provider_for(model_name) == "atoma":
+            return self.atoma_api.query_atoma_stream(query=query, model_name=model_name, max_tokens=max_tokens)
+        return self.openai_api.query_openai_stream(query=query, model_name=model_name, max_tokens=max_tokens)
     
     def generate_questions(self, text: str, model_name='gpt-4o-mini') -> List[str]:
         """
@@ -0,0 +1,183 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+
+class ResponseCache:
+    """
+    Opt-in cache of chat responses.
+
+    Entries are scoped by (collection, metadata filter / retrieval params, model) and keyed on the
+    normalized query. With a similarity threshold set, a miss on the exact key falls back to the
+    cached entry in the same scope whose query embedding is closest, if it is close enough.
+    Entries expire after a TTL, are LRU-evicted past max_entries and are dropped whenever
+    their collection changes. Every change also bumps the collection's generation: an answer
+    whose retrieval started in an earlier generation is not cached, it may predate the change.
+    """
+
+    def __init__(self, ttl_seconds: Optional[float] = None, max_entries: Optional[int] = None, similarity_threshold: Optional[float] = None):
+        """
+        Args:
+            ttl_seconds: Entry lifetime (default: RESPONSE_CACHE_TTL or 3600)
+            max_entries: Max cached responses (default: RESPONSE_CACHE_MAX_ENTRIES or 1000)
+            similarity_threshold: Min cosine similarity for a semantic hit, 0 disables (default: RESPONSE_CACHE_SIMILARITY or 0)
+        """
+        load_dotenv()
+
+        self.ttl_seconds = float(ttl_seconds if ttl_seconds is not None else os.getenv("RESPONSE_CACHE_TTL", 3600))
+        self.max_entries = int(max_entries or os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 1000))
+        self.similarity_threshold = float(similarity_threshold if similarity_threshold is not None else os.getenv("RESPONSE_CACHE_SIMILARITY", 0))
+
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._scopes: Dict[str, set] = {}
+        self._collections: Dict[str, set] = {}
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+
+    @property
+    def semantic(self) -> bool:
+        return self.similarity_threshold > 0
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        query = re.sub(r"\s+", " ", query.strip().lower())
+        return query.rstrip("?!. ")
+
+    @staticmethod
+    def make_scope(collection_name: str, metadata_filter: Optional[Dict], model_name: Optional[str], **params) -> str:
+        """
+        Scope of an answer: everything except the query text that changes what the LLM sees.
+        """
+        return json.dumps([collection_name, metadata_filter, model_name, params], sort_keys=True, default=str)
+
+    @staticmethod
+    def _key(scope: str, normalized_query: str) -> str:
+        return hashlib.sha256(f"{scope}\0{normalized_query}".encode("utf-8")).hexdigest()
+
+    def get(self, scope: str, query: str, query_vector: Optional[List[float]] = None) -> Optional[Dict]:
+        """
+        Return the cached response for the query, or None.
+        """
+        normalized = self.normalize_query(query)
+        key = self._key(scope, normalized)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires_at"] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry["value"]
+            if entry is not None:
+                self._remove(key)
+
+            if self.semantic and query_vector is not None:
+                key = self._nearest(scope, query_vector, now)
+                if key is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self.semantic_hits += 1
+                    return self._entries[key]["value"]
+
+            self.misses += 1
+            return None
+
+    def _nearest(self, scope: str, query_vector: List[float], now: float) -> Optional[str]:
+        keys = [key for key in self._scopes.get(scope, ()) if self._entries[key]["vector"] is not None]
+        for key in [key for key in keys if self._entries[key]["expires_at"] <= now]:
+            self._remove(key)
+            keys.remove(key)
+        if not keys:
+            return None
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        similarities = np.stack([self._entries[key]["vector"] for key in keys]) @ query
+        best = int(np.argmax(similarities))
+        return keys[best] if similarities[best] >= self.similarity_threshold else None
+
+    def generation(self, collection_name: str) -> int:
+        """
+        Number of changes to the collection so far. Read it before retrieval and pass it to put.
+        """
+        with self._lock:
+            return self._generations.get(collection_name, 0)
+
+    def put(self, collection_name: str, scope: str, query: str, value: Dict, query_vector: Optional[List[float]] = None, generation: Optional[int] = None):
+        """
+        Cache an answer. With the collection's generation from before retrieval, the answer is
+        dropped if the collection changed since: it was built from the old data.
+        """
+        key = self._key(scope, self.normalize_query(query))
+
+        vector = None
+        if self.semantic and query_vector is not None:
+            vector = np.asarray(query_vector, dtype=np.float32)
+            vector /= np.linalg.norm(vector) or 1.0
+
+        with self._lock:
+            if generation is not None and generation != self._generations.get(collection_name, 0):
+                self.stale_puts += 1
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {
+                "value": value,
+                "vector": vector,
+                "scope": scope,
+                "collection": collection_name,
+                "expires_at": time.time() + self.ttl_seconds,
+            }
+            self._scopes.setdefault(scope, set()).add(key)
+            self._collections.setdefault(collection_name, set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        for index, name in ((self._scopes, entry["scope"]), (self._collections, entry["collection"])):
+            keys = index.get(name)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[name]
+
+    def invalidate_collection(self, collection_name: str):
+        """
+        Drop every cached answer built from this collection.
+        """
+        with self._lock:
+            self._generations[collection_name] = self._generations.get(collection_name, 0) + 1
+            keys = list(self._collections.get(collection_name, ()))
+            for key in keys:
+                self._remove(key)
+            if keys:
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "stale_puts": self.stale_puts,
+            }
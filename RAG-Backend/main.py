@@ -1,17 +1,72 @@
 import json
 
-from fastapi import FastAPI, File, UploadFile, Query, HTTPException, Body, Form, Depends
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, UploadFile, Query, HTTPException, Body, Form, Depends, Request
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from starlette.requests import ClientDisconnect
 from pydantic import BaseModel, Field
 from typing import List, Dict, Any, Optional, Union
 import asyncio
 import os
-import tempfile
+import time
 import uvicorn
-from vector_db.qdrant_wrapper import QdrantWrapper
+from contextlib import asynccontextmanager
+from vector_db.async_qdrant_wrapper import AsyncQdrantWrapper
+from vector_db.client_pool import QdrantClientPool
+from vector_db.embedding_service import EmbeddingService
+from vector_db.collection_config import CollectionConfig
+from vector_db.filter_compiler import compile_filter, filter_cache_stats, FilterError
+from vector_db.point_ids import check_unique_ids, DuplicateDocumentError
+from vector_db.embedding_cache import EmbeddingCache
+from vector_db.ingest_pipeline import IngestPipeline, iter_ndjson_documents
 from llm.qa_system import DocumentQA
+from llm.provider_router import is_error_response
+from llm.response_cache import ResponseCache
+from llm.caption_cache import CaptionCache
+from llm.context_budget import ContextBudgeter
+from services.job_queue import JobQueue, QueueFullError
+from services.single_flight import AsyncSingleFlight, flight_key
+from services.metrics import REGISTRY, current_collection, track_stage, count_cache, EMBEDDING_SECONDS, CAPTION_SECONDS, PROMPT_ASSEMBLY_SECONDS, ERRORS
+from services.payload_log import log_payload
 
-app = FastAPI(title="AI API", description="API for vector database operations and LLM interactions")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Create the shared embedding service, Qdrant client pool, caches and ingestion job queue once at startup and close them on shutdown.
+    """
+    embedding_service = EmbeddingService(cache=EmbeddingCache())
+    await embedding_service.start()
+    response_cache = ResponseCache()
+    chat_flights = AsyncSingleFlight()
+
+    def on_collection_change(collection_name: str):
+        response_cache.invalidate_collection(collection_name)
+        chat_flights.forget()
+
+    qdrant_pool = QdrantClientPool(embedding_service=embedding_service, on_collection_change=on_collection_change)
+    # bounded by QDRANT_HEALTH_TIMEOUT; /ready keeps reporting qdrant's state afterwards
+    if not await qdrant_pool.ahealth_check():
+        print('Warning: qdrant is not reachable at startup.')
+    app.state.embedding_service = embedding_service
+    app.state.response_cache = response_cache
+    app.state.chat_flights = chat_flights
+    app.state.qdrant_pool = qdrant_pool
+    caption_cache = CaptionCache()
+    app.state.caption_cache = caption_cache
+    app.state.context_budgeter = ContextBudgeter()
+    job_queue = JobQueue()
+    await job_queue.start()
+    app.state.job_queue = job_queue
+    await doc_qa.start()
+    try:
+        yield
+    finally:
+        await job_queue.aclose()
+        await doc_qa.aclose()
+        await qdrant_pool.aclose()
+        await embedding_service.aclose()
+        caption_cache.close()
+
+app = FastAPI(title="AI API", description="API for vector database operations and LLM interactions", lifespan=lifespan)
 
 # Cross Origin Reference
 from fastapi.middleware.cors import CORSMiddleware
@@ -26,6 +81,117 @@ app.add_middleware(
 # Initialize our services
 doc_qa = DocumentQA()
 
+def get_qdrant(collection_name: str) -> AsyncQdrantWrapper:
+    """Return the shared AsyncQdrantWrapper for a collection from the app's client pool."""
+    # label the request's llm / cache metrics with the collection
+    current_collection.set(collection_name)
+    return app.state.qdrant_pool.get_async_wrapper(collection_name)
+
+async def lookup_cached_response(collection_name: str, scope: str, query: str):
+    """
+    Look a query up in the response cache.
+    Returns (cached response or None, query vector used for semantic matching or None)
+    """
+    response_cache = app.state.response_cache
+    query_vector = None
+    if response_cache.semantic:
+        query_vector = await app.state.embedding_service.embed_query(query)
+    cached = response_cache.get(scope, query, query_vector)
+    count_cache("response", cached is not None, collection_name)
+    return cached, query_vector
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def check_metadata_filter(metadata_filter: Optional[Dict[str, Any]], use_metadata: bool = True):
+    """
+    Reject invalid metadata filters with a 400 before doing any work. The compiled filter
+    is cached, so the wrapper reuses it.
+    """
+    if use_metadata:
+        try:
+            compile_filter(metadata_filter)
+        except FilterError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid metadata_filter: {str(e)}")
+
+async def caption_image(image_bytes: bytes, query: str = "Please describe this image in detail.", model_name: str = "gpt-4o-mini"):
+    """
+    Caption an uploaded image, reusing the cached caption of the same (or, in perceptual
+    mode, a near-duplicate) image. Returns (description, cache_hit).
+    """
+    caption_cache = app.state.caption_cache
+    start = time.perf_counter()
+    cached, phash = await asyncio.to_thread(caption_cache.get, image_bytes, query, model_name)
+    count_cache("caption", cached is not None)
+    if cached is not None:
+        CAPTION_SECONDS.observe(time.perf_counter() - start, model=model_name, cached="true")
+        return cached, True
+
+    with track_stage(CAPTION_SECONDS, "captioning", model=model_name, cached="false"):
+        description = await doc_qa.aquery_image(image_bytes=image_bytes, query=query, model_name=model_name)
+    if description and not is_error_response(description):
+        await asyncio.to_thread(caption_cache.put, image_bytes, query, model_name, description, phash)
+    else:
+        ERRORS.inc(stage="captioning", collection=current_collection.get(), model=model_name)
+    return description, False
+
+async def run_stages(stages: Dict[str, Any]):
+    """
+    Run independent pipeline stages concurrently. stages maps a name to (awaitable, timeout seconds).
+    Returns (results by name, {"<name>_ms": duration}). If a stage fails or times out (504),
+    the other stages are cancelled and the error is raised.
+    """
+    timings = {}
+
+    async def timed(name, awaitable, timeout):
+        start = time.perf_counter()
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            ERRORS.inc(stage=f"{name}_timeout", collection=current_collection.get())
+            raise HTTPException(status_code=504, detail=f"{name} timed out after {timeout:g}s")
+        finally:
+            timings[f"{name}_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+    tasks = {name: asyncio.create_task(timed(name, awaitable, timeout)) for name, (awaitable, timeout) in stages.items()}
+    try:
+        results = await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
+    return dict(zip(tasks, results)), timings
+
+def sse_event(data: Any, event: Optional[str] = None) -> str:
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+async def single_chunk(text: str):
+    yield text
+
+async def stream_chat_events(context_used: Dict[str, Any], chunks, cached: bool = False, on_complete=None, timings: Optional[Dict[str, float]] = None, answered: Optional[Dict[str, str]] = None):
+    """
+    Server-sent events body for streamed chats:
+    a `context` event with the retrieval metadata, one data event per text chunk, then a `done` event.
+    on_complete is called with the full response once the stream finished.
+    With timings, both events carry the stage timings; the done event adds llm_ms.
+    answered ({"model": ...}, filled in while streaming) is added to the done event.
+    """
+    extra = {"timings": timings} if timings is not None else {}
+    yield sse_event({**context_used, "cached": cached, **extra}, event="context")
+
+    llm_start = time.perf_counter()
+    response_chunks = []
+    async for chunk in chunks:
+        response_chunks.append(chunk)
+        yield sse_event({"token": chunk})
+
+    if on_complete is not None:
+        on_complete("".join(response_chunks))
+    if timings is not None:
+        extra = {"timings": {**timings, "llm_ms": round((time.perf_counter() - llm_start) * 1000, 1)}}
+    yield sse_event({"cached": cached, **(answered or {}), **extra}, event="done")
+
 class TextItem(BaseModel):
     text: List[str]
     metadata: Optional[List[Dict[str, Any]]] = None
@@ -38,6 +204,10 @@ class QueryItem(BaseModel):
     limit: int = 50
     use_metadata: bool = True
     collection_name: str
+    hybrid: bool = False
+
+class BatchQueryItem(BaseModel):
+    queries: List[QueryItem]
 
 class ChatItem(BaseModel):
     query: str
@@ -50,6 +220,19 @@ class ChatWithRagItem(BaseModel):
     use_metadata: bool = True    
     model_name: Optional[str] = None
     collection_name: str
+    use_cache: bool = False
+    stream: bool = False
+    rerank: bool = False
+    hybrid: bool = False
+
+class ProvisionItem(BaseModel):
+    collection_name: str
+    hnsw_m: Optional[int] = None
+    hnsw_ef_construct: Optional[int] = None
+    quantization: Optional[str] = None
+    on_disk_vectors: Optional[bool] = None
+    oversampling: Optional[float] = None
+    indexed_fields: Optional[Dict[str, str]] = None
 
 class ImageQueryItem(BaseModel):
     image_url: Optional[str] = None
@@ -76,6 +259,7 @@ async def parse_add_data_form(
     metadata: Optional[str] = Form(None),
     add_metadata: bool = Form(True),
     collection_name: str = Form(...),
+    background: bool = Form(False),
     file: Optional[UploadFile] = File(None)
 ):
     """Parse form data for the add_data endpoint"""
@@ -103,9 +287,53 @@ async def parse_add_data_form(
         "metadata_list": metadata_list,
         "add_metadata": add_metadata,
         "collection_name": collection_name,
+        "background": background,
         "file": file
     }
 
+async def store_data_with_image(text_list: List[str], metadata_list: Optional[List[Dict[str, Any]]], add_metadata: bool, collection_name: str, image_bytes: Optional[bytes] = None) -> Dict[str, Any]:
+    """
+    Caption the image (if any), attach the caption to every text and store the texts.
+    Shared by the inline and the background path of /add_data_with_image; raises on failure.
+    """
+    # first, so the caption metrics are labelled with the collection too
+    qdrant = get_qdrant(collection_name)
+
+    # Process image if provided
+    image_description = None
+    image_cache_hit = False
+    if image_bytes is not None:
+        image_description, image_cache_hit = await caption_image(image_bytes)
+        if not image_description or is_error_response(image_description):
+            raise RuntimeError(f"Image processing failed: {image_description}")
+
+    # If we have an image description, add it to each text entry
+    if image_description:
+        text_list = [f"{text_item}\n\nImage Description: {image_description}" for text_item in text_list]
+
+        # If metadata exists, add image info to it
+        if metadata_list:
+            for metadata_item in metadata_list:
+                metadata_item["contains_image_description"] = True
+                metadata_item["image_processed"] = True
+        else:
+            # Create metadata if it doesn't exist
+            metadata_list = [{"contains_image_description": True, "image_processed": True} for _ in text_list]
+
+    # Add to vector database
+    await qdrant.aadd_data(
+        text=text_list,
+        metadata=metadata_list,
+        add_metadata=add_metadata
+    )
+
+    return {
+        "status": "success",
+        "message": f"Added {len(text_list)} documents to {collection_name}",
+        "image_processed": image_description is not None,
+        "image_cache_hit": image_cache_hit
+    }
+
 @app.post("/add_data_with_image")
 async def add_data_with_image(form_data: dict = Depends(parse_add_data_form)):
     """
@@ -115,6 +343,9 @@ async def add_data_with_image(form_data: dict = Depends(parse_add_data_form)):
     1. Optionally processes an uploaded image to generate a description
     2. Adds the image description to each text entry if requested
     3. Stores the combined text in the vector database
+
+    With background=true the work is queued and {"job_id", "status": "queued"} is returned
+    right away; poll /jobs/{job_id} for the result. Returns 503 when the job queue is full.
     """
     try:
         text_list = form_data["text_list"]
@@ -122,65 +353,88 @@ async def add_data_with_image(form_data: dict = Depends(parse_add_data_form)):
         add_metadata = form_data["add_metadata"]
         collection_name = form_data["collection_name"]
         file = form_data["file"]
-        
-        # Process image if provided
-        image_description = None
-        if file:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1] if file.filename else '.jpg') as temp_file:
-                temp_file.write(await file.read())
-                temp_file_path = temp_file.name
-            
+
+        # reject documents sharing an id before spending a caption call on them
+        if add_metadata and metadata_list:
+            check_unique_ids(metadata_list)
+
+        # read the upload now, it is closed once the request is done
+        image_bytes = await file.read() if file else None
+
+        if form_data["background"]:
             try:
-                image_description = doc_qa.query_image(
-                    image_path=temp_file_path,
-                    query="Please describe this image in detail."
+                job = app.state.job_queue.submit(
+                    "add_data_with_image",
+                    lambda: store_data_with_image(text_list, metadata_list, add_metadata, collection_name, image_bytes),
+                    non_retryable=(ValueError,),
                 )
-                # Clean up the temporary file
-                os.unlink(temp_file_path)
-            except Exception as e:
-                # Clean up in case of error
-                if os.path.exists(temp_file_path):
-                    os.unlink(temp_file_path)
-                raise HTTPException(status_code=500, detail=f"Image processing failed: {str(e)}")
-        
-        # If we have an image description, add it to each text entry
-        if image_description:
-            enhanced_text_list = []
-            for text_item in text_list:
-                enhanced_text = f"{text_item}\n\nImage Description: {image_description}"
-                enhanced_text_list.append(enhanced_text)
-            
-            # Replace the original text list with the enhanced one
-            text_list = enhanced_text_list
-            
-            # If metadata exists, add image info to it
-            if metadata_list:
-                for metadata_item in metadata_list:
-                    metadata_item["contains_image_description"] = True
-                    metadata_item["image_processed"] = True
-            else:
-                # Create metadata if it doesn't exist
-                metadata_list = [{"contains_image_description": True, "image_processed": True} for _ in text_list]
-        
-        # Add to vector database
-        qdrant = QdrantWrapper(collection_name=collection_name)
-
-        # print(f"\n\nAdding {len(text_list)} documents to {collection_name} \n e.g. {text_list[0]}\n")
-        qdrant.add_data(
-            text=text_list,
-            metadata=metadata_list,
-            add_metadata=add_metadata
-        )
-        
-        return {
-            "status": "success", 
-            "message": f"Added {len(text_list)} documents to {collection_name}",
-            "image_processed": image_description is not None
-        }
-        
+            except QueueFullError as ex:
+                raise HTTPException(status_code=503, detail=str(ex), headers={"Retry-After": "5"})
+            return {"status": "queued", "job_id": job.id}
+
+        return await store_data_with_image(text_list, metadata_list, add_metadata, collection_name, image_bytes)
+
+    except HTTPException:
+        raise
+    except DuplicateDocumentError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to add data: {str(e)}")
 
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Status of a background job: queued, running, retrying, succeeded (with result) or failed (with error).
+    """
+    job = app.state.job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job id: {job_id}")
+    return job.to_dict()
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse for responses streamed while the request body is still being read.
+    StreamingResponse otherwise listens for client disconnects on `receive` (on ASGI servers
+    before spec 2.4), which would swallow the body chunks; here a disconnect surfaces as
+    ClientDisconnect from request.stream() instead, or, like in StreamingResponse, as an
+    OSError from send, which closes the body iterator (stopping the ingestion) and is
+    raised as ClientDisconnect.
+    """
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.stream_response(send)
+        except OSError:
+            if hasattr(self.body_iterator, "aclose"):
+                await self.body_iterator.aclose()
+            raise ClientDisconnect()
+        if self.background is not None:
+            await self.background()
+
+@app.post("/bulk_ingest")
+async def bulk_ingest(
+    request: Request,
+    collection_name: str = Query(...),
+    batch_size: Optional[int] = Query(None, ge=1),
+    concurrency: Optional[int] = Query(None, ge=1)
+):
+    """
+    Bulk ingestion for large archives.
+
+    The request body is an NDJSON stream of documents, one per line:
+    {"text": "...", "metadata": {...}} (or just a json string).
+    Documents are chunked, embedded and upserted in bounded batches while the body is still
+    being read, and the response is an NDJSON stream with one progress line per stored batch
+    followed by a final "done" (or "error") line. Documents repeating an earlier document's id
+    get an "error" line with their "document" index and are skipped.
+    """
+    pipeline = IngestPipeline(get_qdrant(collection_name), batch_size=batch_size, concurrency=concurrency)
+
+    async def progress_lines():
+        async for event in pipeline.run(iter_ndjson_documents(request.stream())):
+            yield json.dumps(event) + "\n"
+
+    return DuplexStreamingResponse(progress_lines(), media_type="application/x-ndjson")
 
 @app.post("/chat_with_image_rag")
 async def chat_with_image_rag(
@@ -190,6 +444,10 @@ async def chat_with_image_rag(
     limit: int = Form(50),
     use_metadata: bool = Form(True),
     model_name: Optional[str] = Form(None),
+    use_cache: bool = Form(False),
+    stream: bool = Form(False),
+    rerank: bool = Form(False),
+    hybrid: bool = Form(False),
     file: Optional[UploadFile] = File(None)
 ):
     """
@@ -198,13 +456,26 @@ async def chat_with_image_rag(
     2. If image is provided, generates description of the image
     3. Combines both sources of information in a prompt
     4. Performs inference with an LLM
+
+    With use_cache, text-only chats are answered from the response cache when the same
+    (or, in similarity mode, a close enough) question was answered recently.
+    With stream, the answer is sent as server-sent events (see stream_chat_events).
+
+    Retrieval and image captioning run concurrently, each with its own timeout
+    (RETRIEVAL_TIMEOUT / CAPTION_TIMEOUT seconds); if one fails the other is cancelled.
+    Per-stage durations are reported in `timings`.
+
+    Retrieved documents are deduplicated, optionally reranked (rerank) and packed into the
+    model's context token budget before prompting; context_used reports the tokens used.
+    With hybrid, retrieval fuses dense and keyword (BM25) search, which finds exact names,
+    handles and addresses that dense search alone misses.
     """
     try:
-        print(f"\n\nGot input request with: query:{query}\n collection_name:{collection_name}\n metadata_filter:{type(metadata_filter)}{metadata_filter}\n limit:{limit}\n use_metadata:{use_metadata}\n model_name:{model_name}\n file:{file}")
+        request_start = time.perf_counter()
+        log_payload("chat_with_image_rag", query=query, collection_name=collection_name, metadata_filter=metadata_filter, limit=limit, use_metadata=use_metadata, model_name=model_name, file=file.filename if file else None)
         if not metadata_filter or metadata_filter =="None" or metadata_filter == "null" or metadata_filter == "undefined":
             import json
             metadata_filter = json.dumps({"source": "blog"})
-            print(f"new_metadata_filter:{type(metadata_filter)}{metadata_filter}")
         
         # Parse metadata_filter from string to dict if provided
         metadata_filter_dict = None
@@ -214,80 +485,127 @@ async def chat_with_image_rag(
                 metadata_filter_dict = json.loads(metadata_filter)
             except json.JSONDecodeError:
                 raise HTTPException(status_code=400, detail="Invalid JSON format for metadata_filter")
+        check_metadata_filter(metadata_filter_dict, use_metadata)
+
+        # Serve repeated questions from the response cache (answers to image chats depend on the image)
+        use_response_cache = use_cache and not file
+        if use_response_cache:
+            cache_scope = ResponseCache.make_scope(collection_name, metadata_filter_dict, model_name, limit=limit, use_metadata=use_metadata, rerank=rerank, hybrid=hybrid, endpoint="chat_with_image_rag")
+            cached, query_vector = await lookup_cached_response(collection_name, cache_scope, query)
+            if cached is not None:
+                if stream:
+                    return StreamingResponse(stream_chat_events(cached["context_used"], single_chunk(cached["response"]), cached=True, answered={"model": cached.get("model")}), media_type="text/event-stream", headers=SSE_HEADERS)
+                return {**cached, "cached": True}
         
-        # Step 1: Fetch relevant documents from vector database
-        qdrant = QdrantWrapper(collection_name=collection_name)
-        results = qdrant.query(
-            text=query,
-            metadata_filter=metadata_filter_dict,
-            limit=limit,
-            use_metadata=use_metadata
-        )
-        metadata = [result['metadata'] for result in results if 'metadata' in result]
-        # print(f"\n\nRAG results: {results}")
-        # print(f"\n\nRAG metadata: {metadata}")
-        # Format the RAG results
-        if isinstance(results[0], dict) and 'text' in results[0]:
-            # Handle case where results are already dicts with 'text' field
-            results_formatted = [result['text'] for result in results if 'text' in result]
-        else:
-            # Handle case where results are objects with 'document' attribute
-            results_formatted = [result.document for result in results if hasattr(result, 'document')]
-        
-        # print(f"\n\nRAG results: {results_formatted}")
-
-        # Step 2: Process image if provided
-        image_description = None
-        if file:
-            print(f'\n\nImage file: {file}')
-            with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1] if file.filename else '.jpg') as temp_file:
-                temp_file.write(await file.read())
-                temp_file_path = temp_file.name
-            
-            try:
-                image_description = doc_qa.query_image(
-                    image_path=temp_file_path,
-                    query="Please describe this image in detail."
-                )
-                # Clean up the temporary file
-                os.unlink(temp_file_path)
-            except Exception as e:
-                # Clean up in case of error
-                if os.path.exists(temp_file_path):
-                    os.unlink(temp_file_path)
-                raise HTTPException(status_code=500, detail=f"Image processing failed: {str(e)}")
+        async def answer():
+            # an add / delete from here on makes this answer stale, see ResponseCache.put
+            cache_generation = app.state.response_cache.generation(collection_name)
+            # read the upload before creating any stage coroutine, so a failed read leaves none un-awaited
+            image_bytes = await file.read() if file else None
+            # Step 1 + 2: fetch relevant documents and describe the image (if provided) concurrently
+            qdrant = get_qdrant(collection_name)
+            stages = {
+                "retrieval": (qdrant.aquery(
+                    text=query,
+                    metadata_filter=metadata_filter_dict,
+                    limit=limit,
+                    use_metadata=use_metadata,
+                    hybrid=hybrid
+                ), float(os.getenv("RETRIEVAL_TIMEOUT", 15))),
+            }
+            if file:
+                async def describe_image(image_bytes):
+                    image_description, image_cache_hit = await caption_image(image_bytes)
+                    if not image_description or is_error_response(image_description):
+                        raise HTTPException(status_code=502, detail=f"Image processing failed: {image_description}")
+                    return image_description, image_cache_hit
+
+                stages["captioning"] = (describe_image(image_bytes), float(os.getenv("CAPTION_TIMEOUT", 90)))
+
+            stage_results, timings = await run_stages(stages)
+            results = stage_results["retrieval"]
+            image_description, image_cache_hit = stage_results.get("captioning", (None, False))
+
+            metadata = [result['metadata'] for result in results if 'metadata' in result]
+            # print(f"\n\nRAG results: {results}")
+            # print(f"\n\nRAG metadata: {metadata}")
+            # Format the RAG results
+            if results and isinstance(results[0], dict) and 'text' in results[0]:
+                # Handle case where results are already dicts with 'text' field
+                results_formatted = [result['text'] for result in results if 'text' in result]
+            else:
+                # Handle case where results are objects with 'document' attribute
+                results_formatted = [result.document for result in results if hasattr(result, 'document')]
         
-        # Step 3: Construct the prompt
-        prompt = "Please answer the query based on the context. If the context does not contain the answer, please say something like: couldn't find specific information regarding your question. \n\n"
+            # print(f"\n\nRAG results: {results_formatted}")
+
+            # Step 3: Dedupe, (rerank) and fit the documents into the model's token budget
+            context_start = time.perf_counter()
+            context = await asyncio.to_thread(app.state.context_budgeter.build, query, results_formatted, model_name, rerank)
+            timings["context_ms"] = round((time.perf_counter() - context_start) * 1000, 1)
+
+            # Step 4: Construct the prompt
+            prompt = "Please answer the query based on the context. If the context does not contain the answer, please say something like: couldn't find specific information regarding your question. \n\n"
         
-        # Add document context
-        if results_formatted:
-            prompt += f"## Document Context:\n {results_formatted}\n\n"
+            # Add document context
+            if context["documents"]:
+                prompt += f"## Document Context:\n{context['context']}\n\n"
         
-        # Add image context if available
-        if image_description:
-            prompt += f"## Image Description:\n Below is the description of image given by user: \n {image_description}\n\n"
+            # Add image context if available
+            if image_description:
+                prompt += f"## Image Description:\n Below is the description of image given by user: \n {image_description}\n\n"
         
-        # Add the user query
-        prompt += f"## Query: \n {query}\n\n"
+            # Add the user query
+            prompt += f"## Query: \n {query}\n\n"
+            PROMPT_ASSEMBLY_SECONDS.observe(time.perf_counter() - context_start, collection=collection_name, endpoint="chat_with_image_rag")
 
-        # print(f"\n\nPrompt: {prompt}")
-        
-        # Step 4: Perform inference with LLM
-        response = await doc_qa.query_llm(
-            query=prompt,
-            model_name=model_name
-        )
-        
-        return {
-            "response": response,
-            "context_used": {
+            log_payload("prompt", collection_name=collection_name, documents=len(context["documents"]), prompt=prompt)
+
+            context_used = {
                 "documents_retrieved": len(results_formatted),
                 "image_processed": image_description is not None,
+                "image_cache_hit": image_cache_hit,
+                **context["stats"],
                 "metadata": metadata if metadata else []
             }
-        }
+
+            def cache_response(response, answered_by):
+                if use_response_cache and not is_error_response(response):
+                    app.state.response_cache.put(collection_name, cache_scope, query, {"response": response, "model": answered_by, "context_used": context_used}, query_vector, generation=cache_generation)
+
+            # Step 5: Perform inference with LLM
+            if stream:
+                answered = {}
+                chunks = doc_qa.stream_llm(query=prompt, model_name=model_name, on_model=lambda model: answered.update(model=model))
+                return StreamingResponse(stream_chat_events(context_used, chunks, on_complete=lambda response: cache_response(response, answered.get("model")), timings=timings, answered=answered), media_type="text/event-stream", headers=SSE_HEADERS)
+
+            llm_start = time.perf_counter()
+            response, answered_by = await doc_qa.query_llm_with_model(
+                query=prompt,
+                model_name=model_name
+            )
+            timings["llm_ms"] = round((time.perf_counter() - llm_start) * 1000, 1)
+            timings["total_ms"] = round((time.perf_counter() - request_start) * 1000, 1)
         
+            result = {
+                "response": response,
+                "model": answered_by,
+                "context_used": context_used
+            }
+            cache_response(response, answered_by)
+
+            return {**result, "cached": False, "timings": timings}
+
+        # Identical concurrent text-only chats share one retrieval and completion
+        # (streamed chats only share the retrieval, see AsyncQdrantWrapper.aquery)
+        if stream or file:
+            return await answer()
+        chat_key = flight_key("chat_with_image_rag", collection_name, metadata_filter_dict, model_name, ResponseCache.normalize_query(query), limit, use_metadata, rerank, hybrid, use_response_cache)
+        result, shared = await app.state.chat_flights.do(chat_key, answer)
+        return {**result, "coalesced": shared}
+        
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Chat with image and RAG failed: {str(e)}")
 
@@ -298,13 +616,15 @@ async def add_data(item: TextItem):
     Add data to the Qdrant vector database
     """
     try:
-        qdrant = QdrantWrapper(collection_name=item.collection_name)
-        qdrant.add_data(
+        qdrant = get_qdrant(item.collection_name)
+        await qdrant.aadd_data(
             text=item.text,
             metadata=item.metadata,
             add_metadata=item.add_metadata
         )
         return {"status": "success", "message": f"Added {len(item.text)} documents to {item.collection_name}"}
+    except DuplicateDocumentError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to add data: {str(e)}")
 
@@ -315,17 +635,19 @@ async def query_data(item: QueryItem):
     Query data from the Qdrant vector database
     """
     try:
-        print(f"\n\nquery: {item.text} metadata_filter: {item.metadata_filter} limit: {item.limit} use_metadata: {item.use_metadata} collection_name: {item.collection_name}")
-        qdrant = QdrantWrapper(collection_name=item.collection_name)
-        results = qdrant.query(
+        log_payload("query_data", query=item.text, collection_name=item.collection_name, metadata_filter=item.metadata_filter, limit=item.limit, use_metadata=item.use_metadata)
+        check_metadata_filter(item.metadata_filter, item.use_metadata)
+        qdrant = get_qdrant(item.collection_name)
+        results = await qdrant.aquery(
             text=item.text,
             metadata_filter=item.metadata_filter,
             limit=item.limit,
-            use_metadata=item.use_metadata
+            use_metadata=item.use_metadata,
+            hybrid=item.hybrid
         )
 
-        print(f"\n\n****ing results: {results}")
-        
+        log_payload("query_results", collection_name=item.collection_name, count=len(results), results=results)
+
         # Convert results to a serializable format
         # formatted_results = []
         # for res in results:
@@ -338,9 +660,146 @@ async def query_data(item: QueryItem):
             
         # return {"results": formatted_results}
         return {"results": results}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to query data: {str(e)}")
+
+@app.post("/query_batch")
+async def query_batch(item: BatchQueryItem):
+    """
+    Run several queries, on one or more collections, at once. All texts are embedded in one
+    call and each collection is searched with one batch request. Results are in query order.
+    """
+    max_queries = int(os.getenv("BATCH_QUERY_MAX", 64))
+    if len(item.queries) > max_queries:
+        raise HTTPException(status_code=400, detail=f"At most {max_queries} queries per batch")
+    for query in item.queries:
+        check_metadata_filter(query.metadata_filter, query.use_metadata)
+
+    try:
+        with track_stage(EMBEDDING_SECONDS, "embedding", collection="", kind="query"):
+            vectors = await app.state.embedding_service.embed_queries([query.text for query in item.queries])
+
+        by_collection: Dict[str, List[int]] = {}
+        for i, query in enumerate(item.queries):
+            by_collection.setdefault(query.collection_name, []).append(i)
+
+        batches = await asyncio.gather(*(
+            get_qdrant(collection_name).aquery_batch(
+                [item.queries[i].model_dump(exclude={"collection_name"}) for i in indexes],
+                [vectors[i] for i in indexes]
+            )
+            for collection_name, indexes in by_collection.items()
+        ))
+
+        results = [None] * len(item.queries)
+        for indexes, batch in zip(by_collection.values(), batches):
+            for i, batch_results in zip(indexes, batch):
+                results[i] = batch_results
+        return {"results": results}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to query data: {str(e)}")
 
+@app.post("/provision_collection")
+async def provision_collection(item: ProvisionItem):
+    """
+    Create a collection with the given HNSW / quantization / on-disk layout and payload
+    indexes, or migrate an existing one in place. Unset fields use the .env defaults.
+    """
+    try:
+        config = CollectionConfig(
+            hnsw_m=item.hnsw_m,
+            hnsw_ef_construct=item.hnsw_ef_construct,
+            quantization=item.quantization,
+            on_disk_vectors=item.on_disk_vectors,
+            oversampling=item.oversampling,
+            indexed_fields=item.indexed_fields
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        report = await get_qdrant(item.collection_name).aprovision(config)
+        return {"collection_name": item.collection_name, "config": config.describe(), **report}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to provision collection: {str(e)}")
+
+@app.get("/health")
+async def health():
+    """
+    Health check for the server and the pooled qdrant connection
+    """
+    qdrant_ok = await app.state.qdrant_pool.ahealth_check()
+    if not qdrant_ok:
+        raise HTTPException(status_code=503, detail="Qdrant is not reachable")
+    return {"status": "ok", "qdrant": qdrant_ok, "embedding": app.state.embedding_service.stats(), "jobs": app.state.job_queue.stats(), "filter_cache": filter_cache_stats(), "chat_flights": app.state.chat_flights.stats()}
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus text format metrics of this process: per-stage latency histograms (embedding,
+    qdrant search / upsert, captioning, prompt assembly, llm time to first token and total)
+    and counters of llm tokens, cache hits / misses and errors, labelled by collection and model.
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/ready")
+async def ready():
+    """
+    Readiness probe: 200 once the providers' model lists have been fetched (or failed to)
+    and qdrant is reachable, 503 before. Liveness stays on /health.
+    """
+    status = doc_qa.model_registry.status()
+    qdrant_ok = await app.state.qdrant_pool.ahealth_check()
+    if not status["ready"] or not qdrant_ok:
+        return JSONResponse(status_code=503, content={"ready": False, "qdrant": qdrant_ok, "models": status})
+    return {"ready": True, "qdrant": qdrant_ok, "models": status}
+
+@app.post("/refresh_models")
+async def refresh_models():
+    """
+    Fetch the providers' model lists now instead of waiting for the next periodic refresh (MODEL_LIST_TTL).
+    """
+    await doc_qa.model_registry.refresh()
+    return doc_qa.model_registry.status()
+
+@app.get("/model_stats")
+async def model_stats():
+    """
+    Rolling per-model latency (EWMA overall and by prompt size, p50/p95), output tokens per second,
+    error rate and health, as used to route model_name "auto" (or no model_name).
+    """
+    return {"auto_models": doc_qa.auto_models, "models": doc_qa.model_stats.snapshot()}
+
+@app.get("/llm_router_stats")
+async def llm_router_stats():
+    """
+    Hedged requests, hedge wins, failovers and current hedge delays per model
+    """
+    return doc_qa.router.stats()
+
+@app.get("/embedding_cache_stats")
+async def embedding_cache_stats():
+    """
+    Hit/miss counters of the embedding cache
+    """
+    return app.state.embedding_service.cache.stats()
+
+@app.get("/response_cache_stats")
+async def response_cache_stats():
+    """
+    Hit/miss counters of the chat response cache
+    """
+    return app.state.response_cache.stats()
+
+@app.get("/caption_cache_stats")
+async def caption_cache_stats():
+    """
+    Hit/miss counters and size of the image caption cache.
+    """
+    return await asyncio.to_thread(app.state.caption_cache.stats)
+
 @app.get("/list_models")
 async def list_models():
     """
@@ -364,11 +823,11 @@ async def chat_with_model(item: ChatItem):
     Chat with a language model
     """
     try:
-        response = await doc_qa.query_llm(
+        response, answered_by = await doc_qa.query_llm_with_model(
             query=item.query, 
             model_name=item.model_name
         )
-        return {"response": response}
+        return {"response": response, "model": answered_by}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Chat failed: {str(e)}")
 
@@ -382,7 +841,7 @@ async def query_image_url(item: ImageQueryItem):
         if not item.image_url:
             raise HTTPException(status_code=400, detail="Image URL is required")
             
-        response = doc_qa.query_image(
+        response = await doc_qa.aquery_image(
             image_url=item.image_url,
             query=item.query
         )
@@ -400,28 +859,9 @@ async def query_image_upload(
     Query model with an uploaded image
     """
     try:
-        # Save the uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as temp_file:
-            temp_file.write(await file.read())
-            temp_file_path = temp_file.name
-        
-        # Process the image
-        try:
-            response = doc_qa.query_image(
-                image_path=temp_file_path,
-                query=query
-            )
-            
-            # Clean up the temporary file
-            os.unlink(temp_file_path)
-            
-            return {"description": response}
-        except Exception as e:
-            # Clean up in case of error
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
-            raise e
-            
+        # Process the image straight from the upload
+        response, cached = await caption_image(await file.read(), query=query)
+        return {"description": response, "cached": cached}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Image upload query failed: {str(e)}")
 
@@ -432,30 +872,68 @@ async def chat_with_rag(item: ChatWithRagItem):
     Fetch Data from Qdrant and invoke query LLM
     """
     try:
-        print(f"\n\nquery: {item.query} metadata_filter: {item.metadata_filter} limit: {item.limit} use_metadata: {item.use_metadata} collection_name: {item.collection_name}")
-        
-        qdrant = QdrantWrapper(collection_name=item.collection_name)
-        results = qdrant.query(
-            text=item.query,
-            metadata_filter=item.metadata_filter,
-            limit=item.limit,
-            use_metadata=item.use_metadata
-        )
+        log_payload("chat_with_rag", query=item.query, collection_name=item.collection_name, metadata_filter=item.metadata_filter, limit=item.limit, use_metadata=item.use_metadata, model_name=item.model_name)
+        check_metadata_filter(item.metadata_filter, item.use_metadata)
 
-        print(f"\n\n****ing results: {results}")
-        results_formatted = [result['text'] for result in results if 'text' in result]
-        print(f"\n\n****ing results formatted: {results_formatted}")
+        if item.use_cache:
+            cache_scope = ResponseCache.make_scope(item.collection_name, item.metadata_filter, item.model_name, limit=item.limit, use_metadata=item.use_metadata, rerank=item.rerank, hybrid=item.hybrid, endpoint="chat_with_rag")
+            cached, query_vector = await lookup_cached_response(item.collection_name, cache_scope, item.query)
+            if cached is not None:
+                if item.stream:
+                    return StreamingResponse(stream_chat_events(cached["context_used"], single_chunk(cached["response"]), cached=True, answered={"model": cached.get("model")}), media_type="text/event-stream", headers=SSE_HEADERS)
+                return {**cached, "cached": True}
         
-        prompt=f"Please answer the query based on context. If the context do not have the answer, please say you can't answer the question.\n\nContext: {results_formatted}\n\nQuery: {item.query}"
+        async def answer():
+            # an add / delete from here on makes this answer stale, see ResponseCache.put
+            cache_generation = app.state.response_cache.generation(item.collection_name)
+            qdrant = get_qdrant(item.collection_name)
+            results = await qdrant.aquery(
+                text=item.query,
+                metadata_filter=item.metadata_filter,
+                limit=item.limit,
+                use_metadata=item.use_metadata,
+                hybrid=item.hybrid
+            )
+
+            results_formatted = [result['text'] for result in results if 'text' in result]
+            log_payload("query_results", collection_name=item.collection_name, count=len(results), results=results_formatted)
+
+            context_start = time.perf_counter()
+            context = await asyncio.to_thread(app.state.context_budgeter.build, item.query, results_formatted, item.model_name, item.rerank)
+
+            prompt=f"Please answer the query based on context. If the context do not have the answer, please say you can't answer the question.\n\nContext:\n{context['context']}\n\nQuery: {item.query}"
+            PROMPT_ASSEMBLY_SECONDS.observe(time.perf_counter() - context_start, collection=item.collection_name, endpoint="chat_with_rag")
+
+            log_payload("prompt", collection_name=item.collection_name, documents=len(context["documents"]), prompt=prompt)
+
+            context_used = {"documents_retrieved": len(results_formatted), **context["stats"]}
+
+            def cache_response(response, answered_by):
+                if item.use_cache and not is_error_response(response):
+                    app.state.response_cache.put(item.collection_name, cache_scope, item.query, {"response": response, "model": answered_by, "context_used": context_used}, query_vector, generation=cache_generation)
 
-        print(f"\n\n****ing prompt: {prompt}")
+            if item.stream:
+                answered = {}
+                chunks = doc_qa.stream_llm(query=prompt, model_name=item.model_name, on_model=lambda model: answered.update(model=model))
+                return StreamingResponse(stream_chat_events(context_used, chunks, on_complete=lambda response: cache_response(response, answered.get("model")), answered=answered), media_type="text/event-stream", headers=SSE_HEADERS)
         
-        response = await doc_qa.query_llm(
-            query=prompt,
-            model_name=item.model_name
-        )
+            response, answered_by = await doc_qa.query_llm_with_model(
+                query=prompt,
+                model_name=item.model_name
+            )
+
+            cache_response(response, answered_by)
+
+            return {"response": response, "model": answered_by, "cached": False}
 
-        return {"response": response}
+        # Identical concurrent chats share one retrieval and completion (streamed ones only the retrieval)
+        if item.stream:
+            return await answer()
+        chat_key = flight_key("chat_with_rag", item.collection_name, item.metadata_filter, item.model_name, ResponseCache.normalize_query(item.query), item.limit, item.use_metadata, item.rerank, item.hybrid, item.use_cache)
+        result, shared = await app.state.chat_flights.do(chat_key, answer)
+        return {**result, "coalesced": shared}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to query data: {str(e)}")
 
@@ -0,0 +1,172 @@
+import os
+import time
+import uuid
+import random
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Type
+
+from dotenv import load_dotenv
+
+
+class QueueFullError(Exception):
+    """Raised by JobQueue.submit when the queue is at capacity."""
+
+
+class Job:
+    """
+    State of one background job.
+    status: queued -> running -> (retrying -> running)* -> succeeded | failed
+    """
+
+    def __init__(self, kind: str, func: Callable[[], Awaitable[Any]], non_retryable: Tuple[Type[BaseException], ...] = ()):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.func = func
+        self.non_retryable = non_retryable
+
+        self.status = "queued"
+        self.attempts = 0
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "attempts": self.attempts,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    """
+    In-process background job queue.
+
+    Jobs wait on a bounded asyncio queue and are run by a fixed number of worker tasks,
+    so a burst of ingests is throttled instead of competing with chat requests for the
+    event loop and upstream APIs. Failed jobs are retried with exponential backoff and
+    jitter. Job state lives in memory: ids are only valid on the process that issued them.
+    """
+
+    def __init__(self, workers: Optional[int] = None, max_queue_size: Optional[int] = None, max_attempts: Optional[int] = None, backoff_seconds: Optional[float] = None, max_finished_jobs: Optional[int] = None):
+        """
+        Args:
+            workers: Number of jobs run concurrently (default: JOB_WORKERS or 2)
+            max_queue_size: Max jobs waiting to run (default: JOB_QUEUE_SIZE or 100)
+            max_attempts: Attempts per job including the first one (default: JOB_MAX_ATTEMPTS or 3)
+            backoff_seconds: Delay before the first retry, doubled on every retry (default: JOB_BACKOFF_SECONDS or 2)
+            max_finished_jobs: Finished jobs kept for status polling (default: JOB_HISTORY_SIZE or 1000)
+        """
+        load_dotenv()
+
+        self.workers = int(workers or os.getenv("JOB_WORKERS", 2))
+        self.max_queue_size = int(max_queue_size or os.getenv("JOB_QUEUE_SIZE", 100))
+        self.max_attempts = int(max_attempts or os.getenv("JOB_MAX_ATTEMPTS", 3))
+        self.backoff_seconds = float(backoff_seconds if backoff_seconds is not None else os.getenv("JOB_BACKOFF_SECONDS", 2))
+        self.max_finished_jobs = int(max_finished_jobs or os.getenv("JOB_HISTORY_SIZE", 1000))
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks = []
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+
+    async def start(self):
+        if self._worker_tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def aclose(self):
+        """
+        Stop the workers. Jobs that are still queued or running are marked failed.
+        """
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+        for job in self._jobs.values():
+            if job.status not in ("succeeded", "failed"):
+                job.status = "failed"
+                job.error = "server shut down before the job finished"
+                job.finished_at = time.time()
+
+    def submit(self, kind: str, func: Callable[[], Awaitable[Any]], non_retryable: Tuple[Type[BaseException], ...] = ()) -> Job:
+        """
+        Queue a job. func is a zero-argument coroutine function, called once per attempt.
+        Exceptions of the non_retryable types fail the job immediately.
+
+        Raises:
+            QueueFullError: if max_queue_size jobs are already waiting
+        """
+        if self._queue is None:
+            raise RuntimeError("Job queue is not started")
+
+        job = Job(kind, func, non_retryable)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFullError(f"Job queue is full ({self.max_queue_size} jobs waiting)")
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: Job):
+        job.started_at = time.time()
+        while True:
+            job.status = "running"
+            job.attempts += 1
+            try:
+                job.result = await job.func()
+                job.status = "succeeded"
+                job.error = None
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                job.error = f"{type(ex).__name__}: {ex}"
+                if isinstance(ex, job.non_retryable) or job.attempts >= self.max_attempts:
+                    job.status = "failed"
+                    print(f'job {job.id} ({job.kind}) failed after {job.attempts} attempt(s): {job.error}')
+                    break
+                job.status = "retrying"
+                delay = self.backoff_seconds * 2 ** (job.attempts - 1)
+                await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+
+        job.finished_at = time.time()
+        job.func = None
+        self._forget_old_jobs()
+
+    def _forget_old_jobs(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in ("succeeded", "failed")]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
+
+    def stats(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        for job in self._jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue_size": self.max_queue_size,
+            "jobs": counts,
+        }
@@ -0,0 +1,236 @@
+import os
+import math
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Collection the current request works on, for metrics of code that doesn't know it
+# (llm calls, embedding cache). Set by main.get_qdrant; tasks inherit it.
+current_collection: ContextVar[str] = ContextVar("current_collection", default="")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Label value that values past a BoundedLabel's limit are folded into
+OTHER = "other"
+
+
+class BoundedLabel:
+    """
+    Bounds the values of a label that comes from request input (collection names), so
+    clients can't grow /metrics and its memory without limit. With an allow-list only those
+    values are kept, otherwise the first max_values distinct ones; the rest become "other".
+    """
+
+    def __init__(self, max_values: int, allowed: Optional[Sequence[str]] = None):
+        self.max_values = max_values
+        self.allowed = set(allowed) if allowed else None
+        self._seen: set = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, value: str) -> str:
+        if not value:
+            return value
+        if self.allowed is not None:
+            return value if value in self.allowed else OTHER
+        with self._lock:
+            if value in self._seen:
+                return value
+            if len(self._seen) < self.max_values:
+                self._seen.add(value)
+                return value
+        return OTHER
+
+
+# Collections labelled by name: METRICS_COLLECTIONS (comma separated) if set, else the first METRICS_MAX_COLLECTIONS seen
+COLLECTION_LABEL = BoundedLabel(
+    int(os.getenv("METRICS_MAX_COLLECTIONS", 100)),
+    [name.strip() for name in os.getenv("METRICS_COLLECTIONS", "").split(",") if name.strip()],
+)
+BOUNDED_LABELS = {"collection": COLLECTION_LABEL}
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        unknown = set(labels) - set(self.labelnames)
+        if unknown:
+            raise ValueError(f"{self.name} has no labels {sorted(unknown)}")
+        values = ("" if labels.get(name) is None else str(labels[name]) for name in self.labelnames)
+        return tuple(BOUNDED_LABELS[name](value) if name in BOUNDED_LABELS else value for name, value in zip(self.labelnames, values))
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + list(self._samples())
+
+    def _samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonic counter per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only go up")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket latency histogram per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + ((math.inf,) if math.inf not in buckets else ())
+        self._values: Dict[Tuple[str, ...], List] = {}  # key -> [bucket counts, sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return entry[2] if entry else 0
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted((key, (list(entry[0]), entry[1], entry[2])) for key, entry in self._values.items())
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {count}"
+
+
+class MetricsRegistry:
+    """
+    In-process metrics rendered in the Prometheus text exposition format (GET /metrics).
+    Metrics are per process: with several workers, scrape each one.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# Per-stage latency of the RAG pipeline
+EMBEDDING_SECONDS = REGISTRY.histogram("rag_embedding_seconds", "Time to embed query or document texts, including waiting for a micro-batch.", ["collection", "kind"])
+QDRANT_SEARCH_SECONDS = REGISTRY.histogram("rag_qdrant_search_seconds", "Qdrant search round trip.", ["collection", "mode"])
+QDRANT_UPSERT_SECONDS = REGISTRY.histogram("rag_qdrant_upsert_seconds", "Qdrant upsert round trip.", ["collection"])
+CAPTION_SECONDS = REGISTRY.histogram("rag_caption_seconds", "Image captioning, cache lookups included.", ["model", "cached"])
+PROMPT_ASSEMBLY_SECONDS = REGISTRY.histogram("rag_prompt_assembly_seconds", "Dedupe, rerank, context budgeting and prompt construction.", ["collection", "endpoint"])
+LLM_TTFT_SECONDS = REGISTRY.histogram("rag_llm_time_to_first_token_seconds", "Time until a streamed llm answer's first chunk.", ["model", "collection"])
+LLM_SECONDS = REGISTRY.histogram("rag_llm_seconds", "Total time of an llm request (per model tried).", ["model", "collection"])
+
+LLM_TOKENS = REGISTRY.counter("rag_llm_tokens_total", "Approximate llm tokens, by type (prompt or completion).", ["model", "collection", "type"])
+CACHE_HITS = REGISTRY.counter("rag_cache_hits_total", "Cache hits, by cache (response, caption, embedding).", ["cache", "collection"])
+CACHE_MISSES = REGISTRY.counter("rag_cache_misses_total", "Cache misses, by cache (response, caption, embedding).", ["cache", "collection"])
+LLM_FALLBACK_ANSWERS = REGISTRY.counter("rag_llm_fallback_answers_total", "Llm answers given by another model of the requested model's fallback chain.", ["model", "answered_by"])
+ERRORS = REGISTRY.counter("rag_errors_total", "Failed pipeline stages.", ["stage", "collection", "model"])
+
+
+@contextmanager
+def track_stage(histogram: Histogram, stage: str, **labels):
+    """
+    Time a block into histogram; if it raises, count an error for stage too.
+    """
+    try:
+        with histogram.time(**labels):
+            yield
+    except Exception:
+        ERRORS.inc(stage=stage, collection=labels.get("collection", current_collection.get()), model=labels.get("model", ""))
+        raise
+
+
+def count_cache(cache: str, hit: bool, collection: Optional[str] = None, amount: int = 1):
+    if amount:
+        (CACHE_HITS if hit else CACHE_MISSES).inc(amount, cache=cache, collection=collection if collection is not None else current_collection.get())
@@ -0,0 +1,44 @@
+import os
+import sys
+import json
+import random
+import logging
+from typing import Any
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Share of payload log events written (0 disables them, 1 logs every request)
+PAYLOAD_LOG_SAMPLE_RATE = float(os.getenv("PAYLOAD_LOG_SAMPLE_RATE", 0.01))
+# Longest logged value, in characters; longer values are cut
+PAYLOAD_LOG_MAX_CHARS = int(os.getenv("PAYLOAD_LOG_MAX_CHARS", 300))
+
+logger = logging.getLogger("rag.payload")
+if not logger.handlers:
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(os.getenv("PAYLOAD_LOG_LEVEL", "INFO"))
+    logger.propagate = False
+
+
+def truncate(value: Any, max_chars: int = PAYLOAD_LOG_MAX_CHARS) -> Any:
+    """Numbers and booleans as they are, anything else as a string of at most max_chars."""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    text = value if isinstance(value, str) else json.dumps(value, default=str, ensure_ascii=False)
+    if len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}... ({len(text) - max_chars} more chars)"
+
+
+def log_payload(event: str, **fields):
+    """
+    Log one json line with the request data of an event, for a sample of the calls, with
+    long values (documents, prompts, results) truncated. Replaces printing whole payloads,
+    which on ingest and chat cost more I/O than the request itself.
+    """
+    if PAYLOAD_LOG_SAMPLE_RATE <= 0 or random.random() >= PAYLOAD_LOG_SAMPLE_RATE or not logger.isEnabledFor(logging.INFO):
+        return
+    logger.info(json.dumps({"event": event, **{key: truncate(value) for key, value in fields.items()}}, default=str, ensure_ascii=False))
@@ -0,0 +1,121 @@
+import json
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+def flight_key(*parts: Any) -> str:
+    """Key of a call from its arguments (dicts compare by content, not key order)."""
+    return json.dumps(parts, sort_keys=True, default=str)
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncSingleFlight:
+    """
+    Coalesces concurrent identical calls.
+
+    While a call for a key is in flight, callers with the same key await its result (or
+    exception) instead of starting their own. Nothing is kept once the call finished, so
+    unlike a cache this never serves a result older than the request asking for it.
+    The call is cancelled only when every caller waiting on it was cancelled.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, _Flight] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """
+        Returns (result, shared): shared is True if the result came from another caller's call.
+        """
+        flight = self._flights.get(key)
+        shared = flight is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            self.calls += 1
+            flight = _Flight(asyncio.ensure_future(func()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._drop(key, flight))
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task), shared
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+                self._drop(key, flight)
+
+    def _drop(self, key: Hashable, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def forget(self):
+        """
+        Make the next callers start new calls, e.g. after the data the calls read changed.
+        Calls in flight still answer the callers already waiting on them.
+        """
+        self._flights.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._flights), "calls": self.calls, "coalesced": self.coalesced}
+
+
+class SingleFlight:
+    """
+    Thread-safe AsyncSingleFlight for blocking calls: threads asking for a key that is in
+    flight block on the first thread's call and get its result (or exception).
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, func: Callable[[], T]) -> Tuple[T, bool]:
+        """
+        Returns (result, shared): shared is True if the result came from another thread's call.
+        """
+        with self._lock:
+            future = self._flights.get(key)
+            shared = future is not None
+            if shared:
+                self.coalesced += 1
+            else:
+                self.calls += 1
+                future = Future()
+                self._flights[key] = future
+        if shared:
+            return future.result(), True
+
+        try:
+            result = func()
+            future.set_result(result)
+            return result, False
+        except BaseException as ex:
+            future.set_exception(ex)
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is future:
+                    del self._flights[key]
+
+    def forget(self):
+        """See AsyncSingleFlight.forget."""
+        with self._lock:
+            self._flights.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"in_flight": len(self._flights), "calls": self.calls, "coalesced": self.coalesced}
@@ -0,0 +1,64 @@
+import json
+import asyncio
+
+import pytest
+from starlette.requests import ClientDisconnect
+
+from main import DuplexStreamingResponse
+from vector_db.ingest_pipeline import IngestPipeline
+
+
+class SlowWrapper:
+    collection_name = "posts"
+
+    def __init__(self):
+        self.stored = 0
+
+    def get_chunker(self):
+        return self
+
+    def iter_chunks(self, text):
+        yield text
+
+    async def aupsert_chunks(self, texts, metadatas):
+        await asyncio.sleep(0.01)
+        self.stored += len(texts)
+
+    async def adelete_stale_chunks(self, chunk_counts):
+        pass
+
+
+def test_disconnect_while_sending_stops_the_ingestion():
+    wrapper = SlowWrapper()
+    read = []
+
+    async def documents():
+        for i in range(1000):
+            read.append(i)
+            yield f"doc {i}", {}
+
+    async def main():
+        pipeline = IngestPipeline(wrapper, batch_size=1, concurrency=1, queue_size=1)
+
+        async def lines():
+            async for event in pipeline.run(documents()):
+                yield json.dumps(event) + "\n"
+
+        sent = []
+
+        async def send(message):
+            if message["type"] == "http.response.body" and sent:
+                raise OSError("connection reset")
+            sent.append(message)
+
+        response = DuplexStreamingResponse(lines(), media_type="application/x-ndjson")
+        with pytest.raises(ClientDisconnect):
+            await response({"type": "http", "asgi": {"spec_version": "2.4"}}, None, send)
+        stored, documents_read = wrapper.stored, len(read)
+        await asyncio.sleep(0.1)
+        return stored, documents_read
+
+    stored, documents_read = asyncio.run(main())
+    # nothing more was read or stored after the client went away
+    assert len(read) == documents_read < 1000
+    assert wrapper.stored == stored
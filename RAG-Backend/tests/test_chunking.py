@@ -0,0 +1,62 @@
+import pytest
+
+from vector_db.chunking import TokenChunker
+
+
+def sentences(count, words=5):
+    return " ".join(f"Sentence {i} " + " ".join(f"w{i}x{j}" for j in range(words - 2)) + "." for i in range(count))
+
+
+def test_short_text_is_one_chunk():
+    chunker = TokenChunker(chunk_tokens=50, overlap_tokens=0)
+    assert list(chunker.iter_chunks("One sentence. And another one!")) == ["One sentence. And another one!"]
+
+
+def test_empty_text_has_no_chunks():
+    assert list(TokenChunker(chunk_tokens=50, overlap_tokens=0).iter_chunks("  \n ")) == []
+
+
+def test_chunks_respect_the_token_budget_and_end_on_sentences():
+    chunker = TokenChunker(chunk_tokens=20, overlap_tokens=0)
+    chunks = list(chunker.iter_chunks(sentences(12)))
+    assert len(chunks) > 1
+    assert all(chunker.count_tokens(chunk) <= 20 for chunk in chunks)
+    assert all(chunk.endswith(".") for chunk in chunks)
+    # without overlap every sentence is in exactly one chunk
+    assert " ".join(chunks) == sentences(12)
+
+
+def test_consecutive_chunks_share_trailing_sentences():
+    chunker = TokenChunker(chunk_tokens=20, overlap_tokens=7)
+    chunks = list(chunker.iter_chunks(sentences(12)))
+    for previous, current in zip(chunks, chunks[1:]):
+        last_sentence = previous[previous.rindex("Sentence"):]
+        assert current.startswith(last_sentence)
+
+
+def test_paragraph_breaks_are_kept():
+    text = "First paragraph without punctuation\n\nSecond paragraph"
+    assert list(TokenChunker(chunk_tokens=50, overlap_tokens=0).iter_chunks(text)) == [text]
+
+
+def test_long_sentence_is_split_at_word_boundaries():
+    words = [f"word{i}" for i in range(60)]
+    chunker = TokenChunker(chunk_tokens=10, overlap_tokens=2)
+    chunks = list(chunker.iter_chunks(" ".join(words)))
+    assert len(chunks) > 1
+    assert all(chunker.count_tokens(chunk) <= 10 for chunk in chunks)
+    assert all(set(chunk.split()) <= set(words) for chunk in chunks)
+    assert chunks[0].split()[0] == "word0" and chunks[-1].split()[-1] == "word59"
+
+
+def test_split_pairs_chunks_with_their_metadata():
+    chunker = TokenChunker(chunk_tokens=20, overlap_tokens=0)
+    pairs = list(chunker.split([sentences(6), "Short one."], [{"id": 1}, {"id": 2}]))
+    assert {metadata["id"] for _, metadata in pairs} == {1, 2}
+    assert pairs[-1] == ("Short one.", {"id": 2})
+
+
+@pytest.mark.parametrize("chunk_tokens, overlap_tokens", [(0, 0), (10, 10), (10, -1)])
+def test_invalid_sizes_are_rejected(chunk_tokens, overlap_tokens):
+    with pytest.raises(ValueError):
+        TokenChunker(chunk_tokens=chunk_tokens, overlap_tokens=overlap_tokens)
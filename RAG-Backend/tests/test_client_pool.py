@@ -0,0 +1,32 @@
+import time
+import asyncio
+
+from vector_db.client_pool import QdrantClientPool
+
+
+def make_pool(get_collections):
+    pool = QdrantClientPool(url="http://localhost:6333", timeout=30, health_timeout=0.05)
+    pool.async_client.get_collections = get_collections
+    return pool
+
+
+def test_health_check_gives_up_after_health_timeout():
+    async def hang():
+        await asyncio.sleep(30)
+
+    pool = make_pool(hang)
+    start = time.perf_counter()
+    assert asyncio.run(pool.ahealth_check()) is False
+    assert time.perf_counter() - start < 5
+    pool.close()
+
+
+def test_health_check_reports_reachable_and_failing_qdrant():
+    async def ok():
+        return []
+
+    async def fail():
+        raise ConnectionError("refused")
+
+    assert asyncio.run(make_pool(ok).ahealth_check()) is True
+    assert asyncio.run(make_pool(fail).ahealth_check()) is False
@@ -0,0 +1,91 @@
+from llm.context_budget import ContextBudgeter, overlap_length
+
+
+def make_budgeter(**kwargs):
+    return ContextBudgeter(default_budget=kwargs.pop("default_budget", 6000), model_budgets={}, dedup_similarity=0.8, **kwargs)
+
+
+def test_short_non_overlapping_documents_are_kept():
+    documents = ['Creator handle is @alice.', 'SUI address 0xabc123 owns it']
+    assert make_budgeter().dedupe(documents) == documents
+
+
+def test_short_document_after_long_one_is_kept():
+    documents = ["A long blog post about staking rewards on the SUI network.", "Another blog post."]
+    assert make_budgeter().dedupe(documents) == documents
+
+
+def test_exact_and_contained_duplicates_are_dropped():
+    long = "Staking rewards on SUI are paid out every epoch to delegators."
+    assert make_budgeter().dedupe([long, long.upper(), long[:40]]) == [long]
+
+
+def test_lower_ranked_document_containing_a_kept_one_replaces_it():
+    short = "Staking rewards on SUI are paid out every epoch."
+    longer = "From the docs: " + short + " Delegators can withdraw them at any time."
+    assert make_budgeter().dedupe([short, longer]) == [longer]
+
+
+def test_overlap_with_kept_sibling_is_trimmed():
+    shared = "the validator set changes at every epoch boundary "
+    first = "Delegation works like this: " + shared
+    second = shared + "and rewards are recomputed afterwards."
+    kept = make_budgeter().dedupe([first, second])
+    assert kept == [first.strip(), "and rewards are recomputed afterwards."]
+
+
+def test_document_trimmed_to_a_short_leftover_is_dropped():
+    shared = "the validator set changes at every epoch boundary "
+    first = "Delegation works like this: " + shared
+    second = shared + "ok."
+    assert make_budgeter().dedupe([first, second]) == [first.strip()]
+
+
+def test_near_duplicates_are_dropped():
+    first = "one two three four five six seven eight nine ten eleven twelve"
+    second = "one two three four five six seven eight nine ten eleven twelve thirteen"
+    budgeter = make_budgeter()
+    # second contains first, so it replaces it; a reworded copy is a near duplicate
+    assert budgeter.dedupe([second, "ONE two three four five six seven eight nine ten eleven"]) == [second]
+    assert len(budgeter.dedupe([first, first + "!"])) == 1
+
+
+def test_overlap_length():
+    assert overlap_length("x" * 10 + "a" * 40, "a" * 40 + "y") == 40
+    assert overlap_length("abc", "abc") == 0  # shorter than the minimum
+    assert overlap_length("a" * 40, "b" * 40) == 0
+
+
+def test_pack_respects_budget_and_truncates_first_document():
+    budgeter = make_budgeter()
+    documents = ["word " * 10, "word " * 100, "word " * 5]
+    used, tokens = budgeter.pack(documents, budget=30)
+    assert used == [documents[0], documents[2]]
+    assert tokens <= 30
+
+    used, tokens = budgeter.pack(["word " * 100], budget=20)
+    assert len(used) == 1 and tokens <= 20
+
+
+def test_build_reports_stats():
+    context = make_budgeter(default_budget=1000).build("q", ["Blog post one.", "Another blog post.", "Blog post one."])
+    assert context["documents"] == ["Blog post one.", "Another blog post."]
+    assert context["stats"]["documents_after_dedupe"] == 2
+    assert context["context"].startswith("[1] Blog post one.")
+
+
+def test_document_larger_than_the_budget_is_truncated_to_fit():
+    budgeter = make_budgeter()
+    # punctuation counts a token per character, so cutting by characters would overshoot
+    document = "!" * 200 + " word" * 200
+    used, tokens = budgeter.pack([document], budget=50)
+    assert tokens <= 50
+    assert budgeter.count_tokens(used[0]) + 4 == tokens
+    assert used[0] == "!" * 46
+
+
+def test_truncate_cuts_at_token_boundaries():
+    budgeter = make_budgeter()
+    assert budgeter.truncate("alpha beta, gamma delta", 3) == "alpha beta,"
+    assert budgeter.truncate("alpha beta", 10) == "alpha beta"
+    assert budgeter.truncate("alpha beta", 0) == ""
@@ -0,0 +1,94 @@
+from vector_db.embedding_cache import EmbeddingCache
+
+DIM = 4
+VECTOR_BYTES = DIM * 4
+
+
+def vector(i):
+    return [float(i), float(i) + 0.5, -float(i), 1.0]
+
+
+def test_make_key_separates_model_kind_and_text():
+    keys = {EmbeddingCache.make_key(*parts) for parts in [("m", "query", "t"), ("m", "passage", "t"), ("n", "query", "t"), ("m", "query", "u")]}
+    assert len(keys) == 4
+
+
+def test_memory_tier_evicts_least_recently_used_by_bytes():
+    cache = EmbeddingCache(max_bytes=2 * VECTOR_BYTES, disk_path=None)
+    cache.put("a", vector(1))
+    cache.put("b", vector(2))
+    assert cache.get("a") == vector(1)
+    cache.put("c", vector(3))
+
+    assert cache.get("b") is None
+    assert cache.get("a") == vector(1) and cache.get("c") == vector(3)
+    stats = cache.stats()
+    assert (stats["memory_entries"], stats["memory_bytes"], stats["evictions"]) == (2, 2 * VECTOR_BYTES, 1)
+    assert (stats["memory_hits"], stats["misses"]) == (3, 1)
+
+
+def test_vectors_larger_than_the_budget_are_not_kept_in_memory():
+    cache = EmbeddingCache(max_bytes=VECTOR_BYTES - 1, disk_path=None)
+    cache.put("a", vector(1))
+    assert cache.get("a") is None
+
+
+def test_disk_tier_serves_entries_evicted_from_memory(tmp_path):
+    cache = EmbeddingCache(max_bytes=VECTOR_BYTES, disk_path=str(tmp_path), disk_entries=10)
+    cache.put("a", vector(1))
+    cache.put("b", vector(2))
+    assert cache.get("a") == vector(1)
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_cache_reopens_from_disk(tmp_path):
+    cache = EmbeddingCache(max_bytes=VECTOR_BYTES, disk_path=str(tmp_path), disk_entries=10)
+    for i in range(3):
+        cache.put(f"k{i}", vector(i))
+    cache.flush()
+
+    reopened = EmbeddingCache(max_bytes=VECTOR_BYTES, disk_path=str(tmp_path), disk_entries=10)
+    assert [reopened.get(f"k{i}") for i in range(3)] == [vector(i) for i in range(3)]
+    assert reopened.stats()["disk_hits"] == 3
+
+
+def test_changed_capacity_starts_fresh(tmp_path):
+    cache = EmbeddingCache(disk_path=str(tmp_path), disk_entries=10)
+    cache.put("a", vector(1))
+    cache.flush()
+    assert EmbeddingCache(disk_path=str(tmp_path), disk_entries=20).get("a") is None
+
+
+def test_ring_buffer_overwrites_oldest_rows(tmp_path):
+    cache = EmbeddingCache(max_bytes=VECTOR_BYTES, disk_path=str(tmp_path), disk_entries=3)
+    for i in range(5):
+        cache.put(f"k{i}", vector(i))
+    assert cache.stats()["disk_entries"] == 3
+    assert cache.get("k0") is None and cache.get("k1") is None
+    assert [cache.get(f"k{i}") for i in range(2, 5)] == [vector(i) for i in range(2, 5)]
+
+
+def test_rows_reused_after_the_last_flush_are_misses_after_a_crash(tmp_path):
+    cache = EmbeddingCache(max_bytes=VECTOR_BYTES, disk_path=str(tmp_path), disk_entries=3, flush_every=1000)
+    for i in range(3):
+        cache.put(f"old{i}", vector(i))
+    cache.flush()
+    # the ring wraps, the vectors are written but the index is not saved before the crash
+    for i in range(2):
+        cache.put(f"new{i}", vector(10 + i))
+    cache._vectors.flush()
+    cache._row_hashes.flush()
+
+    reopened = EmbeddingCache(max_bytes=VECTOR_BYTES, disk_path=str(tmp_path), disk_entries=3)
+    assert reopened.get("old0") is None
+    assert reopened.get("old1") is None
+    assert reopened.get("old2") == vector(2)
+    assert reopened.stats()["disk_entries"] == 1
+
+
+def test_disk_tier_skips_vectors_of_another_size(tmp_path):
+    cache = EmbeddingCache(max_bytes=0, disk_path=str(tmp_path), disk_entries=3)
+    cache.put("a", vector(1))
+    cache.put("b", [1.0, 2.0])
+    assert cache.get("a") == vector(1)
+    assert cache.get("b") is None
@@ -0,0 +1,99 @@
+import pytest
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import DatetimeRange, Distance, FieldCondition, MatchAny, MatchValue, PointStruct, Range, VectorParams
+
+from vector_db.filter_compiler import FilterError, compile_filter, filter_cache_stats
+
+POSTS = [
+    {"source": "blog", "creator_id": "alice", "views": 1500, "published_at": "2024-01-10T00:00:00Z", "tags": ["sui"], "title": "Staking on SUI", "author": {"name": "Anon"}, "comments": [{"author": "bob", "likes": 5}]},
+    {"source": "blog", "creator_id": "bob", "views": 20, "published_at": "2024-02-10T00:00:00Z", "tags": ["nsfw"], "title": "Other news", "image": "a.png", "comments": [{"author": "bob", "likes": 1}, {"author": "carol", "likes": 9}]},
+    {"source": "news", "creator_id": "carol", "views": 700, "published_at": "2023-12-24T00:00:00Z", "tags": [], "title": "SUI weekly", "author": {"name": "Anon"}, "score": 0.5},
+    {"source": "spam", "creator_id": "dave", "views": 0, "published_at": None},
+]
+
+
+@pytest.fixture(scope="module")
+def client():
+    client = QdrantClient(":memory:")
+    client.create_collection("posts", vectors_config=VectorParams(size=2, distance=Distance.DOT))
+    client.upsert("posts", points=[PointStruct(id=i, vector=[1.0, 0.0], payload=post) for i, post in enumerate(POSTS)])
+    return client
+
+
+def matching(client, metadata_filter):
+    points, _ = client.scroll("posts", scroll_filter=compile_filter(metadata_filter), limit=100)
+    return sorted(point.payload["creator_id"] for point in points)
+
+
+def test_nothing_to_filter_on():
+    assert compile_filter(None) is None
+    assert compile_filter({}) is None
+
+
+def test_plain_values_and_lists():
+    compiled = compile_filter({"source": "blog", "creator_id": ["alice", "bob"]})
+    # fields come in key order, filters are compiled from their canonical json
+    assert compiled.must == [
+        FieldCondition(key="creator_id", match=MatchAny(any=["alice", "bob"])),
+        FieldCondition(key="source", match=MatchValue(value="blog")),
+    ]
+
+
+def test_numeric_and_date_ranges():
+    assert compile_filter({"views": {"$gt": 10, "$lte": 100}}).must == [FieldCondition(key="views", range=Range(gt=10, lte=100))]
+    compiled = compile_filter({"published_at": {"$gte": "2024-01-01T00:00:00Z"}})
+    assert isinstance(compiled.must[0].range, DatetimeRange)
+
+
+def test_nested_keys_are_dotted_paths():
+    assert compile_filter({"author": {"name": "Anon"}}) == compile_filter({"author.name": "Anon"})
+
+
+@pytest.mark.parametrize("metadata_filter, expected", [
+    ({"source": "blog"}, ["alice", "bob"]),
+    ({"creator_id": ["alice", "carol"]}, ["alice", "carol"]),
+    ({"views": {"$gte": 700}}, ["alice", "carol"]),
+    ({"published_at": {"$gte": "2024-01-01T00:00:00Z", "$lt": "2024-02-01T00:00:00Z"}}, ["alice"]),
+    ({"source": {"$ne": "spam"}}, ["alice", "bob", "carol"]),
+    ({"tags": {"$nin": ["nsfw"]}}, ["alice", "carol", "dave"]),
+    ({"image": {"$exists": True}}, ["bob"]),
+    ({"author.name": "Anon"}, ["alice", "carol"]),
+    ({"comments": {"$elem": {"author": "bob", "likes": {"$gte": 3}}}}, ["alice"]),
+    ({"should": [{"source": "news"}, {"views": {"$gt": 1000}}]}, ["alice", "carol"]),
+    ({"must_not": {"source": "blog"}}, ["carol", "dave"]),
+    ({"score": 0.5}, ["carol"]),
+    ({"published_at": None}, ["dave"]),
+])
+def test_filters_match_in_qdrant(client, metadata_filter, expected):
+    assert matching(client, metadata_filter) == expected
+
+
+@pytest.mark.parametrize("metadata_filter", [
+    ["source", "blog"],
+    {"$gt": 3},
+    {"views": {}},
+    {"views": {"$gt": 1, "nested": 2}},
+    {"views": {"$between": [1, 2]}},
+    {"creator_id": []},
+    {"creator_id": ["alice", 1]},
+    {"views": {"$gt": "1", "$lt": 5}},
+    {"title": {"$text": 3}},
+    {"image": {"$exists": "yes"}},
+    {"comments": {"$elem": []}},
+    {"should": ["blog"]},
+    {"source": {"a": object()}},
+])
+def test_invalid_filters_raise_filter_error(metadata_filter):
+    with pytest.raises(FilterError):
+        compile_filter(metadata_filter)
+
+
+def test_filter_error_is_a_value_error():
+    assert issubclass(FilterError, ValueError)
+
+
+def test_compiled_filters_are_cached_by_content():
+    first = compile_filter({"source": "blog", "views": {"$gt": 5}})
+    hits = filter_cache_stats()["hits"]
+    assert compile_filter({"views": {"$gt": 5}, "source": "blog"}) is first
+    assert filter_cache_stats()["hits"] == hits + 1
@@ -0,0 +1,43 @@
+import io
+
+from PIL import Image
+
+from llm.image_encoding import EXIF_ORIENTATION, prepare_image, target_size
+
+
+def jpeg(size, orientation=None):
+    image = Image.new("RGB", size, "white")
+    # mark the top left corner, to find where it ends up
+    image.paste((255, 0, 0), (0, 0, size[0] // 4, size[1] // 4))
+    exif = Image.Exif()
+    if orientation is not None:
+        exif[EXIF_ORIENTATION] = orientation
+    output = io.BytesIO()
+    image.save(output, format="JPEG", exif=exif)
+    return output.getvalue()
+
+
+def test_target_size_fits_short_side_and_never_upscales():
+    assert target_size(4000, 3000, 2048, 768) == (1024, 768)
+    assert target_size(300, 200, 2048, 768) == (300, 200)
+
+
+def test_small_upright_image_is_passed_through():
+    data = jpeg((300, 200))
+    assert prepare_image(data, downscale=True) == (data, "image/jpeg")
+
+
+def test_rotated_photo_is_made_upright_before_resizing():
+    # stored landscape, displayed portrait (orientation 6: rotate 90 degrees clockwise)
+    data, mime = prepare_image(jpeg((4000, 3000), orientation=6), downscale=True, max_side=2048, max_short_side=768, jpeg_quality=85)
+    image = Image.open(io.BytesIO(data))
+    assert mime == "image/jpeg"
+    assert image.size == (768, 1024)
+    assert image.getexif().get(EXIF_ORIENTATION, 1) == 1
+    # the stored top left corner is now the top right one
+    assert image.getpixel((760, 5))[0] > 200 and image.getpixel((5, 5))[1] > 200
+
+
+def test_small_rotated_photo_is_still_made_upright():
+    data, _ = prepare_image(jpeg((300, 200), orientation=6), downscale=True)
+    assert Image.open(io.BytesIO(data)).size == (200, 300)
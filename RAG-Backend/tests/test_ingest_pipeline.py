@@ -0,0 +1,89 @@
+import json
+import asyncio
+
+import pytest
+
+from vector_db.ingest_pipeline import IngestPipeline, iter_ndjson_documents
+
+
+class OneChunkPerDocument:
+    def iter_chunks(self, text):
+        yield text
+
+
+class FakeWrapper:
+    """Records what the pipeline stores instead of embedding and upserting it."""
+
+    collection_name = "posts"
+
+    def __init__(self):
+        self.stored = []
+        self.stale = None
+
+    def get_chunker(self):
+        return OneChunkPerDocument()
+
+    async def aupsert_chunks(self, texts, metadatas):
+        self.stored += list(zip(texts, metadatas))
+
+    async def adelete_stale_chunks(self, chunk_counts):
+        self.stale = dict(chunk_counts)
+
+
+async def body(lines):
+    for line in lines:
+        yield (json.dumps(line) + "\n").encode()
+
+
+def ingest(wrapper, lines, **kwargs):
+    async def collect():
+        pipeline = IngestPipeline(wrapper, **kwargs)
+        return [event async for event in pipeline.run(iter_ndjson_documents(body(lines)))]
+    return asyncio.run(collect())
+
+
+def test_documents_are_stored_in_batches():
+    wrapper = FakeWrapper()
+    events = ingest(wrapper, [{"text": f"doc {i}", "metadata": {"source_id": i}} for i in range(5)] + ["plain"], batch_size=2, concurrency=1)
+    assert [event["status"] for event in events] == ["progress"] * 3 + ["done"]
+    assert events[-1]["documents"] == 6 and events[-1]["chunks"] == 6
+    assert sorted(text for text, _ in wrapper.stored) == sorted([f"doc {i}" for i in range(5)] + ["plain"])
+    assert wrapper.stale == {str(i): 1 for i in range(5)}
+
+
+def test_repeated_id_in_stream_is_rejected_not_stored():
+    wrapper = FakeWrapper()
+    events = ingest(wrapper, [
+        {"text": "first", "metadata": {"source_id": "a"}},
+        {"text": "second", "metadata": {"source_id": "b"}},
+        {"text": "again", "metadata": {"source_id": "a"}},
+    ], batch_size=10, concurrency=1)
+
+    errors = [event for event in events if event["status"] == "error"]
+    assert len(errors) == 1
+    assert errors[0]["document"] == 2
+    assert "Documents 0 and 2" in errors[0]["detail"]
+    assert events[-1]["status"] == "done"
+    assert (events[-1]["documents"], events[-1]["rejected"], events[-1]["chunks"]) == (3, 1, 2)
+    assert [text for text, _ in wrapper.stored] == ["first", "second"]
+    assert wrapper.stale == {"a": 1, "b": 1}
+
+
+def test_invalid_line_ends_the_stream_with_an_error():
+    async def broken():
+        yield b'{"text": "ok"}\n'
+        yield b"not json\n"
+
+    async def collect():
+        pipeline = IngestPipeline(FakeWrapper(), batch_size=1, concurrency=1)
+        return [event async for event in pipeline.run(iter_ndjson_documents(broken()))]
+
+    events = asyncio.run(collect())
+    assert events[-1]["status"] == "error"
+    assert "line 2" in events[-1]["detail"]
+
+
+@pytest.mark.parametrize("kwargs", [{"batch_size": -1}, {"concurrency": -1}, {"queue_size": -1}])
+def test_invalid_sizes_are_rejected(kwargs):
+    with pytest.raises(ValueError):
+        IngestPipeline(FakeWrapper(), **kwargs)
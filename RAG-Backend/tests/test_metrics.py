@@ -0,0 +1,30 @@
+from services.metrics import OTHER, BoundedLabel, MetricsRegistry
+
+
+def test_label_values_past_the_limit_are_folded_into_other():
+    label = BoundedLabel(2)
+    assert [label(name) for name in ("a", "b", "c", "a", "")] == ["a", "b", OTHER, "a", ""]
+
+
+def test_allow_list_keeps_only_listed_values():
+    label = BoundedLabel(100, allowed=["posts"])
+    assert (label("posts"), label("junk")) == ("posts", OTHER)
+
+
+def test_counter_renders_prometheus_text():
+    registry = MetricsRegistry()
+    counter = registry.counter("test_total", "A test counter.", ["collection"])
+    counter.inc(2, collection="posts")
+    assert 'test_total{collection="posts"} 2' in registry.render()
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("test_seconds", "A test histogram.", ["stage"], buckets=(0.1, 1.0))
+    histogram.observe(0.05, stage="x")
+    histogram.observe(0.5, stage="x")
+    lines = registry.render().splitlines()
+    assert 'test_seconds_bucket{stage="x",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{stage="x",le="1"} 2' in lines
+    assert 'test_seconds_bucket{stage="x",le="+Inf"} 2' in lines
+    assert histogram.count(stage="x") == 2
@@ -0,0 +1,121 @@
+from types import SimpleNamespace
+
+import pytest
+
+from vector_db.point_ids import (
+    CHUNK_INDEX_FIELD, CONTENT_HASH_FIELD, DOCUMENT_KEY_FIELD,
+    DuplicateDocumentError, check_unique_ids, chunk_point, content_hash, content_key, count_chunks,
+    document_key, key_chunks, plan_upsert, point_id, public_metadata, stale_chunks_filter,
+)
+from vector_db.qdrant_wrapper import points_to_query_responses, strip_internal_fields
+
+
+class WordChunker:
+    """Two words per chunk, enough to exercise key_chunks."""
+
+    def iter_chunks(self, text):
+        words = text.split()
+        for i in range(0, len(words), 2):
+            yield " ".join(words[i:i + 2])
+
+
+def test_document_key_uses_id_field_else_content_key():
+    assert document_key("text", {"source_id": 42}) == "42"
+    assert document_key("text", {"post": "a"}, id_field="post") == "a"
+    assert document_key("text", {"source_id": ""}) == content_key("text", {"source_id": ""})
+
+
+def test_same_text_with_different_metadata_gets_different_points():
+    alice = document_key("same text", {"creator_id": "alice"})
+    bob = document_key("same text", {"creator_id": "bob"})
+    assert alice != bob
+    assert point_id("posts", alice, 0) != point_id("posts", bob, 0)
+
+    ids, payloads = zip(*(chunk_point("posts", "same text", {"creator_id": creator}) for creator in ("alice", "bob")))
+    # bob's chunk is new, not a payload update of alice's
+    assert plan_upsert([ids[1]], [payloads[1]], {ids[0]: payloads[0]}) == ([0], [])
+
+
+def test_content_key_ignores_metadata_key_order_and_internal_fields():
+    assert content_key("t", {"a": 1, "b": 2}) == content_key("t", {"b": 2, "a": 1, CHUNK_INDEX_FIELD: 3})
+    assert content_key("t", {"a": 1}) != content_key("t2", {"a": 1})
+
+
+def test_point_id_is_deterministic_per_collection_document_and_chunk():
+    assert point_id("posts", "doc", 0) == point_id("posts", "doc", 0)
+    assert len({point_id("posts", "doc", 0), point_id("posts", "doc", 1), point_id("other", "doc", 0)}) == 3
+
+
+def test_key_chunks_numbers_chunks_per_document():
+    chunks = list(key_chunks(WordChunker(), ["a b c d e", "f g"], [{"source_id": "one"}, {"source_id": "two"}]))
+    assert [chunk for chunk, _ in chunks] == ["a b", "c d", "e", "f g"]
+    assert [(meta[DOCUMENT_KEY_FIELD], meta[CHUNK_INDEX_FIELD]) for _, meta in chunks] == [("one", 0), ("one", 1), ("one", 2), ("two", 0)]
+
+
+def test_chunk_point_payload_carries_key_index_and_hash():
+    id_, payload = chunk_point("posts", "a b", {"source": "blog", DOCUMENT_KEY_FIELD: "one", CHUNK_INDEX_FIELD: 1})
+    assert id_ == point_id("posts", "one", 1)
+    assert payload == {"document": "a b", "source": "blog", DOCUMENT_KEY_FIELD: "one", CHUNK_INDEX_FIELD: 1, CONTENT_HASH_FIELD: content_hash("a b")}
+
+
+def test_chunk_point_without_key_is_keyed_by_text():
+    id_, payload = chunk_point("posts", "a b", {})
+    assert payload[DOCUMENT_KEY_FIELD] == content_key("a b", {})
+    assert id_ == point_id("posts", payload[DOCUMENT_KEY_FIELD], 0)
+
+
+def test_plan_upsert_embeds_new_and_changed_text_and_updates_changed_metadata():
+    payloads = [chunk_point("posts", text, {"views": views})[1] for text, views in (("new", 1), ("changed", 1), ("same", 2), ("untouched", 1))]
+    ids = ["1", "2", "3", "4"]
+    existing = {
+        "2": {**payloads[1], CONTENT_HASH_FIELD: content_hash("old text")},
+        "3": {**payloads[2], "views": 1},
+        "4": dict(payloads[3]),
+    }
+    assert plan_upsert(ids, payloads, existing) == ([0, 1], [2])
+
+
+def test_count_chunks_ignores_text_keyed_documents():
+    counts = {}
+    count_chunks(counts, [
+        {DOCUMENT_KEY_FIELD: "one", CHUNK_INDEX_FIELD: 0},
+        {DOCUMENT_KEY_FIELD: "one", CHUNK_INDEX_FIELD: 2},
+        {DOCUMENT_KEY_FIELD: content_key("abc", {}), CHUNK_INDEX_FIELD: 5},
+    ])
+    assert counts == {"one": 3}
+
+
+def test_stale_chunks_filter_matches_chunks_past_the_new_end():
+    assert stale_chunks_filter({}) is None
+    stale = stale_chunks_filter({"one": 3})
+    conditions = stale.should[0].must
+    assert (conditions[0].key, conditions[0].match.value) == (DOCUMENT_KEY_FIELD, "one")
+    assert (conditions[1].key, conditions[1].range.gte) == (CHUNK_INDEX_FIELD, 3)
+
+
+def test_duplicate_ids_in_one_request_are_rejected():
+    with pytest.raises(DuplicateDocumentError, match="Documents 0 and 2"):
+        check_unique_ids([{"source_id": "one"}, {"source_id": "two"}, {"source_id": "one"}])
+    # a ValueError, so background jobs don't retry it
+    assert issubclass(DuplicateDocumentError, ValueError)
+
+
+def test_documents_without_ids_may_repeat():
+    check_unique_ids([{}, {"source_id": ""}, {}, {"source_id": None}])
+
+
+def test_public_metadata_drops_internal_fields():
+    _, payload = chunk_point("posts", "a b", {"source": "blog", DOCUMENT_KEY_FIELD: "one", CHUNK_INDEX_FIELD: 0})
+    assert public_metadata(payload) == {"document": "a b", "source": "blog"}
+    assert public_metadata(None) == {}
+
+
+def test_search_results_have_no_internal_fields():
+    _, payload = chunk_point("posts", "a b", {"source": "blog"})
+    responses = points_to_query_responses([SimpleNamespace(id="1", payload=payload, score=0.5)])
+    assert responses[0].metadata == {"document": "a b", "source": "blog"}
+    assert responses[0].document == "a b"
+
+    raw = points_to_query_responses([SimpleNamespace(id="1", payload=payload, score=0.5)])
+    raw[0].metadata = payload
+    assert strip_internal_fields(raw)[0].metadata == {"document": "a b", "source": "blog"}
@@ -0,0 +1,115 @@
+import asyncio
+
+from llm.model_stats import ModelStats
+from llm.provider_router import ProviderRouter, is_error_response
+
+
+class FakeCall:
+    """Stands in for the provider call: per model a (delay, response) pair, records the calls."""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.calls = []
+        self.cancelled = []
+
+    async def __call__(self, model_name, query, max_tokens=None):
+        self.calls.append(model_name)
+        delay, response = self.answers[model_name]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(model_name)
+            raise
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def make_router(call, fallbacks=None, hedge_percentile=0, hedge_min_samples=1):
+    return ProviderRouter(call, fallbacks=fallbacks if fallbacks is not None else {"*": ["fallback"]}, hedge_percentile=hedge_percentile, hedge_min_samples=hedge_min_samples, model_stats=ModelStats(alpha=0.5, latency_window=50))
+
+
+def test_hedging_is_off_by_default(monkeypatch):
+    monkeypatch.delenv("LLM_HEDGE_PERCENTILE", raising=False)
+    router = ProviderRouter(FakeCall({}), fallbacks={})
+    assert router.hedge_percentile == 0
+    assert router.hedge_delay("primary") is None
+
+
+def test_explicit_zero_settings_are_kept():
+    router = make_router(FakeCall({}), hedge_min_samples=0)
+    assert router.hedge_min_samples == 0
+    stats = ModelStats(alpha=0, latency_window=0)
+    assert (stats.alpha, stats.latency_window) == (0, 0)
+
+
+def test_first_model_answers():
+    call = FakeCall({"primary": (0, "hello"), "fallback": (0, "other")})
+    router = make_router(call)
+    assert asyncio.run(router.query("hi", "primary")) == ("hello", "primary")
+    assert call.calls == ["primary"]
+
+
+def test_error_fails_over_to_next_model():
+    call = FakeCall({"primary": (0, "Error: rate limited"), "fallback": (0, "from fallback")})
+    router = make_router(call)
+    assert asyncio.run(router.query("hi", "primary")) == ("from fallback", "fallback")
+    assert call.calls == ["primary", "fallback"]
+    assert router.failovers == 1
+    assert router.model_stats.snapshot()["primary"]["errors"] == 1
+
+
+def test_exception_counts_as_error():
+    call = FakeCall({"primary": (0, RuntimeError("boom")), "fallback": (0, "ok")})
+    assert asyncio.run(make_router(call).query("hi", "primary")) == ("ok", "fallback")
+
+
+def test_last_error_is_returned_when_every_model_fails():
+    call = FakeCall({"primary": (0, "Error: one"), "fallback": (0, "Error: two")})
+    response, model = asyncio.run(make_router(call).query("hi", "primary"))
+    assert is_error_response(response)
+    assert (response, model) == ("Error: two", "fallback")
+
+
+def test_slow_model_is_hedged_and_loser_cancelled():
+    call = FakeCall({"primary": (1.0, "slow"), "fallback": (0, "fast")})
+    router = make_router(call, hedge_percentile=95)
+    router.model_stats.record("primary", 0.01)
+
+    assert asyncio.run(router.query("hi", "primary")) == ("fast", "fallback")
+    assert call.cancelled == ["primary"]
+    assert (router.hedges, router.hedge_wins) == (1, 1)
+
+
+def test_cancelled_loser_counts_towards_percentile_but_not_average():
+    call = FakeCall({"primary": (0.3, "slow"), "fallback": (0, "fast")})
+    router = make_router(call, hedge_percentile=95)
+    router.model_stats.record("primary", 0.01)
+
+    asyncio.run(router.query("hi", "primary"))
+    stats = router.model_stats.snapshot()["primary"]
+    # the cancelled request ran at least until the hedge answered
+    assert stats["p95_latency"] >= 0.01
+    assert len(router.model_stats._latencies["primary"]) == 2
+    assert stats["latency_ewma"] == 0.01
+    assert stats["requests"] == 1
+
+
+def test_stream_fails_over_before_first_chunk():
+    async def open_stream(model_name, query, max_tokens=None):
+        if model_name == "primary":
+            yield "Error: unavailable"
+            return
+        for text in ("a", "b"):
+            yield text
+
+    async def collect():
+        router = make_router(FakeCall({}))
+        models = []
+        chunks = [text async for text in router.stream("hi", "primary", open_stream, on_model=models.append)]
+        return chunks, models, router
+
+    chunks, models, router = asyncio.run(collect())
+    assert chunks == ["a", "b"]
+    assert models == ["fallback"]
+    assert router.failovers == 1
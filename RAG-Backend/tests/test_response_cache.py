@@ -0,0 +1,96 @@
+import time
+
+from llm.response_cache import ResponseCache
+
+SCOPE = ResponseCache.make_scope("posts", {"source": "blog"}, "gpt-4o-mini", limit=5)
+
+
+def answer(text):
+    return {"response": text, "context_used": {}}
+
+
+def test_normalized_query_hits():
+    cache = ResponseCache(ttl_seconds=60, max_entries=10, similarity_threshold=0)
+    cache.put("posts", SCOPE, "What is SUI?", answer("a chain"))
+    assert cache.get(SCOPE, "  what is   sui ") == answer("a chain")
+    assert cache.get(SCOPE, "what is eth") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_scope_separates_answers():
+    cache = ResponseCache(ttl_seconds=60, max_entries=10, similarity_threshold=0)
+    cache.put("posts", SCOPE, "q", answer("blog"))
+    other = ResponseCache.make_scope("posts", {"source": "news"}, "gpt-4o-mini", limit=5)
+    assert cache.get(other, "q") is None
+    # filter key order doesn't change the scope
+    assert ResponseCache.make_scope("posts", {"a": 1, "b": 2}, None) == ResponseCache.make_scope("posts", {"b": 2, "a": 1}, None)
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    cache = ResponseCache(ttl_seconds=10, max_entries=10, similarity_threshold=0)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now)
+    cache.put("posts", SCOPE, "q", answer("old"))
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+    assert cache.get(SCOPE, "q") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(ttl_seconds=60, max_entries=2, similarity_threshold=0)
+    cache.put("posts", SCOPE, "one", answer("1"))
+    cache.put("posts", SCOPE, "two", answer("2"))
+    cache.get(SCOPE, "one")
+    cache.put("posts", SCOPE, "three", answer("3"))
+    assert cache.get(SCOPE, "two") is None
+    assert cache.get(SCOPE, "one") == answer("1")
+    assert cache.get(SCOPE, "three") == answer("3")
+
+
+def test_semantic_hit_needs_close_vector_in_same_scope():
+    cache = ResponseCache(ttl_seconds=60, max_entries=10, similarity_threshold=0.9)
+    cache.put("posts", SCOPE, "what is sui", answer("a chain"), query_vector=[1.0, 0.0])
+    assert cache.get(SCOPE, "tell me about sui", query_vector=[0.99, 0.05]) == answer("a chain")
+    assert cache.get(SCOPE, "who is bob", query_vector=[0.0, 1.0]) is None
+    other = ResponseCache.make_scope("other", None, None)
+    assert cache.get(other, "tell me about sui", query_vector=[1.0, 0.0]) is None
+    assert cache.stats()["semantic_hits"] == 1
+
+
+def test_semantic_matching_is_off_by_default_threshold():
+    cache = ResponseCache(ttl_seconds=60, max_entries=10, similarity_threshold=0)
+    assert not cache.semantic
+    cache.put("posts", SCOPE, "what is sui", answer("a chain"), query_vector=[1.0, 0.0])
+    assert cache.get(SCOPE, "tell me about sui", query_vector=[1.0, 0.0]) is None
+
+
+def test_invalidation_drops_only_that_collection():
+    cache = ResponseCache(ttl_seconds=60, max_entries=10, similarity_threshold=0)
+    other = ResponseCache.make_scope("news", None, None)
+    cache.put("posts", SCOPE, "q", answer("posts"))
+    cache.put("news", other, "q", answer("news"))
+    cache.invalidate_collection("posts")
+    assert cache.get(SCOPE, "q") is None
+    assert cache.get(other, "q") == answer("news")
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_answer_retrieved_before_a_change_is_not_cached():
+    cache = ResponseCache(ttl_seconds=60, max_entries=10, similarity_threshold=0)
+    generation = cache.generation("posts")
+    # data is added while the LLM is still answering from the old retrieval
+    cache.invalidate_collection("posts")
+    cache.put("posts", SCOPE, "q", answer("stale"), generation=generation)
+    assert cache.get(SCOPE, "q") is None
+    assert cache.stats()["stale_puts"] == 1
+
+    cache.put("posts", SCOPE, "q", answer("fresh"), generation=cache.generation("posts"))
+    assert cache.get(SCOPE, "q") == answer("fresh")
+
+
+def test_changes_to_other_collections_keep_the_answer():
+    cache = ResponseCache(ttl_seconds=60, max_entries=10, similarity_threshold=0)
+    generation = cache.generation("posts")
+    cache.invalidate_collection("news")
+    cache.put("posts", SCOPE, "q", answer("ok"), generation=generation)
+    assert cache.get(SCOPE, "q") == answer("ok")
@@ -0,0 +1,171 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+from services.single_flight import AsyncSingleFlight, SingleFlight, flight_key
+
+
+def test_flight_key_ignores_dict_key_order():
+    assert flight_key("q", {"a": 1, "b": 2}) == flight_key("q", {"b": 2, "a": 1})
+    assert flight_key("q", {"a": 1}) != flight_key("q", {"a": 2})
+
+
+def test_concurrent_identical_calls_share_one_call():
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def main():
+        flights = AsyncSingleFlight()
+        results = await asyncio.gather(*(flights.do("key", work) for _ in range(5)))
+        return results, flights.stats()
+
+    results, stats = asyncio.run(main())
+    assert len(calls) == 1
+    assert [result for result, _ in results] == ["result"] * 5
+    assert sorted(shared for _, shared in results) == [False] + [True] * 4
+    assert stats == {"in_flight": 0, "calls": 1, "coalesced": 4}
+
+
+def test_different_keys_and_later_calls_run_separately():
+    calls = []
+
+    async def work():
+        calls.append(1)
+        return len(calls)
+
+    async def main():
+        flights = AsyncSingleFlight()
+        await asyncio.gather(flights.do("a", work), flights.do("b", work))
+        # nothing is kept once a call finished
+        return await flights.do("a", work)
+
+    assert asyncio.run(main()) == (3, False)
+
+
+def test_exceptions_reach_every_waiter():
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def main():
+        flights = AsyncSingleFlight()
+        return await asyncio.gather(*(flights.do("key", fail) for _ in range(3)), return_exceptions=True)
+
+    assert [str(result) for result in asyncio.run(main())] == ["boom"] * 3
+
+
+def test_call_survives_while_a_waiter_remains():
+    async def main():
+        flights = AsyncSingleFlight()
+        started = asyncio.Event()
+
+        async def work():
+            started.set()
+            await asyncio.sleep(0.05)
+            return "done"
+
+        first = asyncio.create_task(flights.do("key", work))
+        await started.wait()
+        second = asyncio.create_task(flights.do("key", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == ("done", True)
+
+
+def test_call_is_cancelled_when_every_waiter_is():
+    cancelled = []
+
+    async def main():
+        flights = AsyncSingleFlight()
+
+        async def work():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        task = asyncio.create_task(flights.do("key", work))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0)
+        return flights.stats()["in_flight"]
+
+    assert asyncio.run(main()) == 0
+    assert cancelled == [True]
+
+
+def test_forget_starts_a_new_call_for_later_callers():
+    async def main():
+        flights = AsyncSingleFlight()
+        release = asyncio.Event()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await release.wait()
+            return len(calls)
+
+        first = asyncio.create_task(flights.do("key", work))
+        await asyncio.sleep(0)
+        flights.forget()
+        second = asyncio.create_task(flights.do("key", work))
+        await asyncio.sleep(0)
+        release.set()
+        return await first, await second
+
+    assert asyncio.run(main()) == ((2, False), (2, False))
+
+
+def test_threads_share_one_blocking_call():
+    flights = SingleFlight()
+    entered, release = threading.Event(), threading.Event()
+    calls, results = [], []
+
+    def work():
+        calls.append(1)
+        entered.set()
+        release.wait(5)
+        return "result"
+
+    def caller():
+        results.append(flights.do("key", work))
+
+    leader = threading.Thread(target=caller)
+    leader.start()
+    entered.wait(5)
+    followers = [threading.Thread(target=caller) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    # followers block on the leader's future, counted as coalesced once they asked
+    deadline = time.monotonic() + 5
+    while flights.stats()["coalesced"] < 3 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert sorted(results) == [("result", False)] + [("result", True)] * 3
+    assert flights.stats() == {"in_flight": 0, "calls": 1, "coalesced": 3}
+
+
+def test_failed_thread_call_is_not_kept():
+    flights = SingleFlight()
+
+    def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        flights.do("key", fail)
+    assert flights.do("key", lambda: "ok") == ("ok", False)
@@ -0,0 +1,448 @@
+import os
+import asyncio
+from itertools import islice
+from typing import Callable, List, Dict, Union, Optional
+from dotenv import load_dotenv
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.fastembed_common import QueryResponse
+from qdrant_client.http.models import PointStruct, QueryRequest, OverwritePayloadOperation, SetPayload
+
+from vector_db.qdrant_wrapper import hybrid_query_args, points_to_query_responses, strip_internal_fields
+from vector_db.collection_config import CollectionConfig, migration_report
+from vector_db.filter_compiler import compile_filter
+from vector_db.embedding_service import EmbeddingService
+from vector_db.chunking import TokenChunker, tokenizer_for_client
+from vector_db.point_ids import key_chunks, chunk_point, plan_upsert, count_chunks, stale_chunks_filter, check_unique_ids
+from services.single_flight import AsyncSingleFlight, flight_key
+from services.metrics import track_stage, EMBEDDING_SECONDS, QDRANT_SEARCH_SECONDS, QDRANT_UPSERT_SECONDS
+
+
+class AsyncQdrantWrapper:
+    """
+    Async counterpart of QdrantWrapper built on AsyncQdrantClient, so the
+    FastAPI handlers can await qdrant round trips instead of blocking the event loop.
+    """
+
+    def __init__(self, collection_name: str = "test_collection0", client: Optional[AsyncQdrantClient] = None, embedding_service: Optional[EmbeddingService] = None, on_change: Optional[Callable[[str], None]] = None, collection_config: Optional[CollectionConfig] = None):
+        """
+        Args:
+            collection_name: Name of the collection to use
+            client: Optional shared AsyncQdrantClient (see vector_db/client_pool.py). A new client is created if not given.
+            embedding_service: Optional EmbeddingService. When given, embeddings are computed off the event loop
+                and sent to qdrant as vectors; otherwise the client's inline fastembed integration is used.
+            on_change: Optional callback called with the collection name after data is added or deleted
+                (e.g. to invalidate cached chat responses)
+            collection_config: Layout of collections created by the embedding service path and by aprovision()
+                (see vector_db/collection_config.py). Read from .env if not given.
+        """
+        load_dotenv()
+
+        if client is None:
+            client = AsyncQdrantClient(
+                url=os.getenv("QDRANT_URL"),
+                api_key=os.getenv("QDRANT_API_KEY"),
+            )
+        self.client = client
+
+        self.batch_size = int(os.getenv("INGEST_BATCH_SIZE", 64))
+        self.skip_unchanged = os.getenv("INGEST_SKIP_UNCHANGED", "true").lower() in ("1", "true", "yes")
+        self._chunker = None
+
+        self.collection_name = collection_name
+        self.embedding_service = embedding_service
+        self._collection_ready = False
+        self._has_sparse: Optional[bool] = None
+        self.on_change = on_change
+        self.collection_config = collection_config or CollectionConfig()
+        # identical concurrent queries share one search
+        self.query_flights = AsyncSingleFlight()
+
+    def _notify_change(self):
+        # queries started before the change must not answer queries made after it
+        self.query_flights.forget()
+        if self.on_change is not None:
+            self.on_change(self.collection_name)
+
+    def get_chunker(self) -> TokenChunker:
+        """
+        Token based chunker using the embedding model's tokenizer (see vector_db/chunking.py).
+        Blocking on first call (loads the model), so call it off the event loop.
+        """
+        if self._chunker is None:
+            if self.embedding_service is not None:
+                tokenizer = self.embedding_service.tokenizer()
+            else:
+                tokenizer = tokenizer_for_client(self.client)
+            self._chunker = TokenChunker(tokenizer=tokenizer)
+        return self._chunker
+
+    async def aadd_data(self, text: Union[str, List[str]], metadata: Optional[Union[Dict, List[Dict]]] = None, add_metadata=False) -> List:
+        """
+        Add text data to the Qdrant collection with optional metadata.
+
+        Args:
+            text: Single string or list of strings to add
+            metadata: Optional metadata dict or list of dicts, one per text item
+            add_metadata: Whether to add metadata to the documents
+
+        Returns:
+            List of IDs for the added items. Ids are derived from the document (its DOCUMENT_ID_FIELD
+            metadata, default source_id, or its text) and chunk index, so adding a document again
+            updates its points instead of duplicating them. Raises DuplicateDocumentError if two
+            documents have the same id.
+        """
+        if isinstance(text, str):
+            text = [text]
+
+        if not add_metadata or metadata is None:
+            metadata = [{}] * len(text)
+        elif isinstance(metadata, dict):
+            metadata = [metadata]
+
+        if len(text) != len(metadata):
+            raise ValueError("Number of text items must match number of metadata items")
+        check_unique_ids(metadata)
+
+        # Chunking is lazy and CPU bound: pull one batch of chunks at a time off the event loop,
+        # then embed and upsert it, so memory is bounded by batch_size rather than document size.
+        loop = asyncio.get_running_loop()
+        chunker = await loop.run_in_executor(None, self.get_chunker)
+        chunks = key_chunks(chunker, text, metadata)
+        ids = []
+        chunk_counts: Dict[str, int] = {}
+        while True:
+            batch = await loop.run_in_executor(None, lambda: list(islice(chunks, self.batch_size)))
+            if not batch:
+                break
+            texts, metadatas = [chunk for chunk, _ in batch], [meta for _, meta in batch]
+            ids += await self.aupsert_chunks(texts, metadatas)
+            count_chunks(chunk_counts, metadatas)
+
+        await self.adelete_stale_chunks(chunk_counts)
+        return ids
+
+    async def aupsert_chunks(self, texts: List[str], metadatas: List[Dict]) -> List:
+        """
+        Embed and store one batch of already chunked texts under deterministic ids (see
+        vector_db/point_ids.py). With skip_unchanged (INGEST_SKIP_UNCHANGED, default true),
+        chunks whose stored content hash matches are not embedded again; only their payload
+        is updated if the metadata changed.
+
+        Returns:
+            List of IDs for the added items
+        """
+        points = [chunk_point(self.collection_name, text, meta) for text, meta in zip(texts, metadatas)]
+        ids, payloads = [id_ for id_, _ in points], [payload for _, payload in points]
+        if self.embedding_service is not None:
+            await self._ensure_collection()
+
+        to_embed, to_update = list(range(len(ids))), []
+        if self.skip_unchanged and ids and await self._collection_exists():
+            stored = await self.client.retrieve(collection_name=self.collection_name, ids=ids, with_payload=True, with_vectors=False)
+            to_embed, to_update = plan_upsert(ids, payloads, {str(point.id): point.payload for point in stored})
+
+        if to_update:
+            await self.client.batch_update_points(
+                collection_name=self.collection_name,
+                update_operations=[OverwritePayloadOperation(overwrite_payload=SetPayload(payload=payloads[i], points=[ids[i]])) for i in to_update]
+            )
+        if to_embed:
+            await self._upsert_points([ids[i] for i in to_embed], [texts[i] for i in to_embed], [payloads[i] for i in to_embed])
+        if to_embed or to_update:
+            self._notify_change()
+        return ids
+
+    async def _collection_exists(self) -> bool:
+        return self._collection_ready or await self.client.collection_exists(self.collection_name)
+
+    async def _upsert_points(self, ids: List[str], texts: List[str], payloads: List[Dict]):
+        if self.embedding_service is None:
+            # the client embeds inline, so this includes embedding time
+            with track_stage(QDRANT_UPSERT_SECONDS, "qdrant_upsert", collection=self.collection_name):
+                await self.client.add(
+                    collection_name=self.collection_name,
+                    documents=texts,
+                    metadata=payloads,
+                    ids=ids
+                )
+            return
+
+        with track_stage(EMBEDDING_SECONDS, "embedding", collection=self.collection_name, kind="document"):
+            if await self._sparse_enabled():
+                vectors, sparse_vectors = await asyncio.gather(
+                    self.embedding_service.embed_documents(texts),
+                    self.embedding_service.embed_sparse_documents(texts),
+                )
+            else:
+                vectors, sparse_vectors = await self.embedding_service.embed_documents(texts), [None] * len(texts)
+
+        # same point layout as client.add (with a sparse model set), so both paths can read each other's data
+        vector_name = self.embedding_service.vector_name
+        sparse_name = self.embedding_service.sparse_vector_name
+        points = [
+            PointStruct(
+                id=id_,
+                vector={vector_name: vector, **({sparse_name: sparse_vector} if sparse_vector is not None else {})},
+                payload=payload
+            )
+            for id_, payload, vector, sparse_vector in zip(ids, payloads, vectors, sparse_vectors)
+        ]
+        with track_stage(QDRANT_UPSERT_SECONDS, "qdrant_upsert", collection=self.collection_name):
+            await self.client.upsert(collection_name=self.collection_name, points=points)
+
+    async def adelete_stale_chunks(self, chunk_counts: Dict[str, int], documents_per_request: int = 100):
+        """
+        Delete chunks past the current end of re-ingested documents (left over when an edited
+        document got shorter). chunk_counts maps document keys to their number of chunks.
+        """
+        keys = list(chunk_counts)
+        for start in range(0, len(keys), documents_per_request):
+            stale_filter = stale_chunks_filter({key: chunk_counts[key] for key in keys[start:start + documents_per_request]})
+            await self.client.delete(collection_name=self.collection_name, points_selector=stale_filter)
+        if keys:
+            self._notify_change()
+
+    async def _ensure_collection(self):
+        """
+        Create the collection with the fastembed vector layout (plus the sparse vector, if
+        the service has a sparse model) if it doesn't exist yet.
+        """
+        if self._collection_ready:
+            return
+        if not await self.client.collection_exists(self.collection_name):
+            await self.aprovision()
+        self._collection_ready = True
+
+    async def aprovision(self, collection_config: Optional[CollectionConfig] = None) -> Dict:
+        """
+        Create the collection with the configured HNSW / quantization / on-disk layout and
+        payload indexes, or migrate an existing collection to it in place (qdrant rebuilds
+        the index in the background while search keeps working). Needs an embedding service.
+
+        Returns:
+            What was done: {"created", "updated", "indexes_created", "warnings"}
+        """
+        if self.embedding_service is None:
+            raise ValueError("Provisioning collections needs an embedding service")
+        config = collection_config or self.collection_config
+        self.collection_config = config
+        vector_name = self.embedding_service.vector_name
+        sparse_name = self.embedding_service.sparse_vector_name
+
+        created, args, warnings = False, {}, []
+        if not await self.client.collection_exists(self.collection_name):
+            await self.client.create_collection(
+                collection_name=self.collection_name,
+                **config.create_collection_args(vector_name, self.embedding_service.vector_params(), sparse_name, self.embedding_service.sparse_vector_params())
+            )
+            self._has_sparse = sparse_name is not None
+            created = True
+        else:
+            info = await self.client.get_collection(self.collection_name)
+            args = config.migration_args(info, vector_name)
+            if args:
+                await self.client.update_collection(collection_name=self.collection_name, **args)
+            if sparse_name and sparse_name not in (info.config.params.sparse_vectors or {}):
+                warnings.append(f"no sparse vectors ({sparse_name}): hybrid search needs the data re-ingested into a new collection")
+
+        indexes = config.missing_payload_indexes(await self.client.get_collection(self.collection_name))
+        for field, schema in indexes.items():
+            await self.client.create_payload_index(collection_name=self.collection_name, field_name=field, field_schema=schema)
+        self._collection_ready = True
+        return migration_report(created, args, indexes, warnings)
+
+    async def _sparse_enabled(self) -> bool:
+        """
+        Whether the collection stores sparse vectors of the service's sparse model
+        (collections created before hybrid search was enabled don't).
+        """
+        if self.embedding_service is None or self.embedding_service.sparse_vector_name is None:
+            return False
+        if self._has_sparse is None:
+            if not await self.client.collection_exists(self.collection_name):
+                return False
+            info = await self.client.get_collection(self.collection_name)
+            self._has_sparse = self.embedding_service.sparse_vector_name in (info.config.params.sparse_vectors or {})
+        return self._has_sparse
+
+    async def _search(self, text: str, query_filter, limit: int, hybrid: bool = False) -> List[QueryResponse]:
+        if hybrid:
+            if await self._sparse_enabled():
+                return await self._hybrid_search(text, query_filter, limit)
+            print(f'collection {self.collection_name} has no sparse vectors, using dense search')
+
+        if self.embedding_service is None:
+            # the client embeds inline, so this includes embedding time
+            with track_stage(QDRANT_SEARCH_SECONDS, "qdrant_search", collection=self.collection_name, mode="dense"):
+                return strip_internal_fields(await self.client.query(
+                    collection_name=self.collection_name,
+                    query_text=text,
+                    query_filter=query_filter,
+                    limit=limit
+                ))
+
+        with track_stage(EMBEDDING_SECONDS, "embedding", collection=self.collection_name, kind="query"):
+            vector = await self.embedding_service.embed_query(text)
+        with track_stage(QDRANT_SEARCH_SECONDS, "qdrant_search", collection=self.collection_name, mode="dense"):
+            response = await self.client.query_points(
+                collection_name=self.collection_name,
+                query=vector,
+                using=self.embedding_service.vector_name,
+                query_filter=query_filter,
+                search_params=self.collection_config.search_params(),
+                limit=limit,
+                with_payload=True,
+            )
+        return points_to_query_responses(response.points)
+
+    async def _hybrid_search(self, text: str, query_filter, limit: int) -> List[QueryResponse]:
+        """
+        Dense and sparse search in one request, fused with reciprocal rank fusion.
+        """
+        with track_stage(EMBEDDING_SECONDS, "embedding", collection=self.collection_name, kind="query"):
+            dense_vector, sparse_vector = await asyncio.gather(
+                self.embedding_service.embed_query(text),
+                self.embedding_service.embed_sparse_query(text),
+            )
+        with track_stage(QDRANT_SEARCH_SECONDS, "qdrant_search", collection=self.collection_name, mode="hybrid"):
+            response = await self.client.query_points(
+                collection_name=self.collection_name,
+                **hybrid_query_args(dense_vector, self.embedding_service.vector_name, sparse_vector, self.embedding_service.sparse_vector_name, query_filter, limit, self.collection_config.search_params())
+            )
+        return points_to_query_responses(response.points)
+
+    async def aquery(self, text: str, metadata_filter: Optional[Dict] = None, limit: int = 5, use_metadata=False, hybrid: bool = False) -> List[Dict]:
+        """
+        Query the Qdrant collection for documents matching the query text and optional metadata filter.
+
+        Args:
+            text: Query text
+            metadata_filter: Optional metadata filter (e.g., {"source": "some_source"}, {"views": {"$gt": 100}}, see vector_db/filter_compiler.py)
+            limit: Maximum number of results to return
+            use_metadata: Whether to apply metadata_filter and format the results as dicts
+            hybrid: Fuse dense results with a sparse keyword (e.g. BM25) search using RRF.
+                Needs an embedding service with a sparse model; falls back to dense search otherwise.
+
+        Returns:
+            List of dictionaries containing matches with text and metadata.
+            Concurrent identical queries share one search and the same result list, don't modify it.
+        """
+        key = flight_key(text, metadata_filter if use_metadata else None, limit, use_metadata, hybrid)
+        results, _ = await self.query_flights.do(key, lambda: self._aquery(text, metadata_filter, limit, use_metadata, hybrid))
+        return results
+
+    async def _aquery(self, text: str, metadata_filter: Optional[Dict], limit: int, use_metadata: bool, hybrid: bool) -> List[Dict]:
+        if not use_metadata:
+            return await self._search(text, None, limit, hybrid)
+
+        search_results = await self._search(text, compile_filter(metadata_filter), limit, hybrid)
+
+        results = []
+        for item in search_results:
+            results.append({
+                "text": item.document,
+                "metadata": item.metadata,
+                "score": item.score
+            })
+
+        return results
+
+    async def aquery_batch(self, queries: List[Dict], dense_vectors: Optional[List[List[float]]] = None) -> List[List]:
+        """
+        Run several queries against the collection in one round trip (query_batch_points),
+        with all query texts embedded in one call.
+
+        Args:
+            queries: One dict per query with the arguments of aquery: "text" and optional
+                "metadata_filter", "limit" (default 5), "use_metadata" (default False) and "hybrid"
+            dense_vectors: Vectors of the query texts if they are already embedded
+                (e.g. when one batch spans several collections)
+
+        Returns:
+            One list of results per query, in order, formatted like aquery's
+        """
+        if not queries:
+            return []
+        if self.embedding_service is None:
+            return list(await asyncio.gather(*(
+                self.aquery(query["text"], query.get("metadata_filter"), query.get("limit", 5), query.get("use_metadata", False), query.get("hybrid", False))
+                for query in queries
+            )))
+
+        texts = [query["text"] for query in queries]
+        if dense_vectors is None:
+            with track_stage(EMBEDDING_SECONDS, "embedding", collection=self.collection_name, kind="query"):
+                dense_vectors = await self.embedding_service.embed_queries(texts)
+
+        sparse_vectors = {}
+        hybrid = [i for i, query in enumerate(queries) if query.get("hybrid")]
+        if hybrid:
+            if await self._sparse_enabled():
+                with track_stage(EMBEDDING_SECONDS, "embedding", collection=self.collection_name, kind="sparse_query"):
+                    sparse_vectors = dict(zip(hybrid, await self.embedding_service.embed_sparse_queries([texts[i] for i in hybrid])))
+            else:
+                print(f'collection {self.collection_name} has no sparse vectors, using dense search')
+
+        search_params = self.collection_config.search_params()
+        requests = []
+        for i, query in enumerate(queries):
+            query_filter = compile_filter(query.get("metadata_filter")) if query.get("use_metadata", False) else None
+            limit = query.get("limit", 5)
+            if i in sparse_vectors:
+                requests.append(QueryRequest(**hybrid_query_args(dense_vectors[i], self.embedding_service.vector_name, sparse_vectors[i], self.embedding_service.sparse_vector_name, query_filter, limit, search_params)))
+            else:
+                requests.append(QueryRequest(query=dense_vectors[i], using=self.embedding_service.vector_name, filter=query_filter, params=search_params, limit=limit, with_payload=True))
+
+        with track_stage(QDRANT_SEARCH_SECONDS, "qdrant_search", collection=self.collection_name, mode="batch"):
+            responses = await self.client.query_batch_points(collection_name=self.collection_name, requests=requests)
+
+        results = []
+        for query, response in zip(queries, responses):
+            search_results = points_to_query_responses(response.points)
+            if query.get("use_metadata", False):
+                search_results = [{"text": item.document, "metadata": item.metadata, "score": item.score} for item in search_results]
+            results.append(search_results)
+        return results
+
+    async def adelete_by_metadata(self, metadata_filter: Dict) -> bool:
+        """
+        Delete points from the collection based on metadata filter.
+
+        Args:
+            metadata_filter: Metadata to filter points to delete
+
+        Returns:
+            True if operation was successful
+        """
+        delete_filter = compile_filter(metadata_filter)
+        if delete_filter:
+            await self.client.delete(
+                collection_name=self.collection_name,
+                points_selector=delete_filter
+            )
+            self._notify_change()
+            return True
+
+        return False
+
+    async def aget_collection_info(self) -> Dict:
+        """
+        Get information about the collection.
+        """
+        return (await self.client.get_collection(self.collection_name)).dict()
+
+    async def acount_documents(self, metadata_filter: Optional[Dict] = None) -> int:
+        """
+        Count documents in the collection, optionally filtered by metadata.
+
+        Args:
+            metadata_filter: Optional metadata to filter results
+
+        Returns:
+            Number of documents
+        """
+        result = await self.client.count(
+            collection_name=self.collection_name,
+            count_filter=compile_filter(metadata_filter)
+        )
+        return result.count
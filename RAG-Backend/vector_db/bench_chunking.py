@@ -0,0 +1,68 @@
+"""
+Chunking throughput benchmark.
+
+    python -m vector_db.bench_chunking --mb 4 --tokenizer approx
+    python -m vector_db.bench_chunking --mb 4 --tokenizer fastembed   # needs the embedding model
+
+Generates a synthetic multi-megabyte document (paragraphs of sentences, plus some very
+long run-on sentences) and reports chunks/s and MB/s for TokenChunker.iter_chunks.
+"""
+import argparse
+import random
+import time
+
+from vector_db.chunking import TokenChunker, load_tokenizer
+
+WORDS = "sui token creator post blog content learning course chain wallet address move contract reward nft community".split()
+
+
+def make_document(size_mb: float, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    target = int(size_mb * 1024 * 1024)
+    paragraphs, size = [], 0
+    while size < target:
+        sentences = []
+        for _ in range(rng.randint(3, 8)):
+            # every 50th sentence is a run-on longer than a whole chunk
+            length = rng.randint(600, 900) if rng.random() < 0.02 else rng.randint(6, 30)
+            sentences.append(" ".join(rng.choice(WORDS) for _ in range(length)).capitalize() + rng.choice(".!?"))
+        paragraph = " ".join(sentences)
+        paragraphs.append(paragraph)
+        size += len(paragraph) + 2
+    return "\n\n".join(paragraphs)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=float, default=4)
+    parser.add_argument("--tokenizer", choices=["approx", "fastembed"], default="approx")
+    parser.add_argument("--chunk-tokens", type=int, default=384)
+    parser.add_argument("--overlap-tokens", type=int, default=48)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    tokenizer = None
+    if args.tokenizer == "fastembed":
+        from fastembed import TextEmbedding
+        from qdrant_client.qdrant_fastembed import QdrantFastembedMixin
+        tokenizer = load_tokenizer(TextEmbedding(model_name=QdrantFastembedMixin.DEFAULT_EMBEDDING_MODEL))
+
+    chunker = TokenChunker(tokenizer=tokenizer, chunk_tokens=args.chunk_tokens, overlap_tokens=args.overlap_tokens)
+    document = make_document(args.mb)
+    size_mb = len(document) / (1024 * 1024)
+
+    for run in range(args.repeat):
+        start = time.perf_counter()
+        n_chunks = 0
+        max_tokens = 0
+        for chunk in chunker.iter_chunks(document):
+            n_chunks += 1
+            if n_chunks % 100 == 0:
+                max_tokens = max(max_tokens, chunker.count_tokens(chunk))
+        seconds = time.perf_counter() - start
+        print(f"run {run}: {size_mb:.1f} MB -> {n_chunks} chunks in {seconds:.2f}s "
+              f"({n_chunks / seconds:.0f} chunks/s, {size_mb / seconds:.2f} MB/s, sampled max tokens {max_tokens})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import os
+import re
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+# A unit is a sentence: starts at a non-space character and runs to sentence punctuation
+# followed by whitespace, to a paragraph break or to the end of the text.
+UNIT_PATTERN = re.compile(r"\S.*?(?:[.!?][\"')\]]*(?=\s)|(?=\n\s*\n)|\Z)", re.DOTALL)
+
+# Used to count tokens when the embedder's tokenizer is not available.
+APPROX_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# Number of sentences sent to the tokenizer at once.
+ENCODE_BATCH_SIZE = 256
+
+
+def load_tokenizer(embedding_model):
+    """
+    Return a copy of a fastembed TextEmbedding's tokenizer with truncation and padding
+    disabled (the model's own copy truncates at its max length), or None if unavailable.
+    """
+    tokenizer = getattr(getattr(embedding_model, "model", None), "tokenizer", None)
+    if tokenizer is None:
+        return None
+
+    from tokenizers import Tokenizer
+    tokenizer = Tokenizer.from_str(tokenizer.to_str())
+    tokenizer.no_truncation()
+    tokenizer.no_padding()
+    return tokenizer
+
+
+def tokenizer_for_client(client):
+    """
+    Tokenizer of the fastembed model a (sync or async) qdrant client embeds with.
+    Returns None, so token counts are approximated, if the model can't be loaded.
+    """
+    try:
+        return load_tokenizer(client._get_or_init_model(model_name=client.embedding_model_name))
+    except Exception as ex:
+        print(f'could not load embedding tokenizer, approximating token counts: {ex}')
+        return None
+
+
+class TokenChunker:
+    """
+    Token-count based chunker with sentence/paragraph boundary awareness.
+
+    Sentences are packed into chunks of at most chunk_tokens tokens (measured with the
+    embedding model's tokenizer), consecutive chunks share up to overlap_tokens tokens of
+    trailing sentences, and a sentence longer than a whole chunk is split at word boundaries.
+    Chunks are produced lazily and sliced from the original text, so paragraph breaks are
+    kept and a large document is never copied into a list of pieces.
+    """
+
+    def __init__(self, tokenizer=None, chunk_tokens: Optional[int] = None, overlap_tokens: Optional[int] = None):
+        """
+        Args:
+            tokenizer: A `tokenizers.Tokenizer` (see load_tokenizer). Falls back to a word/punctuation count if None.
+            chunk_tokens: Max tokens per chunk (default: CHUNK_TOKENS or 384)
+            overlap_tokens: Tokens shared by consecutive chunks (default: CHUNK_OVERLAP_TOKENS or 48)
+        """
+        load_dotenv()
+
+        self.tokenizer = tokenizer
+        self.chunk_tokens = int(chunk_tokens if chunk_tokens is not None else os.getenv("CHUNK_TOKENS", 384))
+        self.overlap_tokens = int(overlap_tokens if overlap_tokens is not None else os.getenv("CHUNK_OVERLAP_TOKENS", 48))
+
+        if self.chunk_tokens < 1:
+            raise ValueError("CHUNK_TOKENS must be at least 1")
+        if not 0 <= self.overlap_tokens < self.chunk_tokens:
+            raise ValueError(f"CHUNK_OVERLAP_TOKENS must be >= 0 and smaller than CHUNK_TOKENS ({self.overlap_tokens} >= {self.chunk_tokens})")
+
+    def _token_offsets(self, texts: List[str]) -> List[List[Tuple[int, int]]]:
+        """
+        Character offsets of every token, per text.
+        """
+        if self.tokenizer is None:
+            return [[match.span() for match in APPROX_TOKEN_PATTERN.finditer(text)] for text in texts]
+        encodings = self.tokenizer.encode_batch(texts, add_special_tokens=False)
+        return [encoding.offsets for encoding in encodings]
+
+    def count_tokens(self, text: str) -> int:
+        return len(self._token_offsets([text])[0])
+
+    def _units(self, text: str) -> Iterator[Tuple[int, int, List[Tuple[int, int]]]]:
+        """
+        Yield (start, end, token offsets) of every sentence, tokenizing in batches.
+        """
+        matches = UNIT_PATTERN.finditer(text)
+        while True:
+            batch = list(islice(matches, ENCODE_BATCH_SIZE))
+            if not batch:
+                return
+            offsets = self._token_offsets([match.group() for match in batch])
+            for match, unit_offsets in zip(batch, offsets):
+                yield match.start(), match.end(), unit_offsets
+
+    def _split_long_unit(self, text: str, start: int, end: int, offsets: List[Tuple[int, int]]) -> Iterator[str]:
+        """
+        Split a sentence longer than chunk_tokens into token windows, preferring to cut
+        where a token starts a new word.
+        """
+        unit = text[start:end]
+        step_back = self.overlap_tokens
+        first = 0
+        while first < len(offsets):
+            last = min(first + self.chunk_tokens, len(offsets))
+            if last < len(offsets):
+                # move the cut back to a word start, but keep at least half a chunk
+                cut = last
+                while cut > first + self.chunk_tokens // 2 and not unit[offsets[cut][0] - 1:offsets[cut][0]].isspace():
+                    cut -= 1
+                if cut > first + self.chunk_tokens // 2:
+                    last = cut
+
+            chunk_end = offsets[last][0] if last < len(offsets) else len(unit)
+            yield unit[offsets[first][0]:chunk_end].strip()
+
+            if last >= len(offsets):
+                return
+            first = max(last - step_back, first + 1)
+
+    def iter_chunks(self, text: str) -> Iterator[str]:
+        """
+        Lazily yield the chunks of a single text.
+        """
+        pending: List[Tuple[int, int, int]] = []  # (start, end, n_tokens) of sentences in the current chunk
+        pending_tokens = 0
+        has_new = False  # whether pending holds more than the overlap carried from the previous chunk
+
+        for start, end, offsets in self._units(text):
+            n_tokens = len(offsets)
+
+            if n_tokens > self.chunk_tokens:
+                if has_new:
+                    yield text[pending[0][0]:pending[-1][1]]
+                yield from self._split_long_unit(text, start, end, offsets)
+                pending, pending_tokens, has_new = [], 0, False
+                continue
+
+            if pending_tokens + n_tokens > self.chunk_tokens and has_new:
+                yield text[pending[0][0]:pending[-1][1]]
+
+                # carry trailing sentences into the next chunk, as long as the new sentence still fits
+                budget = min(self.overlap_tokens, self.chunk_tokens - n_tokens)
+                carried, carried_tokens = [], 0
+                for unit in reversed(pending):
+                    if carried_tokens + unit[2] > budget:
+                        break
+                    carried.insert(0, unit)
+                    carried_tokens += unit[2]
+                pending, pending_tokens, has_new = carried, carried_tokens, False
+
+            pending.append((start, end, n_tokens))
+            pending_tokens += n_tokens
+            has_new = True
+
+        if has_new:
+            yield text[pending[0][0]:pending[-1][1]]
+
+    def split(self, texts: Iterable[str], metadatas: Iterable[Dict]) -> Iterator[Tuple[str, Dict]]:
+        """
+        Lazily yield (chunk, metadata) pairs for parallel iterables of texts and metadata.
+        """
+        for text, metadata in zip(texts, metadatas):
+            for chunk in self.iter_chunks(text):
+                yield chunk, metadata
@@ -0,0 +1,147 @@
+import os
+import asyncio
+import threading
+from typing import Callable, Dict, Optional
+
+import httpx
+from dotenv import load_dotenv
+from qdrant_client import QdrantClient, AsyncQdrantClient
+
+from vector_db.qdrant_wrapper import QdrantWrapper
+from vector_db.async_qdrant_wrapper import AsyncQdrantWrapper
+from vector_db.embedding_service import EmbeddingService
+from vector_db.collection_config import CollectionConfig
+
+
+class QdrantClientPool:
+    """
+    Process-wide Qdrant connection pool.
+
+    One QdrantClient and one AsyncQdrantClient (and therefore one HTTP connection pool
+    each and one fastembed model) are created at startup and shared by a registry of
+    per-collection wrappers, so request handlers no longer pay connection setup and
+    model load on every call.
+    """
+
+    def __init__(self, url: Optional[str] = None, api_key: Optional[str] = None, pool_size: Optional[int] = None, timeout: Optional[int] = None, health_timeout: Optional[float] = None, embedding_service: Optional[EmbeddingService] = None, on_collection_change: Optional[Callable[[str], None]] = None, collection_config: Optional[CollectionConfig] = None):
+        """
+        Args:
+            url: Qdrant url (default: QDRANT_URL from .env)
+            api_key: Qdrant api key (default: QDRANT_API_KEY from .env)
+            pool_size: Max number of open http connections (default: QDRANT_POOL_SIZE or 10)
+            timeout: Request timeout in seconds (default: QDRANT_TIMEOUT or 30)
+            health_timeout: Seconds the async health check waits before reporting qdrant as down (default: QDRANT_HEALTH_TIMEOUT or 2)
+            embedding_service: Optional shared EmbeddingService handed to the sync and async wrappers
+            on_collection_change: Optional callback the async wrappers call after adding or deleting data
+            collection_config: Layout used to create / provision collections (default: read from .env)
+        """
+        load_dotenv()
+
+        self.url = url or os.getenv("QDRANT_URL")
+        self.api_key = api_key or os.getenv("QDRANT_API_KEY")
+        self.pool_size = int(pool_size or os.getenv("QDRANT_POOL_SIZE", 10))
+        self.timeout = int(timeout or os.getenv("QDRANT_TIMEOUT", 30))
+        self.health_timeout = float(health_timeout or os.getenv("QDRANT_HEALTH_TIMEOUT", 2))
+        self.embedding_service = embedding_service
+        self.on_collection_change = on_collection_change
+        self.collection_config = collection_config or CollectionConfig()
+
+        if self.pool_size < 1:
+            raise ValueError("QDRANT_POOL_SIZE must be at least 1")
+
+        self.client = QdrantClient(
+            url=self.url,
+            api_key=self.api_key,
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+        )
+        self.async_client = AsyncQdrantClient(
+            url=self.url,
+            api_key=self.api_key,
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+        )
+
+        self._wrappers: Dict[str, QdrantWrapper] = {}
+        self._async_wrappers: Dict[str, AsyncQdrantWrapper] = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def get_wrapper(self, collection_name: str) -> QdrantWrapper:
+        """
+        Return the shared QdrantWrapper for a collection, creating it on first use.
+        """
+        if self._closed:
+            raise RuntimeError("Qdrant client pool is closed")
+
+        wrapper = self._wrappers.get(collection_name)
+        if wrapper is None:
+            with self._lock:
+                wrapper = self._wrappers.get(collection_name)
+                if wrapper is None:
+                    wrapper = QdrantWrapper(collection_name=collection_name, client=self.client, collection_config=self.collection_config, embedding_service=self.embedding_service)
+                    self._wrappers[collection_name] = wrapper
+        return wrapper
+
+    def get_async_wrapper(self, collection_name: str) -> AsyncQdrantWrapper:
+        """
+        Return the shared AsyncQdrantWrapper for a collection, creating it on first use.
+        """
+        if self._closed:
+            raise RuntimeError("Qdrant client pool is closed")
+
+        wrapper = self._async_wrappers.get(collection_name)
+        if wrapper is None:
+            with self._lock:
+                wrapper = self._async_wrappers.get(collection_name)
+                if wrapper is None:
+                    wrapper = AsyncQdrantWrapper(collection_name=collection_name, client=self.async_client, embedding_service=self.embedding_service, on_change=self.on_collection_change, collection_config=self.collection_config)
+                    self._async_wrappers[collection_name] = wrapper
+        return wrapper
+
+    def health_check(self) -> bool:
+        """
+        Check that the Qdrant server is reachable through the pooled client.
+        """
+        try:
+            self.client.get_collections()
+            return True
+        except Exception as ex:
+            print(f'qdrant health check failed: {ex}')
+            return False
+
+    async def ahealth_check(self) -> bool:
+        """
+        Async health check through the pooled AsyncQdrantClient. Gives up after health_timeout
+        rather than the full request timeout, so startup and /ready don't hang on a down qdrant.
+        """
+        try:
+            await asyncio.wait_for(self.async_client.get_collections(), self.health_timeout)
+            return True
+        except asyncio.TimeoutError:
+            print(f'qdrant health check timed out after {self.health_timeout:g}s')
+            return False
+        except Exception as ex:
+            print(f'qdrant health check failed: {ex}')
+            return False
+
+    def close(self):
+        """
+        Drop all registered wrappers and close the sync connections.
+        Use aclose() from async code to close the async client as well.
+        """
+        with self._lock:
+            self._wrappers.clear()
+            self._async_wrappers.clear()
+            if not self._closed:
+                self.client.close()
+                self._closed = True
+
+    async def aclose(self):
+        """
+        Drop all registered wrappers and close both sync and async connections.
+        """
+        was_closed = self._closed
+        self.close()
+        if not was_closed:
+            await self.async_client.close()
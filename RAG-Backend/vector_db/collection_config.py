@@ -0,0 +1,150 @@
+import os
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+from qdrant_client.http.models import (
+    BinaryQuantization,
+    BinaryQuantizationConfig,
+    Disabled,
+    HnswConfigDiff,
+    PayloadSchemaType,
+    QuantizationSearchParams,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    SearchParams,
+    SparseVectorParams,
+    VectorParams,
+    VectorParamsDiff,
+)
+
+QUANTIZATION_MODES = ("none", "scalar", "binary")
+
+
+def parse_indexed_fields(spec: str) -> Dict[str, str]:
+    """
+    Parse "source:keyword,creator_id:keyword,published_at:datetime" into {field: schema}.
+    A field without a schema is indexed as keyword.
+    """
+    fields = {}
+    for item in spec.split(","):
+        if item.strip():
+            field, _, schema = item.partition(":")
+            fields[field.strip()] = (schema.strip() or "keyword").lower()
+    return fields
+
+
+class CollectionConfig:
+    """
+    How collections are laid out in qdrant: HNSW graph parameters, optional scalar/binary
+    quantization (searched with rescoring of the original vectors), on-disk storage of the
+    original vectors and payload indexes for the metadata fields used in filters.
+    """
+
+    def __init__(self, hnsw_m: Optional[int] = None, hnsw_ef_construct: Optional[int] = None, quantization: Optional[str] = None, on_disk_vectors: Optional[bool] = None, oversampling: Optional[float] = None, indexed_fields: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            hnsw_m: Edges per node of the HNSW graph (default: QDRANT_HNSW_M or 16)
+            hnsw_ef_construct: Neighbours considered while building the graph (default: QDRANT_HNSW_EF_CONSTRUCT or 100)
+            quantization: "none", "scalar" (int8, 4x smaller) or "binary" (32x smaller, for large models) (default: QDRANT_QUANTIZATION or none)
+            on_disk_vectors: Keep original vectors on disk, only the (quantized) index in RAM (default: QDRANT_ON_DISK_VECTORS or false)
+            oversampling: Candidates fetched with quantized vectors per result before rescoring (default: QDRANT_OVERSAMPLING or 2.0)
+            indexed_fields: Payload fields to index, {field: keyword|integer|float|bool|datetime|text|uuid|geo}
+                (default: QDRANT_INDEXED_FIELDS or "source:keyword,document_key:keyword")
+        """
+        load_dotenv()
+
+        self.hnsw_m = int(hnsw_m or os.getenv("QDRANT_HNSW_M", 16))
+        self.hnsw_ef_construct = int(hnsw_ef_construct or os.getenv("QDRANT_HNSW_EF_CONSTRUCT", 100))
+        self.quantization = (quantization or os.getenv("QDRANT_QUANTIZATION") or "none").lower()
+        if on_disk_vectors is None:
+            on_disk_vectors = os.getenv("QDRANT_ON_DISK_VECTORS", "false").lower() in ("1", "true", "yes")
+        self.on_disk_vectors = on_disk_vectors
+        self.oversampling = float(oversampling or os.getenv("QDRANT_OVERSAMPLING", 2.0))
+        self.indexed_fields = indexed_fields if indexed_fields is not None else parse_indexed_fields(os.getenv("QDRANT_INDEXED_FIELDS", "source:keyword,document_key:keyword"))
+
+        if self.quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"QDRANT_QUANTIZATION must be one of {QUANTIZATION_MODES}, got {self.quantization}")
+        for field, schema in self.indexed_fields.items():
+            if schema.upper() not in PayloadSchemaType.__members__:
+                raise ValueError(f"Unknown payload index type {schema} for field {field}")
+
+    def hnsw_config(self) -> HnswConfigDiff:
+        return HnswConfigDiff(m=self.hnsw_m, ef_construct=self.hnsw_ef_construct)
+
+    def quantization_config(self):
+        if self.quantization == "scalar":
+            return ScalarQuantization(scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True))
+        if self.quantization == "binary":
+            return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+        return None
+
+    def search_params(self) -> Optional[SearchParams]:
+        """
+        Search params for quantized collections: oversample with the quantized vectors,
+        then rescore with the originals. None when quantization is off.
+        """
+        if self.quantization == "none":
+            return None
+        return SearchParams(quantization=QuantizationSearchParams(rescore=True, oversampling=self.oversampling))
+
+    def payload_schemas(self) -> Dict[str, PayloadSchemaType]:
+        return {field: PayloadSchemaType[schema.upper()] for field, schema in self.indexed_fields.items()}
+
+    def create_collection_args(self, vector_name: str, vector_params: VectorParams, sparse_name: Optional[str] = None, sparse_params: Optional[SparseVectorParams] = None) -> Dict[str, Any]:
+        """
+        Keyword arguments for create_collection with this layout.
+        """
+        vector_params = vector_params.model_copy(update={"on_disk": self.on_disk_vectors})
+        return {
+            "vectors_config": {vector_name: vector_params},
+            "sparse_vectors_config": {sparse_name: sparse_params} if sparse_name else None,
+            "hnsw_config": self.hnsw_config(),
+            "quantization_config": self.quantization_config(),
+        }
+
+    def migration_args(self, info, vector_name: str) -> Dict[str, Any]:
+        """
+        Keyword arguments for update_collection bringing an existing collection (its
+        get_collection info) to this layout, empty if it already matches. Qdrant applies the
+        changes in place and rebuilds the index in the background; search keeps working.
+        """
+        args: Dict[str, Any] = {}
+
+        hnsw = info.config.hnsw_config
+        if hnsw.m != self.hnsw_m or hnsw.ef_construct != self.hnsw_ef_construct:
+            args["hnsw_config"] = self.hnsw_config()
+
+        current = info.config.quantization_config
+        current_mode = "scalar" if isinstance(current, ScalarQuantization) else "binary" if isinstance(current, BinaryQuantization) else "none" if current is None else "other"
+        if current_mode != self.quantization:
+            args["quantization_config"] = self.quantization_config() or Disabled.DISABLED
+
+        vectors = info.config.params.vectors
+        params = vectors.get(vector_name) if isinstance(vectors, dict) else vectors
+        if params is not None and bool(params.on_disk) != self.on_disk_vectors:
+            args["vectors_config"] = {vector_name: VectorParamsDiff(on_disk=self.on_disk_vectors)}
+        return args
+
+    def missing_payload_indexes(self, info) -> Dict[str, PayloadSchemaType]:
+        existing = info.payload_schema or {}
+        return {field: schema for field, schema in self.payload_schemas().items() if field not in existing}
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "hnsw_m": self.hnsw_m,
+            "hnsw_ef_construct": self.hnsw_ef_construct,
+            "quantization": self.quantization,
+            "on_disk_vectors": self.on_disk_vectors,
+            "oversampling": self.oversampling,
+            "indexed_fields": self.indexed_fields,
+        }
+
+
+def migration_report(created: bool, args: Dict[str, Any], indexes: Dict[str, PayloadSchemaType], warnings: List[str]) -> Dict[str, Any]:
+    return {
+        "created": created,
+        "updated": sorted(args),
+        "indexes_created": sorted(indexes),
+        "warnings": warnings,
+    }
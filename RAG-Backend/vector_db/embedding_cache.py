@@ -0,0 +1,221 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+
+class EmbeddingCache:
+    """
+    Content-hash keyed cache for embeddings.
+
+    Tier 1 is an in-memory LRU bounded by total vector bytes. Tier 2 (optional) is an
+    on-disk ring buffer of float32 vectors in a memory-mapped file plus a json index,
+    so repeated FAQ queries and re-ingested chunks skip embedding even after a restart.
+    Each row also stores a hash of its key: rows are overwritten right away but the index
+    is only saved every flush_every entries, so after a crash the saved index can point
+    at rows reused by other keys. Those rows are treated as misses.
+    """
+
+    INDEX_FILE = "index.json"
+    VECTORS_FILE = "vectors.f32"
+    KEYS_FILE = "keys.bin"
+    KEY_HASH_BYTES = 16
+
+    def __init__(self, max_bytes: Optional[int] = None, disk_path: Optional[str] = None, disk_entries: Optional[int] = None, flush_every: int = 256):
+        """
+        Args:
+            max_bytes: Memory tier budget (default: EMBEDDING_CACHE_MAX_MB or 64 MB)
+            disk_path: Directory for the disk tier (default: EMBEDDING_CACHE_DIR, disabled if unset)
+            disk_entries: Max vectors kept on disk (default: EMBEDDING_DISK_CACHE_ENTRIES or 100000)
+            flush_every: Persist the disk index after this many new entries
+        """
+        load_dotenv()
+
+        self.max_bytes = int(max_bytes if max_bytes is not None else float(os.getenv("EMBEDDING_CACHE_MAX_MB", 64)) * 1024 * 1024)
+        self.disk_path = disk_path or os.getenv("EMBEDDING_CACHE_DIR")
+        self.disk_entries = int(disk_entries or os.getenv("EMBEDDING_DISK_CACHE_ENTRIES", 100000))
+        self.flush_every = flush_every
+
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+
+        # disk tier state, created lazily once the vector size is known
+        self._dim: Optional[int] = None
+        self._vectors: Optional[np.memmap] = None
+        self._row_hashes: Optional[np.memmap] = None
+        self._disk_index: Dict[str, int] = {}
+        self._row_keys: List[Optional[str]] = []
+        self._next_row = 0
+        self._unflushed = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.disk_path:
+            self._load_disk_index()
+
+    @staticmethod
+    def make_key(model_name: str, kind: str, text: str) -> str:
+        """
+        Hash of model, embedding kind ("query" or "passage") and text.
+        Query and passage embeddings differ for some models, so kind is part of the key.
+        """
+        return hashlib.sha256(f"{model_name}\0{kind}\0{text}".encode("utf-8")).hexdigest()
+
+    @classmethod
+    def _key_hash(cls, key: str) -> np.ndarray:
+        return np.frombuffer(hashlib.sha256(key.encode("utf-8")).digest()[:cls.KEY_HASH_BYTES], dtype=np.uint8)
+
+    def get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return vector.tolist()
+
+            row = self._disk_index.get(key)
+            if row is not None and self._vectors is not None and not np.array_equal(self._row_hashes[row], self._key_hash(key)):
+                # row was reused after the index was last saved
+                del self._disk_index[key]
+                row = None
+            if row is not None and self._vectors is not None:
+                vector = np.array(self._vectors[row])
+                self._put_memory(key, vector)
+                self.disk_hits += 1
+                return vector.tolist()
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, vector: List[float]):
+        array = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._put_memory(key, array)
+            if self.disk_path:
+                self._put_disk(key, array)
+
+    def _put_memory(self, key: str, vector: np.ndarray):
+        if vector.nbytes > self.max_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= old.nbytes
+        self._memory[key] = vector
+        self._memory_bytes += vector.nbytes
+
+        while self._memory_bytes > self.max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.nbytes
+            self.evictions += 1
+
+    # ---- disk tier ----
+
+    def _load_disk_index(self):
+        index_path = os.path.join(self.disk_path, self.INDEX_FILE)
+        vectors_path = os.path.join(self.disk_path, self.VECTORS_FILE)
+        keys_path = os.path.join(self.disk_path, self.KEYS_FILE)
+        if not (os.path.exists(index_path) and os.path.exists(vectors_path) and os.path.exists(keys_path)):
+            return
+        try:
+            with open(index_path, "r") as f:
+                index = json.load(f)
+            if index["capacity"] != self.disk_entries:
+                print('embedding cache capacity changed, starting a fresh disk cache.')
+                return
+            self._dim = index["dim"]
+            self._open_vectors(mode="r+")
+            self._disk_index = index["keys"]
+            self._next_row = index["next_row"]
+            self._row_keys = [None] * self.disk_entries
+            for key, row in self._disk_index.items():
+                self._row_keys[row] = key
+        except Exception as ex:
+            print(f'failed to load embedding disk cache, starting fresh: {ex}')
+            self._dim = None
+            self._vectors = None
+            self._row_hashes = None
+            self._disk_index = {}
+
+    def _open_vectors(self, mode: str):
+        os.makedirs(self.disk_path, exist_ok=True)
+        self._vectors = np.memmap(
+            os.path.join(self.disk_path, self.VECTORS_FILE),
+            dtype=np.float32,
+            mode=mode,
+            shape=(self.disk_entries, self._dim),
+        )
+        self._row_hashes = np.memmap(
+            os.path.join(self.disk_path, self.KEYS_FILE),
+            dtype=np.uint8,
+            mode=mode,
+            shape=(self.disk_entries, self.KEY_HASH_BYTES),
+        )
+
+    def _put_disk(self, key: str, vector: np.ndarray):
+        if self._vectors is None:
+            self._dim = vector.shape[0]
+            self._open_vectors(mode="w+")
+            self._row_keys = [None] * self.disk_entries
+        if vector.shape[0] != self._dim or key in self._disk_index:
+            return
+
+        # ring buffer: overwrite the oldest row once the file is full
+        row = self._next_row
+        old_key = self._row_keys[row]
+        if old_key is not None:
+            self._disk_index.pop(old_key, None)
+        # clear the row's key hash first, so a crash mid-write never leaves a row that
+        # verifies for either key
+        self._row_hashes[row] = 0
+        self._vectors[row] = vector
+        self._row_hashes[row] = self._key_hash(key)
+        self._disk_index[key] = row
+        self._row_keys[row] = key
+        self._next_row = (row + 1) % self.disk_entries
+
+        self._unflushed += 1
+        if self._unflushed >= self.flush_every:
+            self._flush()
+
+    def _flush(self):
+        if self._vectors is None:
+            return
+        self._vectors.flush()
+        self._row_hashes.flush()
+        index_path = os.path.join(self.disk_path, self.INDEX_FILE)
+        with open(index_path + ".tmp", "w") as f:
+            json.dump({"dim": self._dim, "capacity": self.disk_entries, "next_row": self._next_row, "keys": self._disk_index}, f)
+        os.replace(index_path + ".tmp", index_path)
+        self._unflushed = 0
+
+    def flush(self):
+        """
+        Persist the disk tier (no-op when it is disabled).
+        """
+        with self._lock:
+            self._flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "hits": hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk_index),
+            }
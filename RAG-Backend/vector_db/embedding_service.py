@@ -0,0 +1,374 @@
+import os
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from dotenv import load_dotenv
+from qdrant_client.http.models import VectorParams, SparseVectorParams, SparseVector, Modifier
+from qdrant_client.qdrant_fastembed import SUPPORTED_EMBEDDING_MODELS, SUPPORTED_SPARSE_EMBEDDING_MODELS, IDF_EMBEDDING_MODELS, QdrantFastembedMixin
+
+from vector_db.embedding_cache import EmbeddingCache
+from vector_db.chunking import load_tokenizer
+from vector_db.qdrant_wrapper import sparse_vector_name
+from services.metrics import count_cache
+
+
+class EmbeddingService:
+    """
+    Background embedding service that owns the fastembed model.
+
+    ONNX inference runs on a dedicated thread pool (onnxruntime releases the GIL) so it
+    never blocks the event loop. Concurrent query embeddings are merged into micro-batches:
+    a batch is flushed when it reaches max_batch_size or when its oldest request has waited
+    max_wait_ms, and every caller gets its vector back through an asyncio future.
+    Repeated texts are answered from an optional EmbeddingCache without touching the model.
+    An optional sparse model (e.g. BM25) provides the keyword side of hybrid search.
+    """
+
+    def __init__(self, model_name: Optional[str] = None, max_batch_size: Optional[int] = None, max_wait_ms: Optional[float] = None, workers: Optional[int] = None, threads: Optional[int] = None, cache: Optional[EmbeddingCache] = None, sparse_model_name: Optional[str] = None):
+        """
+        Args:
+            model_name: fastembed model (default: EMBEDDING_MODEL or qdrant-client's default, so existing collections stay compatible)
+            max_batch_size: Max queries per micro-batch (default: EMBEDDING_MAX_BATCH_SIZE or 32)
+            max_wait_ms: Max time a query waits for its batch to fill (default: EMBEDDING_MAX_WAIT_MS or 5)
+            workers: Number of inference threads (default: EMBEDDING_WORKERS or 2)
+            threads: onnxruntime intra-op threads per inference (default: EMBEDDING_THREADS or onnxruntime's default)
+            cache: Optional EmbeddingCache for query and passage vectors
+            sparse_model_name: fastembed sparse model stored next to the dense vectors, "" disables (default: SPARSE_EMBEDDING_MODEL or Qdrant/bm25)
+        """
+        load_dotenv()
+
+        self.model_name = model_name or os.getenv("EMBEDDING_MODEL", QdrantFastembedMixin.DEFAULT_EMBEDDING_MODEL)
+        self.max_batch_size = int(max_batch_size or os.getenv("EMBEDDING_MAX_BATCH_SIZE", 32))
+        self.max_wait_ms = float(max_wait_ms if max_wait_ms is not None else os.getenv("EMBEDDING_MAX_WAIT_MS", 5))
+        self.workers = int(workers or os.getenv("EMBEDDING_WORKERS", 2))
+        threads = threads or os.getenv("EMBEDDING_THREADS")
+        self.threads = int(threads) if threads else None
+
+        self.sparse_model_name = (sparse_model_name if sparse_model_name is not None else os.getenv("SPARSE_EMBEDDING_MODEL", "Qdrant/bm25")) or None
+
+        if self.model_name not in SUPPORTED_EMBEDDING_MODELS:
+            raise ValueError(f"Unsupported embedding model: {self.model_name}")
+        if self.sparse_model_name is not None and self.sparse_model_name not in SUPPORTED_SPARSE_EMBEDDING_MODELS:
+            raise ValueError(f"Unsupported sparse embedding model: {self.sparse_model_name}")
+        if self.max_batch_size < 1 or self.workers < 1:
+            raise ValueError("EMBEDDING_MAX_BATCH_SIZE and EMBEDDING_WORKERS must be at least 1")
+
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="embedding")
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._sparse_model = None
+        self._tokenizer = None
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._batcher_task: Optional[asyncio.Task] = None
+        self._inflight: Optional[asyncio.Semaphore] = None
+        self._batch_tasks = set()
+
+        # simple throughput counters
+        self._stats_lock = threading.Lock()
+        self.embedded_count = 0
+        self.batch_count = 0
+        self.inference_seconds = 0.0
+
+    @property
+    def vector_name(self) -> str:
+        """Named vector used by qdrant-client's fastembed integration for this model."""
+        return f"fast-{self.model_name.split('/')[-1].lower()}"
+
+    def vector_params(self) -> VectorParams:
+        size, distance = SUPPORTED_EMBEDDING_MODELS[self.model_name]
+        return VectorParams(size=size, distance=distance)
+
+    @property
+    def sparse_vector_name(self) -> Optional[str]:
+        """Named sparse vector for the sparse model, None if sparse embeddings are disabled."""
+        return sparse_vector_name(self.sparse_model_name) if self.sparse_model_name else None
+
+    def sparse_vector_params(self) -> SparseVectorParams:
+        # bm25 style models only ship term frequencies, qdrant applies the idf
+        return SparseVectorParams(modifier=Modifier.IDF if self.sparse_model_name in IDF_EMBEDDING_MODELS else None)
+
+    def _load_model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from fastembed import TextEmbedding
+                    # share the instance with qdrant-client's mixin so sync scripts don't load it twice
+                    model = QdrantFastembedMixin.embedding_models.get(self.model_name)
+                    if model is None:
+                        model = TextEmbedding(model_name=self.model_name, threads=self.threads)
+                        QdrantFastembedMixin.embedding_models[self.model_name] = model
+                    self._model = model
+        return self._model
+
+    def _load_sparse_model(self):
+        if self._sparse_model is None:
+            with self._model_lock:
+                if self._sparse_model is None:
+                    from fastembed import SparseTextEmbedding
+                    model = QdrantFastembedMixin.sparse_embedding_models.get(self.sparse_model_name)
+                    if model is None:
+                        model = SparseTextEmbedding(model_name=self.sparse_model_name, threads=self.threads)
+                        QdrantFastembedMixin.sparse_embedding_models[self.sparse_model_name] = model
+                    self._sparse_model = model
+        return self._sparse_model
+
+    def tokenizer(self):
+        """
+        The model's tokenizer without truncation (for chunking), None if the model can't be loaded.
+        Blocking on first call: loads the model.
+        """
+        if self._tokenizer is None:
+            try:
+                self._tokenizer = load_tokenizer(self._load_model())
+            except Exception as ex:
+                print(f'could not load embedding tokenizer, approximating token counts: {ex}')
+        return self._tokenizer
+
+    def _run_query_embed(self, texts: List[str]) -> List[List[float]]:
+        start = time.perf_counter()
+        vectors = [vector.tolist() for vector in self._load_model().query_embed(texts)]
+        self._record(len(texts), time.perf_counter() - start)
+        return vectors
+
+    def _run_passage_embed(self, texts: List[str]) -> List[List[float]]:
+        start = time.perf_counter()
+        vectors = [vector.tolist() for vector in self._load_model().passage_embed(texts, batch_size=self.max_batch_size)]
+        self._record(len(texts), time.perf_counter() - start)
+        return vectors
+
+    def _run_sparse_embed(self, texts: List[str], query: bool) -> List[SparseVector]:
+        model = self._load_sparse_model()
+        embeddings = model.query_embed(texts) if query else model.passage_embed(texts, batch_size=self.max_batch_size)
+        return [SparseVector(indices=embedding.indices.tolist(), values=embedding.values.tolist()) for embedding in embeddings]
+
+    def _record(self, count: int, seconds: float):
+        with self._stats_lock:
+            self.embedded_count += count
+            self.batch_count += 1
+            self.inference_seconds += seconds
+
+    def _warmup(self):
+        try:
+            self._load_model()
+            if self.sparse_model_name is not None:
+                self._load_sparse_model()
+        except Exception as ex:
+            print(f'embedding model warm-up failed: {ex}')
+
+    async def start(self):
+        """
+        Start the micro-batching loop and warm up the model in the background.
+        Must be called from the event loop that will use the service.
+        """
+        if self._batcher_task is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._inflight = asyncio.Semaphore(self.workers)
+        self._batcher_task = asyncio.create_task(self._batch_loop())
+
+        self.executor.submit(self._warmup)
+
+    async def aclose(self):
+        """
+        Stop the batching loop, fail pending requests and shut the thread pool down.
+        """
+        if self._batcher_task is not None:
+            self._batcher_task.cancel()
+            try:
+                await self._batcher_task
+            except asyncio.CancelledError:
+                pass
+            self._batcher_task = None
+
+        if self._queue is not None:
+            while not self._queue.empty():
+                _, future = self._queue.get_nowait()
+                if not future.done():
+                    future.set_exception(RuntimeError("Embedding service is closed"))
+
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.cache is not None:
+            self.cache.flush()
+
+    def _cache_key(self, kind: str, text: str) -> str:
+        return EmbeddingCache.make_key(self.model_name, kind, text)
+
+    def embed_query(self, text: str) -> asyncio.Future:
+        """
+        Queue a query text for embedding. Returns a future resolving to its vector.
+        """
+        if self._queue is None:
+            raise RuntimeError("Embedding service is not started")
+        future = asyncio.get_running_loop().create_future()
+
+        if self.cache is not None:
+            vector = self.cache.get(self._cache_key("query", text))
+            count_cache("embedding", vector is not None)
+            if vector is not None:
+                future.set_result(vector)
+                return future
+
+        self._queue.put_nowait((text, future))
+        return future
+
+    async def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed several query texts in one inference call (for batch queries). Cached and
+        repeated texts are only embedded once.
+        """
+        if not texts:
+            return []
+        keys = [self._cache_key("query", text) for text in texts]
+        vectors = [self.cache.get(key) if self.cache is not None else None for key in keys]
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if self.cache is not None:
+            count_cache("embedding", True, amount=len(texts) - len(missing))
+            count_cache("embedding", False, amount=len(missing))
+        if missing:
+            embedded = dict(zip(missing, await asyncio.get_running_loop().run_in_executor(self.executor, self._run_query_embed, missing)))
+            for i, text in enumerate(texts):
+                if vectors[i] is None:
+                    vectors[i] = embedded[text]
+                    if self.cache is not None:
+                        self.cache.put(keys[i], vectors[i])
+        return vectors
+
+    async def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed documents (passages) on the inference pool. Documents already arrive in
+        batches, so they skip the micro-batching queue. Cached chunks are not re-embedded.
+        """
+        if not texts:
+            return []
+        if self.cache is None:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, self._run_passage_embed, list(texts))
+
+        keys = [self._cache_key("passage", text) for text in texts]
+        vectors = [self.cache.get(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        count_cache("embedding", True, amount=len(texts) - len(missing))
+        count_cache("embedding", False, amount=len(missing))
+        if missing:
+            embedded = await asyncio.get_running_loop().run_in_executor(self.executor, self._run_passage_embed, [texts[i] for i in missing])
+            for i, vector in zip(missing, embedded):
+                vectors[i] = vector
+                self.cache.put(keys[i], vector)
+        return vectors
+
+    async def embed_sparse_documents(self, texts: List[str]) -> List[SparseVector]:
+        """
+        Sparse (keyword) vectors of documents, computed on the inference pool.
+        """
+        if not texts:
+            return []
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._run_sparse_embed, list(texts), False)
+
+    async def embed_sparse_query(self, text: str) -> SparseVector:
+        """
+        Sparse (keyword) vector of a query. Cheap for BM25 (tokenization only), so not micro-batched.
+        """
+        vectors = await asyncio.get_running_loop().run_in_executor(self.executor, self._run_sparse_embed, [text], True)
+        return vectors[0]
+
+    async def embed_sparse_queries(self, texts: List[str]) -> List[SparseVector]:
+        """
+        Sparse (keyword) vectors of several queries in one call.
+        """
+        if not texts:
+            return []
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._run_sparse_embed, list(texts), True)
+
+    def embed_queries_sync(self, texts: List[str]) -> List[List[float]]:
+        """
+        Blocking embed_queries for sync code (QdrantWrapper), run on the caller's thread.
+        """
+        return self._embed_cached_sync("query", texts, self._run_query_embed)
+
+    def embed_documents_sync(self, texts: List[str]) -> List[List[float]]:
+        """
+        Blocking embed_documents for sync code (QdrantWrapper), run on the caller's thread.
+        """
+        return self._embed_cached_sync("passage", texts, self._run_passage_embed)
+
+    def embed_sparse_sync(self, texts: List[str], query: bool = False) -> List[SparseVector]:
+        """
+        Blocking sparse (keyword) vectors of queries or documents, for sync code.
+        """
+        if not texts:
+            return []
+        return self._run_sparse_embed(list(texts), query)
+
+    def _embed_cached_sync(self, kind: str, texts: List[str], embed) -> List[List[float]]:
+        if not texts:
+            return []
+        if self.cache is None:
+            return embed(list(texts))
+
+        keys = [self._cache_key(kind, text) for text in texts]
+        vectors = [self.cache.get(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        count_cache("embedding", True, amount=len(texts) - len(missing))
+        count_cache("embedding", False, amount=len(missing))
+        if missing:
+            for i, vector in zip(missing, embed([texts[i] for i in missing])):
+                vectors[i] = vector
+                self.cache.put(keys[i], vector)
+        return vectors
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch: List[Tuple[str, asyncio.Future]] = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait_ms / 1000
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # drop requests whose callers already gave up
+            batch = [(text, future) for text, future in batch if not future.done()]
+            if not batch:
+                continue
+
+            # bound the number of batches running on the pool; the queue keeps filling meanwhile
+            await self._inflight.acquire()
+            task = asyncio.create_task(self._run_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _run_batch(self, batch: List[Tuple[str, asyncio.Future]]):
+        try:
+            texts = [text for text, _ in batch]
+            vectors = await asyncio.get_running_loop().run_in_executor(self.executor, self._run_query_embed, texts)
+            for (text, future), vector in zip(batch, vectors):
+                if self.cache is not None:
+                    self.cache.put(self._cache_key("query", text), vector)
+                if not future.done():
+                    future.set_result(vector)
+        except Exception as ex:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(ex)
+        finally:
+            self._inflight.release()
+
+    def stats(self) -> dict:
+        return {
+            "model_name": self.model_name,
+            "sparse_model_name": self.sparse_model_name,
+            "embedded": self.embedded_count,
+            "batches": self.batch_count,
+            "avg_batch_size": self.embedded_count / self.batch_count if self.batch_count else 0.0,
+            "embeddings_per_second": self.embedded_count / self.inference_seconds if self.inference_seconds else 0.0,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "cache": self.cache.stats() if self.cache is not None else None,
+        }
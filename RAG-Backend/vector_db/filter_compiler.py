@@ -0,0 +1,196 @@
+import os
+import json
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+from pydantic import ValidationError
+from qdrant_client.http.models import (
+    DatetimeRange,
+    FieldCondition,
+    Filter,
+    IsEmptyCondition,
+    IsNullCondition,
+    MatchAny,
+    MatchText,
+    MatchValue,
+    Nested,
+    NestedCondition,
+    PayloadField,
+    Range,
+)
+
+load_dotenv()
+
+# Keys combining sub-filters. A value is one filter object or a list of them.
+CLAUSE_KEYS = ("must", "should", "must_not")
+
+RANGE_OPERATORS = {"$gt": "gt", "$gte": "gte", "$lt": "lt", "$lte": "lte"}
+
+
+class FilterError(ValueError):
+    """Raised for metadata filters that don't follow the filter language."""
+
+
+def compile_filter(metadata_filter: Optional[Dict]) -> Optional[Filter]:
+    """
+    Compile a metadata filter into a qdrant Filter, so filtering runs server side (and uses
+    the payload indexes, see collection_config.py). Returns None if there is nothing to filter on.
+
+    The filter is a json object. Every field key must match (AND); a plain value is an exact
+    match, a list matches any of its values, and a nested object addresses nested payload
+    keys ({"author": {"name": "x"}} is the same as {"author.name": "x"}). Objects of operators
+    match a field in other ways:
+
+        {"published_at": {"$gte": "2024-01-01T00:00:00Z", "$lt": "2024-02-01T00:00:00Z"},
+         "views": {"$gt": 1000},
+         "creator_id": {"$in": ["alice", "bob"]},
+         "source": {"$ne": "spam"},
+         "tags": {"$nin": ["nsfw"]},
+         "title": {"$text": "sui"},
+         "image": {"$exists": true},
+         "comments": {"$elem": {"author": "bob", "likes": {"$gte": 3}}},
+         "should": [{"source": "blog"}, {"source": "news"}],
+         "must_not": {"creator_id": "carol"}}
+
+    $elem matches arrays of objects where a single element satisfies the whole sub-filter.
+    "must", "should" and "must_not" take filter objects (or lists of them); at least one
+    "should" clause has to match.
+
+    Compiled filters are cached by their canonical json (FILTER_CACHE_SIZE, default 1024)
+    and shared between callers, don't modify them.
+
+    Raises:
+        FilterError: if the filter is not valid
+    """
+    if not metadata_filter:
+        return None
+    if not isinstance(metadata_filter, dict):
+        raise FilterError(f"metadata_filter must be an object, got {type(metadata_filter).__name__}")
+    try:
+        key = json.dumps(metadata_filter, sort_keys=True)
+    except (TypeError, ValueError) as ex:
+        raise FilterError(f"metadata_filter is not json serializable: {ex}")
+    return _compile_cached(key)
+
+
+@lru_cache(maxsize=int(os.getenv("FILTER_CACHE_SIZE", 1024)))
+def _compile_cached(key: str) -> Filter:
+    try:
+        return _compile(json.loads(key))
+    except ValidationError as ex:
+        raise FilterError(f"Invalid value: {ex.errors()[0]['msg']}")
+
+
+def filter_cache_stats() -> Dict[str, Any]:
+    info = _compile_cached.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        "entries": info.currsize,
+        "max_entries": info.maxsize,
+        "hits": info.hits,
+        "misses": info.misses,
+        "hit_rate": info.hits / lookups if lookups else 0.0,
+    }
+
+
+def _compile(spec: Dict[str, Any], prefix: str = "") -> Filter:
+    must: List[Any] = []
+    should: List[Any] = []
+    must_not: List[Any] = []
+    clauses = {"must": must, "should": should, "must_not": must_not}
+
+    for key, value in spec.items():
+        if key in CLAUSE_KEYS:
+            for clause in value if isinstance(value, list) else [value]:
+                if not isinstance(clause, dict) or not clause:
+                    raise FilterError(f'"{key}" takes filter objects, got {clause!r}')
+                clauses[key].append(_compile(clause, prefix))
+        elif key.startswith("$"):
+            raise FilterError(f"Operator {key} must be applied to a field")
+        else:
+            _add_field(prefix + key, value, must, must_not)
+
+    if not (must or should or must_not):
+        raise FilterError("Empty filter object")
+    return Filter(must=must or None, should=should or None, must_not=must_not or None)
+
+
+def _add_field(path: str, value: Any, must: List[Any], must_not: List[Any]):
+    if isinstance(value, dict):
+        operators = [key for key in value if key.startswith("$")]
+        if not value:
+            raise FilterError(f"Empty filter object for {path}")
+        if not operators:
+            for key, nested_value in value.items():
+                _add_field(f"{path}.{key}", nested_value, must, must_not)
+        elif len(operators) != len(value):
+            raise FilterError(f"Can't mix operators and nested keys for {path}")
+        else:
+            _add_operators(path, value, must, must_not)
+    elif isinstance(value, list):
+        must.append(_match_any(path, value))
+    else:
+        must.append(_equals(path, value))
+
+
+def _add_operators(path: str, operators: Dict[str, Any], must: List[Any], must_not: List[Any]):
+    bounds = {}
+    for operator, value in operators.items():
+        if operator in RANGE_OPERATORS:
+            bounds[RANGE_OPERATORS[operator]] = value
+        elif operator == "$eq":
+            must.append(_equals(path, value))
+        elif operator == "$ne":
+            must_not.append(_equals(path, value))
+        elif operator == "$in":
+            must.append(_match_any(path, value))
+        elif operator == "$nin":
+            must_not.append(_match_any(path, value))
+        elif operator == "$text":
+            if not isinstance(value, str):
+                raise FilterError(f"$text of {path} must be a string")
+            must.append(FieldCondition(key=path, match=MatchText(text=value)))
+        elif operator == "$exists":
+            if not isinstance(value, bool):
+                raise FilterError(f"$exists of {path} must be true or false")
+            (must_not if value else must).append(IsEmptyCondition(is_empty=PayloadField(key=path)))
+        elif operator == "$elem":
+            if not isinstance(value, dict) or not value:
+                raise FilterError(f"$elem of {path} must be a filter object")
+            must.append(NestedCondition(nested=Nested(key=path, filter=_compile(value))))
+        else:
+            raise FilterError(f"Unknown operator {operator} for {path}")
+
+    if bounds:
+        must.append(_range(path, bounds))
+
+
+def _equals(path: str, value: Any):
+    if value is None:
+        return IsNullCondition(is_null=PayloadField(key=path))
+    if isinstance(value, float) and not value.is_integer():
+        # MatchValue only takes keywords, integers and booleans
+        return FieldCondition(key=path, range=Range(gte=value, lte=value))
+    if isinstance(value, float):
+        value = int(value)
+    if not isinstance(value, (str, int, bool)):
+        raise FilterError(f"Can't match {path} against {value!r}")
+    return FieldCondition(key=path, match=MatchValue(value=value))
+
+
+def _match_any(path: str, values: Any) -> FieldCondition:
+    if not isinstance(values, list) or not values:
+        raise FilterError(f"Expected a non empty list of values for {path}")
+    if not all(isinstance(value, str) for value in values) and not all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+        raise FilterError(f"Values matched for {path} must be all strings or all integers")
+    return FieldCondition(key=path, match=MatchAny(any=values))
+
+
+def _range(path: str, bounds: Dict[str, Any]) -> FieldCondition:
+    if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in bounds.values()):
+        return FieldCondition(key=path, range=Range(**bounds))
+    if all(isinstance(value, str) for value in bounds.values()):
+        # RFC 3339 dates / datetimes, qdrant compares them as timestamps
+        return FieldCondition(key=path, range=DatetimeRange(**bounds))
+    raise FilterError(f"Range bounds of {path} must be all numbers or all dates")
@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import asyncio
+from itertools import islice
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from vector_db.async_qdrant_wrapper import AsyncQdrantWrapper
+from vector_db.point_ids import DuplicateDocumentError, check_unique_id, key_chunks, count_chunks
+
+
+async def iter_ndjson_documents(byte_chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[str, Dict]]:
+    """
+    Parse a stream of NDJSON bytes into (text, metadata) documents, one line at a time.
+    Each line is either {"text": "...", "metadata": {...}} or a plain json string.
+    """
+    buffer = b""
+    line_number = 0
+
+    def parse(line: bytes):
+        document = json.loads(line)
+        if isinstance(document, str):
+            return document, {}
+        if not isinstance(document, dict) or not isinstance(document.get("text"), str):
+            raise ValueError('expected a json string or an object with a "text" field')
+        metadata = document.get("metadata") or {}
+        if not isinstance(metadata, dict):
+            raise ValueError('"metadata" must be an object')
+        return document["text"], metadata
+
+    async for chunk in byte_chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                try:
+                    yield parse(line)
+                except ValueError as ex:
+                    raise ValueError(f"Invalid document on line {line_number}: {ex}")
+
+    if buffer.strip():
+        try:
+            yield parse(buffer)
+        except ValueError as ex:
+            raise ValueError(f"Invalid document on line {line_number + 1}: {ex}")
+
+
+class IngestPipeline:
+    """
+    Bulk ingestion as a chunk -> embed/upsert pipeline.
+
+    A producer chunks incoming documents into batches of batch_size and puts them on a queue
+    holding at most queue_size batches; `concurrency` workers embed and upsert batches from it.
+    When the workers fall behind the producer blocks, which in turn stops reading the request
+    body, so peak memory is bounded by batch size and queue size rather than corpus size.
+    """
+
+    def __init__(self, wrapper: AsyncQdrantWrapper, batch_size: Optional[int] = None, concurrency: Optional[int] = None, queue_size: Optional[int] = None):
+        """
+        Args:
+            wrapper: Collection to ingest into
+            batch_size: Chunks per embed/upsert batch (default: INGEST_BATCH_SIZE or 64)
+            concurrency: Batches embedded/upserted in parallel (default: INGEST_CONCURRENCY or 2)
+            queue_size: Max batches waiting for a worker (default: INGEST_QUEUE_SIZE or 4)
+        """
+        load_dotenv()
+
+        self.wrapper = wrapper
+        self.batch_size = int(batch_size or os.getenv("INGEST_BATCH_SIZE", 64))
+        self.concurrency = int(concurrency or os.getenv("INGEST_CONCURRENCY", 2))
+        self.queue_size = int(queue_size or os.getenv("INGEST_QUEUE_SIZE", 4))
+
+        if self.batch_size < 1 or self.concurrency < 1 or self.queue_size < 1:
+            raise ValueError("batch_size, concurrency and queue_size must be at least 1")
+
+    async def run(self, documents: AsyncIterator[Tuple[str, Dict]]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Ingest documents, yielding a progress event per stored batch and a final
+        {"status": "done"} or {"status": "error"} event. A document with the same id as an
+        earlier one of the stream is not stored; it gets an {"status": "error", "document": n}
+        event (n counted from 0) and ingestion goes on.
+        """
+        loop = asyncio.get_running_loop()
+        batches: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        events: asyncio.Queue = asyncio.Queue()
+        start = time.perf_counter()
+        stats = {"documents": 0, "rejected": 0, "chunks_queued": 0, "chunks_stored": 0, "batches_stored": 0}
+        chunk_counts: Dict[str, int] = {}
+        seen_ids: Dict[str, int] = {}
+
+        async def produce():
+            chunker = await loop.run_in_executor(None, self.wrapper.get_chunker)
+            batch = []
+            async for text, metadata in documents:
+                stats["documents"] += 1
+                try:
+                    # a repeated id would overwrite the earlier document's chunks
+                    check_unique_id(seen_ids, stats["documents"] - 1, metadata)
+                except DuplicateDocumentError as ex:
+                    stats["rejected"] += 1
+                    await events.put({"status": "error", "document": stats["documents"] - 1, "detail": str(ex)})
+                    continue
+                chunks = key_chunks(chunker, [text], [metadata])
+                while True:
+                    size = self.batch_size - len(batch)
+                    piece = await loop.run_in_executor(None, lambda: list(islice(chunks, size)))
+                    if not piece:
+                        break
+                    batch += piece
+                    if len(batch) >= self.batch_size:
+                        stats["chunks_queued"] += len(batch)
+                        await batches.put(batch)
+                        batch = []
+            if batch:
+                stats["chunks_queued"] += len(batch)
+                await batches.put(batch)
+            for _ in range(self.concurrency):
+                await batches.put(None)
+
+        async def work():
+            while True:
+                batch = await batches.get()
+                if batch is None:
+                    return
+                batch_start = time.perf_counter()
+                await self.wrapper.aupsert_chunks([chunk for chunk, _ in batch], [meta for _, meta in batch])
+                count_chunks(chunk_counts, [meta for _, meta in batch])
+                stats["chunks_stored"] += len(batch)
+                stats["batches_stored"] += 1
+                await events.put({
+                    "status": "progress",
+                    "batch": stats["batches_stored"],
+                    "batch_chunks": len(batch),
+                    "batch_seconds": round(time.perf_counter() - batch_start, 3),
+                    "documents_read": stats["documents"],
+                    "chunks_stored": stats["chunks_stored"],
+                })
+
+        async def supervise():
+            tasks = [asyncio.create_task(produce())] + [asyncio.create_task(work()) for _ in range(self.concurrency)]
+            try:
+                await asyncio.gather(*tasks)
+                await self.wrapper.adelete_stale_chunks(chunk_counts)
+                await events.put({"status": "done", "collection_name": self.wrapper.collection_name, "documents": stats["documents"], "rejected": stats["rejected"], "chunks": stats["chunks_stored"], "batches": stats["batches_stored"], "seconds": round(time.perf_counter() - start, 3)})
+            except Exception as ex:
+                await events.put({"status": "error", "detail": str(ex), "documents_read": stats["documents"], "chunks_stored": stats["chunks_stored"]})
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                await events.put(None)
+
+        supervisor = asyncio.create_task(supervise())
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    return
+                yield event
+        finally:
+            # client went away: stop reading and ingesting
+            supervisor.cancel()
+            await asyncio.gather(supervisor, return_exceptions=True)
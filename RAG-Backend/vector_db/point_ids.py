@@ -0,0 +1,158 @@
+import os
+import json
+import uuid
+import hashlib
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from qdrant_client.http.models import FieldCondition, Filter, MatchValue, Range
+
+load_dotenv()
+
+# Payload fields identifying a chunk. document_key should be indexed (see QDRANT_INDEXED_FIELDS)
+# so stale chunks of an edited document are found without a full scan.
+DOCUMENT_KEY_FIELD = "document_key"
+CHUNK_INDEX_FIELD = "chunk_index"
+CONTENT_HASH_FIELD = "content_hash"
+# Not part of the document's metadata, so not returned with search results
+INTERNAL_FIELDS = (DOCUMENT_KEY_FIELD, CHUNK_INDEX_FIELD, CONTENT_HASH_FIELD)
+
+# Keys of documents without an id are derived from their text and metadata, so they never
+# have stale chunks.
+CONTENT_KEY_PREFIX = "sha256:"
+
+POINT_ID_NAMESPACE = uuid.UUID("6f1c3e0a-5b0e-4a4e-9d8e-2f2b6c7a9d41")
+
+
+class DuplicateDocumentError(ValueError):
+    """Raised when documents of one request share an id, so their chunks would overwrite each other."""
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def content_key(text: str, metadata: Optional[Dict]) -> str:
+    """
+    Key of a document without an id: the hash of its text and its metadata (canonical json),
+    so the same text posted with different metadata (e.g. by two creators) is stored twice
+    instead of one overwriting the other.
+    """
+    canonical = json.dumps(public_metadata(metadata), sort_keys=True, default=str)
+    return CONTENT_KEY_PREFIX + content_hash(f"{text}\0{canonical}")
+
+
+def document_key(text: str, metadata: Dict, id_field: Optional[str] = None) -> str:
+    """
+    Stable key of a source document: its id metadata field (DOCUMENT_ID_FIELD, default
+    source_id) if set, else the hash of its text and metadata, so an identical re-submit
+    still maps to the same points.
+    """
+    id_field = id_field or os.getenv("DOCUMENT_ID_FIELD", "source_id")
+    source_id = metadata.get(id_field)
+    if source_id is not None and source_id != "":
+        return str(source_id)
+    return content_key(text, metadata)
+
+
+def check_unique_id(seen: Dict[str, int], index: int, metadata: Dict, id_field: Optional[str] = None):
+    """
+    Raise DuplicateDocumentError if the id of document `index` was already seen (id ->
+    index of the document that had it), else remember it. For documents arriving one at a
+    time, e.g. a bulk ingest stream.
+    """
+    id_field = id_field or os.getenv("DOCUMENT_ID_FIELD", "source_id")
+    source_id = metadata.get(id_field)
+    if source_id is None or source_id == "":
+        return
+    if str(source_id) in seen:
+        raise DuplicateDocumentError(f"Documents {seen[str(source_id)]} and {index} have the same {id_field}: {source_id!r}")
+    seen[str(source_id)] = index
+
+
+def check_unique_ids(metadatas: Iterable[Dict], id_field: Optional[str] = None):
+    """
+    Raise DuplicateDocumentError if two documents have the same id metadata field: their
+    chunks would get the same point ids and the later document would silently replace the
+    earlier. Documents without an id may repeat, identical documents store the same points.
+    """
+    seen: Dict[str, int] = {}
+    for index, metadata in enumerate(metadatas):
+        check_unique_id(seen, index, metadata, id_field)
+
+
+def public_metadata(metadata: Optional[Dict]) -> Dict:
+    """Payload of a point without the internal id / change detection fields."""
+    return {key: value for key, value in (metadata or {}).items() if key not in INTERNAL_FIELDS}
+
+
+def point_id(collection_name: str, document_key: str, chunk_index: int) -> str:
+    """
+    Deterministic point id (uuid5) of a chunk, so ingesting a document again overwrites its points.
+    """
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{collection_name}\0{document_key}\0{chunk_index}"))
+
+
+def key_chunks(chunker, texts: Iterable[str], metadatas: Iterable[Dict], id_field: Optional[str] = None) -> Iterator[Tuple[str, Dict]]:
+    """
+    Lazily yield (chunk, metadata) pairs like TokenChunker.split, with the document key
+    and the chunk's index within its document added to the metadata.
+    """
+    for text, metadata in zip(texts, metadatas):
+        key = document_key(text, metadata, id_field)
+        for index, chunk in enumerate(chunker.iter_chunks(text)):
+            yield chunk, {**metadata, DOCUMENT_KEY_FIELD: key, CHUNK_INDEX_FIELD: index}
+
+
+def chunk_point(collection_name: str, text: str, metadata: Dict) -> Tuple[str, Dict]:
+    """
+    (point id, payload) of a chunk. Chunks without a key (e.g. chunked by the caller) are
+    keyed by their own text and metadata.
+    """
+    key = metadata.get(DOCUMENT_KEY_FIELD) or content_key(text, metadata)
+    index = metadata.get(CHUNK_INDEX_FIELD, 0)
+    payload = {"document": text, **metadata, DOCUMENT_KEY_FIELD: key, CHUNK_INDEX_FIELD: index, CONTENT_HASH_FIELD: content_hash(text)}
+    return point_id(collection_name, key, index), payload
+
+
+def plan_upsert(ids: List[str], payloads: List[Dict], existing: Dict[str, Dict]) -> Tuple[List[int], List[int]]:
+    """
+    Compare new chunks with the stored payloads (by point id) of the same points.
+
+    Returns:
+        (indexes of chunks to embed and upsert: new or changed text,
+         indexes of chunks with unchanged text but changed metadata: payload update only)
+    """
+    to_embed, to_update = [], []
+    for i, (id_, payload) in enumerate(zip(ids, payloads)):
+        stored = existing.get(id_)
+        if stored is None or stored.get(CONTENT_HASH_FIELD) != payload[CONTENT_HASH_FIELD]:
+            to_embed.append(i)
+        elif stored != payload:
+            to_update.append(i)
+    return to_embed, to_update
+
+
+def count_chunks(chunk_counts: Dict[str, int], metadatas: Iterable[Dict]):
+    """
+    Track the number of chunks per document with an id (for stale_chunks_filter).
+    """
+    for metadata in metadatas:
+        key = metadata.get(DOCUMENT_KEY_FIELD)
+        if key is not None and not key.startswith(CONTENT_KEY_PREFIX):
+            chunk_counts[key] = max(chunk_counts.get(key, 0), metadata[CHUNK_INDEX_FIELD] + 1)
+
+
+def stale_chunks_filter(chunk_counts: Dict[str, int]) -> Optional[Filter]:
+    """
+    Filter matching chunks left over from longer, earlier versions of the given documents.
+    """
+    if not chunk_counts:
+        return None
+    return Filter(should=[
+        Filter(must=[
+            FieldCondition(key=DOCUMENT_KEY_FIELD, match=MatchValue(value=key)),
+            FieldCondition(key=CHUNK_INDEX_FIELD, range=Range(gte=count)),
+        ])
+        for key, count in chunk_counts.items()
+    ])
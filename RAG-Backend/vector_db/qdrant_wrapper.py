@@ -1,8 +1,68 @@
 import os
-from typing import List, Dict, Union, Optional, Any
+from typing import TYPE_CHECKING, List, Dict, Union, Optional, Any
 from dotenv import load_dotenv
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import Distance, VectorParams, Filter, FieldCondition, MatchValue
+from qdrant_client.fastembed_common import QueryResponse
+from qdrant_client.http.models import Distance, VectorParams, Filter, Prefetch, FusionQuery, Fusion, SparseVector, SearchParams, SparseVectorParams, Modifier, OverwritePayloadOperation, SetPayload, PointStruct
+from qdrant_client.qdrant_fastembed import IDF_EMBEDDING_MODELS
+
+from vector_db.chunking import TokenChunker, tokenizer_for_client
+from vector_db.collection_config import CollectionConfig, migration_report
+from vector_db.filter_compiler import compile_filter
+from vector_db.point_ids import key_chunks, chunk_point, plan_upsert, count_chunks, stale_chunks_filter, check_unique_ids, public_metadata
+from services.single_flight import SingleFlight, flight_key
+from services.metrics import track_stage, QDRANT_SEARCH_SECONDS, QDRANT_UPSERT_SECONDS
+from services.payload_log import log_payload
+
+if TYPE_CHECKING:
+    # embedding_service imports sparse_vector_name from this module
+    from vector_db.embedding_service import EmbeddingService
+
+
+def sparse_vector_name(sparse_model_name: str) -> str:
+    """Named sparse vector used by qdrant-client's fastembed integration for this model."""
+    return f"fast-sparse-{sparse_model_name.split('/')[-1].lower()}"
+
+
+def hybrid_query_args(dense_vector: List[float], dense_name: str, sparse_vector: SparseVector, sparse_name: str, query_filter: Optional[Filter], limit: int, search_params: Optional[SearchParams] = None) -> Dict[str, Any]:
+    """
+    Keyword arguments for a query_points call that runs a dense and a sparse (keyword) search
+    and fuses their rankings with reciprocal rank fusion. Each side fetches
+    limit * HYBRID_PREFETCH_FACTOR candidates (default 4). search_params apply to the dense side.
+    """
+    prefetch_limit = limit * int(os.getenv("HYBRID_PREFETCH_FACTOR", 4))
+    return {
+        "prefetch": [
+            Prefetch(query=dense_vector, using=dense_name, filter=query_filter, limit=prefetch_limit, params=search_params),
+            Prefetch(query=sparse_vector, using=sparse_name, filter=query_filter, limit=prefetch_limit),
+        ],
+        "query": FusionQuery(fusion=Fusion.RRF),
+        "limit": limit,
+        "with_payload": True,
+    }
+
+
+def points_to_query_responses(points) -> List[QueryResponse]:
+    """Convert query_points results to the QueryResponse objects client.query returns (without internal fields)."""
+    return [
+        QueryResponse(
+            id=point.id,
+            embedding=None,
+            sparse_embedding=None,
+            metadata=public_metadata(point.payload),
+            document=point.payload.get("document", ""),
+            score=point.score,
+        )
+        for point in points
+    ]
+
+
+def strip_internal_fields(responses: List[QueryResponse]) -> List[QueryResponse]:
+    """Drop the point id / change detection fields (see vector_db/point_ids.py) from client.query results."""
+    for response in responses:
+        response.metadata = public_metadata(response.metadata)
+    return responses
+
 
 class QdrantWrapper:
     """
@@ -10,57 +70,107 @@ class QdrantWrapper:
     for embedding storage and retrieval.
     """
     
-    def __init__(self, collection_name: str="test_collection0", vector_size: int = 1536, distance: Distance = Distance.DOT):
+    def __init__(self, collection_name: str="test_collection0", vector_size: int = 1536, distance: Distance = Distance.DOT, client: Optional[QdrantClient] = None, collection_config: Optional[CollectionConfig] = None, embedding_service: Optional["EmbeddingService"] = None):
         """
         Initialize the QdrantWrapper with a specified collection name.
         Creates the collection if it doesn't exist.
-        
+
         Args:
             collection_name: Name of the collection to use
             vector_size: Size of the embedding vectors (default: 1536 for OpenAI embeddings)
             distance: Distance metric to use (default: COSINE)
+            client: Optional shared QdrantClient (see vector_db/client_pool.py). A new client is created if not given.
+            collection_config: Layout used by provision() (see vector_db/collection_config.py). Read from .env if not given.
+            embedding_service: Optional shared EmbeddingService (see vector_db/client_pool.py). When given, documents
+                and queries are embedded with it, dense and sparse, and sent to qdrant as vectors; hybrid search
+                needs it. Otherwise the client's inline fastembed integration embeds (dense only).
         """
         # Load environment variables
         load_dotenv()
-        
+
         # Initialize the client
-        self.client = QdrantClient(
-            url=os.getenv("QDRANT_URL"), 
-            api_key=os.getenv("QDRANT_API_KEY"),
-        )
+        if client is None:
+            client = QdrantClient(
+                url=os.getenv("QDRANT_URL"),
+                api_key=os.getenv("QDRANT_API_KEY"),
+            )
+        self.client = client
 
-        self.chunk_size = int(os.getenv("CHUNK_SIZE", 10000))
-        self.overlap = int(os.getenv("OVERLAP", 10000))
+        self._chunker = None
+        self.embedding_service = embedding_service
+        if embedding_service is not None:
+            self.sparse_model_name = embedding_service.sparse_model_name
+        else:
+            self.sparse_model_name = os.getenv("SPARSE_EMBEDDING_MODEL", "Qdrant/bm25") or None
+        # whether the collection stores sparse vectors, looked up once (reset by provision)
+        self._has_sparse: Optional[bool] = None
         
         self.collection_name = collection_name
         self.vector_size = vector_size
-        
-        # Commented part is giving error (run 3_claude.py to see the error.)
-        # # Create collection if it doesn't exist
-        # if not self.client.collection_exists(collection_name):
-        #     self.client.create_collection(
-        #         collection_name=collection_name,
-        #         vectors_config=VectorParams(
-        #             size=vector_size, 
-        #             distance=distance
-        #         ),
-        #     )
-    # both text and metadata are lists of same length
+        self.collection_config = collection_config or CollectionConfig()
+        # identical concurrent queries (from different threads) share one search
+        self.query_flights = SingleFlight()
+
+        # Collections are created with the fastembed vector layout by provision() (call it once,
+        # e.g. from a setup script), or with qdrant defaults by the first client.add.
 
+    def provision(self, collection_config: Optional[CollectionConfig] = None) -> Dict:
+        """
+        Create the collection with the configured HNSW / quantization / on-disk layout and
+        payload indexes, or migrate an existing collection to it in place.
+
+        Returns:
+            What was done: {"created", "updated", "indexes_created", "warnings"}
+        """
+        config = collection_config or self.collection_config
+        self.collection_config = config
+        self._has_sparse = None
+        if self.embedding_service is not None:
+            vector_name, vector_params = self.embedding_service.vector_name, self.embedding_service.vector_params()
+        else:
+            vector_name = self.client.get_vector_field_name()
+            vector_params = self.client.get_fastembed_vector_params()[vector_name]
+        sparse_name = sparse_vector_name(self.sparse_model_name) if self.sparse_model_name else None
+
+        created, args, warnings = False, {}, []
+        if not self.client.collection_exists(self.collection_name):
+            sparse_params = SparseVectorParams(modifier=Modifier.IDF if self.sparse_model_name in IDF_EMBEDDING_MODELS else None)
+            self.client.create_collection(
+                collection_name=self.collection_name,
+                **config.create_collection_args(vector_name, vector_params, sparse_name, sparse_params)
+            )
+            created = True
+        else:
+            info = self.client.get_collection(self.collection_name)
+            args = config.migration_args(info, vector_name)
+            if args:
+                self.client.update_collection(collection_name=self.collection_name, **args)
+            if sparse_name and sparse_name not in (info.config.params.sparse_vectors or {}):
+                warnings.append(f"no sparse vectors ({sparse_name}): hybrid search needs the data re-ingested into a new collection")
+
+        indexes = config.missing_payload_indexes(self.client.get_collection(self.collection_name))
+        for field, schema in indexes.items():
+            self.client.create_payload_index(collection_name=self.collection_name, field_name=field, field_schema=schema)
+        return migration_report(created, args, indexes, warnings)
+
+    @property
+    def chunker(self) -> TokenChunker:
+        """Token based chunker using the embedding model's tokenizer (see vector_db/chunking.py)."""
+        if self._chunker is None:
+            if self.embedding_service is not None:
+                tokenizer = self.embedding_service.tokenizer()
+            else:
+                tokenizer = tokenizer_for_client(self.client)
+            self._chunker = TokenChunker(tokenizer=tokenizer)
+        return self._chunker
+
+    # both text and metadata are lists of same length
     def split_long_text(self, texts, metadatas):
         texts_new = []
         metadatas_new = []
-        for text, metadata in zip(texts, metadatas):
-            if len(text) > self.chunk_size:
-                start = 0
-                while start < len(text):
-                    end = start + self.chunk_size
-                    texts_new.append(text[start:end])
-                    metadatas_new.append(metadata)
-                    start += self.chunk_size - self.overlap
-            else:
-                texts_new.append(text)
-                metadatas_new.append(metadata)
+        for chunk, metadata in key_chunks(self.chunker, texts, metadatas):
+            texts_new.append(chunk)
+            metadatas_new.append(metadata)
         return texts_new, metadatas_new
 
     def add_data(self, text: Union[str, List[str]], metadata: Optional[Union[Dict, List[Dict]]] = None, add_metadata=False) -> List:
@@ -73,7 +183,7 @@ class QdrantWrapper:
             add_metadata: Whether to add metadata to the documents
             
         Returns:
-            List of IDs for the added items
+            List of IDs for the added items. Raises DuplicateDocumentError if two documents have the same id.
         """
         # Handle single text and metadata as well as lists
         if isinstance(text, str):
@@ -92,55 +202,132 @@ class QdrantWrapper:
                 
             if len(text) != len(metadata):
                 raise ValueError("Number of text items must match number of metadata items")
-            print(f"\n\nAdding text :{text} \n metadata : {metadata} \n collection_name :{self.collection_name}\n")
+            check_unique_ids(metadata)
+            log_payload("add_data", collection_name=self.collection_name, documents=len(text), text=text, metadata=metadata)
             
             texts, metadatas = self.split_long_text(text, metadata)
-            print(f"\n\nSplitted text :{texts} \n metadata : {metadatas} \n collection_name :{self.collection_name}\n")
+            log_payload("add_data_chunks", collection_name=self.collection_name, chunks=len(texts), texts=texts, metadata=metadatas)
+
+            # Deterministic ids (see vector_db/point_ids.py): adding a document again updates its points,
+            # and chunks whose text didn't change are not embedded again
+            points = [chunk_point(self.collection_name, chunk, meta) for chunk, meta in zip(texts, metadatas)]
+            ids, payloads = [id_ for id_, _ in points], [payload for _, payload in points]
+            to_embed, to_update = list(range(len(ids))), []
+            if ids and self.client.collection_exists(self.collection_name):
+                stored = self.client.retrieve(collection_name=self.collection_name, ids=ids, with_payload=True, with_vectors=False)
+                to_embed, to_update = plan_upsert(ids, payloads, {str(point.id): point.payload for point in stored})
+
+            if to_update:
+                self.client.batch_update_points(
+                    collection_name=self.collection_name,
+                    update_operations=[OverwritePayloadOperation(overwrite_payload=SetPayload(payload=payloads[i], points=[ids[i]])) for i in to_update]
+                )
             # Add document with metadata
-            # Using client.add which handles embedding internally
-            result = self.client.add(
-                collection_name=self.collection_name,
-                documents=texts,
-                metadata=metadatas
-            )
-            
-            return result
+            if to_embed:
+                self._upsert_points([ids[i] for i in to_embed], [texts[i] for i in to_embed], [payloads[i] for i in to_embed])
+
+            chunk_counts: Dict[str, int] = {}
+            count_chunks(chunk_counts, metadatas)
+            if chunk_counts:
+                self.client.delete(collection_name=self.collection_name, points_selector=stale_chunks_filter(chunk_counts))
+
+            # queries started before the change must not answer queries made after it
+            self.query_flights.forget()
+            return ids
     
-    def query(self, text: str, metadata_filter: Optional[Dict] = None, limit: int = 5, use_metadata=False) -> List[Dict]:
+    def _upsert_points(self, ids: List[str], texts: List[str], payloads: List[Dict]):
+        if self.embedding_service is None:
+            # the client embeds inline (dense only), so this includes embedding time
+            with track_stage(QDRANT_UPSERT_SECONDS, "qdrant_upsert", collection=self.collection_name):
+                self.client.add(collection_name=self.collection_name, documents=texts, metadata=payloads, ids=ids)
+            return
+
+        if not self.client.collection_exists(self.collection_name):
+            self.provision()
+        vectors = self.embedding_service.embed_documents_sync(texts)
+        sparse_vectors = self.embedding_service.embed_sparse_sync(texts) if self._has_sparse_vectors() else [None] * len(texts)
+
+        # same point layout as AsyncQdrantWrapper._upsert_points, so both wrappers read each other's data
+        vector_name = self.embedding_service.vector_name
+        sparse_name = self.embedding_service.sparse_vector_name
+        points = [
+            PointStruct(
+                id=id_,
+                vector={vector_name: vector, **({sparse_name: sparse_vector} if sparse_vector is not None else {})},
+                payload=payload
+            )
+            for id_, payload, vector, sparse_vector in zip(ids, payloads, vectors, sparse_vectors)
+        ]
+        with track_stage(QDRANT_UPSERT_SECONDS, "qdrant_upsert", collection=self.collection_name):
+            self.client.upsert(collection_name=self.collection_name, points=points)
+
+    def _has_sparse_vectors(self) -> bool:
+        """
+        Whether the collection stores sparse vectors of the sparse model (collections created
+        before hybrid search was enabled don't). Cached per collection, reset by provision().
+        """
+        if self.embedding_service is None or self.sparse_model_name is None:
+            return False
+        if self._has_sparse is None:
+            if not self.client.collection_exists(self.collection_name):
+                return False
+            sparse_vectors = self.client.get_collection(self.collection_name).config.params.sparse_vectors or {}
+            self._has_sparse = sparse_vector_name(self.sparse_model_name) in sparse_vectors
+        return self._has_sparse
+
+    def _hybrid_search(self, text: str, query_filter: Optional[Filter], limit: int) -> List[QueryResponse]:
+        """
+        Dense + sparse search fused with RRF; falls back to dense search if the collection has no
+        sparse vectors (or there is no embedding service to compute the query's sparse vector).
+        """
+        if not self._has_sparse_vectors():
+            print(f'collection {self.collection_name} has no sparse vectors, using dense search')
+            return strip_internal_fields(self.client.query(collection_name=self.collection_name, query_text=text, query_filter=query_filter, limit=limit))
+
+        dense_vector = self.embedding_service.embed_queries_sync([text])[0]
+        sparse_vector = self.embedding_service.embed_sparse_sync([text], query=True)[0]
+
+        response = self.client.query_points(
+            collection_name=self.collection_name,
+            **hybrid_query_args(dense_vector, self.embedding_service.vector_name, sparse_vector, self.embedding_service.sparse_vector_name, query_filter, limit, self.collection_config.search_params())
+        )
+        return points_to_query_responses(response.points)
+
+    def query(self, text: str, metadata_filter: Optional[Dict] = None, limit: int = 5, use_metadata=False, hybrid: bool = False) -> List[Dict]:
         """
         Query the Qdrant collection for documents matching the query text and optional metadata filter.
         
         Args:
             text: Query text
-            metadata_filter: Optional metadata to filter results (e.g., {"source": "some_source"})
+            metadata_filter: Optional metadata filter (e.g., {"source": "some_source"}, {"views": {"$gt": 100}}, see vector_db/filter_compiler.py)
             limit: Maximum number of results to return
+            hybrid: Fuse dense results with a sparse keyword (SPARSE_EMBEDDING_MODEL, default BM25) search using RRF
             
         Returns:
-            List of dictionaries containing matches with text and metadata
+            List of dictionaries containing matches with text and metadata.
+            Concurrent identical queries share one search and the same result list, don't modify it.
         """
+        key = flight_key(text, metadata_filter if use_metadata else None, limit, use_metadata, hybrid)
+        # the client embeds inline, so this includes embedding time
+        with track_stage(QDRANT_SEARCH_SECONDS, "qdrant_search", collection=self.collection_name, mode="hybrid" if hybrid else "dense"):
+            results, _ = self.query_flights.do(key, lambda: self._query(text, metadata_filter, limit, use_metadata, hybrid))
+        return results
+
+    def _query(self, text: str, metadata_filter: Optional[Dict], limit: int, use_metadata: bool, hybrid: bool) -> List[Dict]:
         if use_metadata:
-            # Prepare filter if metadata is provided
-            query_filter = None
-            if metadata_filter:
-                conditions = []
-                for key, value in metadata_filter.items():
-                    conditions.append(
-                        FieldCondition(
-                            key=key,
-                            match=MatchValue(value=value)
-                        )
-                    )
-                
-                if conditions:
-                    query_filter = Filter(must=conditions)
+            # Compile the filter if metadata is provided (see vector_db/filter_compiler.py for the syntax)
+            query_filter = compile_filter(metadata_filter)
             
             # Query the collection
-            search_results = self.client.query(
-                collection_name=self.collection_name,
-                query_text=text,
-                query_filter=query_filter,
-                limit=limit
-            )
+            if hybrid:
+                search_results = self._hybrid_search(text, query_filter, limit)
+            else:
+                search_results = strip_internal_fields(self.client.query(
+                    collection_name=self.collection_name,
+                    query_text=text,
+                    query_filter=query_filter,
+                    limit=limit
+                ))
             
             # Format results
             results = []
@@ -155,11 +342,13 @@ class QdrantWrapper:
             return results
         else:
             # Query the collection
-            search_results = self.client.query(
+            if hybrid:
+                return self._hybrid_search(text, None, limit)
+            search_results = strip_internal_fields(self.client.query(
                 collection_name=self.collection_name,
                 query_text=text,
                 limit=limit
-            )
+            ))
             '''
             Example search_results
             [QueryResponse(id='f94156eb-9570-4e69-80bd-20248d6b39d2', embedding=None, sparse_embedding=None, metadata={'document': 'Another example text'}, document='Another example text', score=0.9478686), QueryResponse(id='0f2a3c3e-e49a-4684-a18a-edbeee8583e7', embedding=None, sparse_embedding=None, metadata={'document': 'This is a sample document'}, document='This is a sample document', score=0.8736136)]
@@ -177,21 +366,13 @@ class QdrantWrapper:
         Returns:
             True if operation was successful
         """
-        conditions = []
-        for key, value in metadata_filter.items():
-            conditions.append(
-                FieldCondition(
-                    key=key,
-                    match=MatchValue(value=value)
-                )
-            )
-        
-        if conditions:
-            delete_filter = Filter(must=conditions)
+        delete_filter = compile_filter(metadata_filter)
+        if delete_filter:
             self.client.delete(
                 collection_name=self.collection_name,
                 points_selector=delete_filter
             )
+            self.query_flights.forget()
             return True
         
         return False
@@ -215,20 +396,8 @@ class QdrantWrapper:
         Returns:
             Number of documents
         """
-        query_filter = None
-        if metadata_filter:
-            conditions = []
-            for key, value in metadata_filter.items():
-                conditions.append(
-                    FieldCondition(
-                        key=key,
-                        match=MatchValue(value=value)
-                    )
-                )
-            
-            if conditions:
-                query_filter = Filter(must=conditions)
-        
+        query_filter = compile_filter(metadata_filter)
+
         return self.client.count(
             collection_name=self.collection_name,
             count_filter=query_filter